@@ -0,0 +1,456 @@
+"""
+This module fetches the Google Calendar from a background thread, so a slow or
+dead API never delays a lock or unlock. Each fetch runs with a hard deadline:
+a request still hanging at the deadline is abandoned together with its connection and
+cache, and the next fetch starts from a fresh service.
+Each calendar is refreshed at its own pace, from its known bookings (see refreshPolicy),
+within a daily budget and backing off when Google throttles or fails.
+The Google client stack (googleCalendar) is only imported by the fetcher thread,
+so the daemon locks the screens at boot without waiting for it.
+A reloaded configuration is applied by the fetcher thread between two fetches: the
+calendar client and the push notifications are only restarted if their settings changed.
+The latest schedule is published as an immutable Schedule the enforcement loop
+reads without locking.
+"""
+
+import time
+import threading
+from typing import Any, Callable, NamedTuple, Optional
+from config import CALENDAR_CLIENT_SUBSYSTEM, CALENDARS_SUBSYSTEM, PUSH_SUBSYSTEM, REFRESH_SUBSYSTEM, Config
+from metrics import calendarApiErrors
+from notifications import PushNotifier
+from refreshPolicy import BURST, Backoff, TokenBucket, refreshInterval, retryable
+from scheduler import Booking
+from snapshot import saveSnapshot
+
+# safety net refresh when push notifications are working
+PUSH_REFRESH_INTERVAL = 5 * 60
+# a fetch (service build included) still running after this many seconds is abandoned
+FETCH_DEADLINE = 15
+# calendars due within this many seconds are refreshed together, in the same batch request
+COALESCE_WINDOW = 10
+
+# fetchWithDeadline failures
+TIMEOUT_FAILURE = "timeout"
+THROTTLED_FAILURE = "throttled"
+# no HTTP answer: network down, DNS failure, connection refused or reset
+UNREACHABLE_FAILURE = "unreachable"
+ERROR_FAILURE = "error"
+
+
+class Schedule(NamedTuple):
+    calendars: dict[str, tuple[Booking, ...]]  # bookings by calendar ID, never modified once published
+    fetchedAt: float  # epoch seconds, 0 if never fetched
+    stale: bool  # True if the last fetch failed or the schedule comes from the snapshot
+
+
+class CalendarFetcher:
+    """
+    Background thread keeping the published schedule up to date.
+    """
+
+    def __init__(self, cfg: Config, initial: Schedule, onPublish: Callable[[Schedule], None],
+                 serviceFactory: Optional[Callable[[], Any]] = None, deadline: float = FETCH_DEADLINE,
+                 snapshotFile: Optional[str] = None):
+        self.cfg: Config = cfg
+        self.schedule: Schedule = initial
+        self.onPublish: Callable[[Schedule], None] = onPublish
+        self.serviceFactory: Callable[[], Any] = (
+            serviceFactory if serviceFactory is not None else self.buildService)
+        self.deadline: float = deadline
+        self.snapshotFile: Optional[str] = snapshotFile
+        self.calendarService: Any = None
+        # attempt of fetchWithDeadline owning the calendar service: an abandoned attempt cannot install the service
+        # it was still building at its deadline
+        self.generation: int = 0
+        self.pushNotifier: Optional[PushNotifier] = None
+        self.refreshRequested: threading.Event = threading.Event()
+        # epoch seconds of the next refresh of each calendar
+        self.nextRefresh: dict[str, float] = {}
+        self.budget: TokenBucket = self.createBudget()
+        # subsystems changed by a reloaded configuration, applied by the fetcher thread
+        self.pendingChanges: set[str] = set()
+        self.lock: threading.Lock = threading.Lock()
+        self.backoff: Backoff = Backoff()
+        self.backoffUntil: float = 0
+        self.running: bool = True
+        self.thread: threading.Thread = threading.Thread(target=self.run, name="calendarFetcher", daemon=True)
+
+    def createBudget(self) -> TokenBucket:
+        calendars: int = len(self.cfg.calendarIds())
+        return TokenBucket(BURST * calendars, self.cfg.refreshDailyBudget * calendars / 86400)
+
+    def startPush(self) -> None:
+        if self.cfg.webhookUrl:
+            self.pushNotifier = PushNotifier(
+                self.cfg.calendarIds(), self.cfg.webhookUrl, self.cfg.receiverPort, self.requestRefresh, self.cfg.verbose)
+
+    def start(self) -> None:
+        self.startPush()
+        self.thread.start()
+
+    def reconfigure(self, cfg: Config, subsystems: set[str]) -> None:
+        """
+        Swap a reloaded configuration in. The changed subsystems are restarted by the fetcher thread
+        before its next fetch, which covers every calendar if the calendar settings changed.
+        """
+        self.cfg = cfg
+        changes: set[str] = subsystems & {CALENDAR_CLIENT_SUBSYSTEM, CALENDARS_SUBSYSTEM, PUSH_SUBSYSTEM, REFRESH_SUBSYSTEM}
+        if changes:
+            with self.lock:
+                self.pendingChanges |= changes
+            self.requestRefresh()
+
+    def applyConfig(self) -> None:
+        """
+        Restart the subsystems changed by a reloaded configuration (fetcher thread).
+        """
+        with self.lock:
+            changes: set[str] = self.pendingChanges
+            self.pendingChanges = set()
+        if not changes:
+            return
+        from googleCalendar import resetSchedule
+
+        # the channels are stopped with the former client, before it is dropped
+        if changes & {CALENDAR_CLIENT_SUBSYSTEM, CALENDARS_SUBSYSTEM, PUSH_SUBSYSTEM}:
+            if self.pushNotifier is not None:
+                self.pushNotifier.stop(self.calendarService)
+                self.pushNotifier = None
+            self.startPush()
+        if CALENDAR_CLIENT_SUBSYSTEM in changes:
+            print("Calendar client settings changed, building a new client.")
+            self.calendarService = None
+            resetSchedule()
+        if changes & {CALENDARS_SUBSYSTEM, REFRESH_SUBSYSTEM}:
+            self.budget = self.createBudget()
+            calendarIds: list[str] = self.cfg.calendarIds()
+            self.nextRefresh = {
+                calendarId: refresh for calendarId, refresh in self.nextRefresh.items() if calendarId in calendarIds
+            }
+
+    def stop(self) -> None:
+        self.running = False
+        self.refreshRequested.set()
+
+    def requestRefresh(self) -> None:
+        """
+        Fetch as soon as possible, e.g. when a push notification reports a change.
+        """
+        self.refreshRequested.set()
+
+    def buildService(self) -> Any:
+        from googleCalendar import getCalendarService
+        return getCalendarService(self.cfg, retry=False)
+
+    def run(self) -> None:
+        # imported here, off the boot path, and before the first fetch deadline starts
+        import googleCalendar
+
+        # the first refresh and the requested ones cover every calendar
+        requested: bool = True
+        while self.running:
+            requested = requested or self.refreshRequested.is_set()
+            self.refreshRequested.clear()
+            self.applyConfig()
+            now: float = time.time()
+            due: list[str] = self.dueCalendars(now, requested)
+            wait: float = max(self.backoffUntil - now, 0)
+            if due and wait == 0:
+                wait = self.budget.take(len(due))
+                if wait == 0:
+                    requested = False
+                    self.planRefresh(due, self.fetchWithDeadline(due))
+                    continue
+                if (self.cfg.verbose):
+                    print(f"Calendar refresh budget spent, next refresh in {wait:.0f} s")
+            elif not due:
+                wait = min(self.nextRefresh.values()) - now
+            self.refreshRequested.wait(max(wait, 0))
+
+    def dueCalendars(self, now: float, requested: bool) -> list[str]:
+        """
+        The calendars to refresh now: all of them if requested, otherwise those due within COALESCE_WINDOW.
+        """
+        return [
+            calendarId for calendarId in self.cfg.calendarIds()
+            if requested or self.nextRefresh.get(calendarId, 0) <= now + COALESCE_WINDOW
+        ]
+
+    def planRefresh(self, refreshed: list[str], failure: Optional[str]) -> None:
+        """
+        Plan the next refresh of the calendars just refreshed: from their bookings after a success,
+        after an exponential backoff of every calendar if Google throttled, failed or could not be reached,
+        at the shortest interval after another HTTP error (400, 404...).
+        """
+        now: float = time.time()
+        if failure in (THROTTLED_FAILURE, TIMEOUT_FAILURE, UNREACHABLE_FAILURE):
+            delay: float = self.backoff.failure()
+            print(f"Calendar API {failure}, backing off for {delay:.0f} s")
+            self.backoffUntil = now + delay
+            for calendarId in self.cfg.calendarIds():
+                self.nextRefresh[calendarId] = max(self.nextRefresh.get(calendarId, 0), self.backoffUntil)
+            return
+        if failure is not None:
+            for calendarId in refreshed:
+                self.nextRefresh[calendarId] = now + self.cfg.refreshMinSeconds
+            return
+
+        self.backoff.reset()
+        pushed: bool = self.pushNotifier is not None and self.pushNotifier.healthy()
+        for calendarId in refreshed:
+            interval: float = refreshInterval(
+                [self.schedule.calendars.get(calendarId, ())], now, self.cfg.refreshMinSeconds, self.cfg.refreshMaxSeconds)
+            if pushed:
+                interval = max(interval, PUSH_REFRESH_INTERVAL)
+            self.nextRefresh[calendarId] = now + interval
+        if (self.cfg.verbose):
+            print(f"Next calendar refresh in {min(self.nextRefresh.values()) - now:.0f} s")
+
+    def fetchWithDeadline(self, calendarIds: Optional[list[str]] = None) -> Optional[str]:
+        """
+        Run one fetch of the given calendars (all by default) in its own thread and wait for it
+        at most self.deadline seconds. Returns None on success, otherwise the kind of failure.
+        """
+        from googleCalendar import resetSchedule
+
+        with self.lock:
+            self.generation += 1
+            generation: int = self.generation
+        # the bookings and the HTTP status of a failure, of this attempt only
+        result: list[tuple[Optional[dict[str, list[Booking]]], int]] = [(None, 0)]
+        worker = threading.Thread(
+            target=lambda: result.__setitem__(0, self.fetch(generation, calendarIds)), name="calendarRequest", daemon=True)
+        started: float = time.monotonic()
+        worker.start()
+        worker.join(self.deadline)
+
+        if worker.is_alive():
+            print(f"Calendar request still running after {self.deadline} s. Abandoning it.")
+            calendarApiErrors.inc(kind="timeout")
+            # the hung request keeps its own service and cache, the next fetch starts clean
+            with self.lock:
+                self.generation += 1
+                self.calendarService = None
+            resetSchedule()
+            self.publishFailure()
+            return TIMEOUT_FAILURE
+
+        calendars, status = result[0]
+        if calendars is None:
+            self.publishFailure()
+            if status == 0:
+                return UNREACHABLE_FAILURE
+            return THROTTLED_FAILURE if retryable(status) else ERROR_FAILURE
+
+        if (self.cfg.verbose):
+            print(f"Calendar fetched in {(time.monotonic() - started) * 1000:.0f} ms")
+        if self.schedule.stale:
+            print("Calendar schedule is up to date.")
+        frozen: dict[str, tuple[Booking, ...]] = {calendarId: tuple(bookings) for calendarId, bookings in calendars.items()}
+        self.publish(Schedule(frozen, time.time(), False))
+        try:
+            saveSnapshot(calendars, self.schedule.fetchedAt, self.cfg.snapshotHours, self.snapshotFile)
+        except Exception as e:
+            print(f"Error saving schedule snapshot: {e}")
+        return None
+
+    def fetch(self, generation: int,
+              calendarIds: Optional[list[str]] = None) -> tuple[Optional[dict[str, list[Booking]]], int]:
+        """
+        Build the service if needed, keep the push channels alive, refresh the given calendars
+        (all by default) and return the bookings of every calendar, None on any error, and the HTTP
+        status of the failure. The service built is kept only if the attempt was not abandoned meanwhile.
+        """
+        from googleCalendar import getBookings, lastChangedEvents
+
+        calendarService: Any = self.calendarService
+        if calendarService is None:
+            calendarService = self.serviceFactory()
+            if calendarService is None:
+                return None, 0
+            with self.lock:
+                if generation == self.generation:
+                    self.calendarService = calendarService
+
+        if self.pushNotifier is not None:
+            self.pushNotifier.renew(calendarService)
+
+        calendars, status = getBookings(self.cfg, calendarService, calendarIds)
+        if calendars is not None and self.pushNotifier is not None:
+            self.pushNotifier.reportPolledChanges(lastChangedEvents())
+        return calendars, status
+
+    def publishFailure(self) -> None:
+        """
+        Keep the last known schedule, marked as stale.
+        """
+        if not self.schedule.stale:
+            print("Calendar unavailable, using the last known schedule.")
+            self.publish(self.schedule._replace(stale=True))
+        elif (self.cfg.verbose):
+            print(f"Schedule is stale, fetched {(time.time() - self.schedule.fetchedAt) / 60:.0f} minutes ago.")
+
+    def publish(self, schedule: Schedule) -> None:
+        # a single reference assignment: readers always see a complete schedule
+        self.schedule = schedule
+        self.onPublish(schedule)
+
+
+# test module
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import httplib2
+    from datetime import datetime, timedelta, timezone
+    from googleapiclient.errors import HttpError
+
+    class FakeRequest:
+        def __init__(self, service: "FakeCalendarService"):
+            self.service = service
+
+        def execute(self) -> dict[str, Any]:
+            time.sleep(self.service.latency)
+            if self.service.hang:
+                threading.Event().wait()
+            if self.service.error is not None:
+                raise self.service.error
+            if self.service.status:
+                raise HttpError(httplib2.Response({"status": self.service.status}), b"{}")
+            now = datetime.now(timezone.utc)
+            return {"items": [{
+                "id": "a", "status": "confirmed", "summary": "booking",
+                "start": {"dateTime": (now + timedelta(minutes=30)).isoformat()},
+                "end": {"dateTime": (now + timedelta(minutes=45)).isoformat()},
+            }], "nextSyncToken": "1"}
+
+    class FakeCalendarService:
+        """
+        Stand-in for the Google Calendar service with a configurable latency, or hanging forever.
+        """
+
+        def __init__(self):
+            self.latency: float = 0
+            self.hang: bool = False
+            self.status: int = 0
+            self.error: Optional[Exception] = None
+
+        def events(self) -> "FakeCalendarService":
+            return self
+
+        def list(self, **query: Any) -> FakeRequest:
+            return FakeRequest(self)
+
+    published: list[Schedule] = []
+    publishedEvent = threading.Event()
+
+    def onPublish(schedule: Schedule) -> None:
+        published.append(schedule)
+        publishedEvent.set()
+
+    def waitPublished() -> Schedule:
+        assert publishedEvent.wait(5)
+        publishedEvent.clear()
+        return published[-1]
+
+    service = FakeCalendarService()
+    cfg = Config(calendarId="test")
+    snapshotFile = os.path.join(tempfile.mkdtemp(), "schedule.json")
+    fetcher = CalendarFetcher(cfg, Schedule({}, 0, True), onPublish, lambda: service, deadline=0.5,
+                              snapshotFile=snapshotFile)
+    # the fetcher thread is driven by hand
+    assert fetcher.fetchWithDeadline() is None
+    schedule = waitPublished()
+    assert not schedule.stale and len(schedule.calendars["test"]) == 1
+    assert os.path.exists(snapshotFile)
+
+    # next refresh halfway to the unlock, 25 minutes away
+    fetcher.planRefresh(["test"], None)
+    assert 740 < fetcher.nextRefresh["test"] - time.time() <= 750
+
+    # throttled: every calendar backs off, more at each failure in a row
+    service.status = 429
+    assert fetcher.fetchWithDeadline() == THROTTLED_FAILURE
+    assert waitPublished().stale
+    delays = []
+    for _ in range(3):
+        fetcher.planRefresh(["test"], THROTTLED_FAILURE)
+        delays.append(fetcher.backoffUntil - time.time())
+    assert 9 < delays[0] <= 20 and 19 < delays[1] <= 40 and 39 < delays[2] <= 80, delays
+    assert fetcher.dueCalendars(time.time(), False) == []
+    service.status = 404
+    assert fetcher.fetchWithDeadline() == ERROR_FAILURE
+    service.status = 0
+
+    # no answer at all (network down): backs off too, reset by the first success
+    fetcher.fetchWithDeadline()
+    fetcher.planRefresh(["test"], None)
+    service.error = ConnectionError("Connection refused")
+    backoffs = []
+    for _ in range(3):
+        failure = fetcher.fetchWithDeadline()
+        assert failure == UNREACHABLE_FAILURE, failure
+        fetcher.planRefresh(["test"], failure)
+        backoffs.append(fetcher.backoffUntil - time.time())
+    assert 9 < backoffs[0] <= 20 and 19 < backoffs[1] <= 40 and 39 < backoffs[2] <= 80, backoffs
+    assert fetcher.nextRefresh["test"] >= fetcher.backoffUntil
+    service.error = None
+    assert fetcher.fetchWithDeadline() is None
+    fetcher.planRefresh(["test"], None)
+    assert fetcher.backoff.failures == 0
+
+    # a slow request within the deadline is fine
+    service.latency = 0.2
+    fetcher.fetchWithDeadline()
+    assert not fetcher.schedule.stale
+
+    # a hanging request is abandoned at the deadline and the last schedule is kept as stale
+    service.hang = True
+    start = time.monotonic()
+    assert fetcher.fetchWithDeadline() == TIMEOUT_FAILURE
+    elapsed = time.monotonic() - start
+    schedule = waitPublished()
+    assert schedule.stale and len(schedule.calendars["test"]) == 1
+    assert elapsed < 1, elapsed
+    assert fetcher.calendarService is None
+
+    # the next fetch builds a fresh service and recovers
+    service.hang = False
+    service.latency = 0
+    fetcher.fetchWithDeadline()
+    schedule = waitPublished()
+    assert not schedule.stale
+
+    # a service still being built when its attempt was abandoned is not installed over the one of the next attempt
+    release = threading.Event()
+    abandonedService = FakeCalendarService()
+    factories = [lambda: release.wait() and abandonedService, lambda: service]
+    fetcher.serviceFactory = lambda: factories.pop(0)()
+    fetcher.calendarService = None
+    assert fetcher.fetchWithDeadline() == TIMEOUT_FAILURE
+    waitPublished()
+    assert fetcher.fetchWithDeadline() is None and fetcher.calendarService is service
+    waitPublished()
+    release.set()
+    time.sleep(0.2)
+    assert fetcher.calendarService is service
+    fetcher.serviceFactory = lambda: service
+
+    # a reloaded configuration: a new client for a new key, a new budget for the new calendars
+    assert fetcher.calendarService is service
+    budget = fetcher.budget
+    fetcher.reconfigure(Config(calendarId="test", serviceAccountJsonPath="other.json"), {CALENDAR_CLIENT_SUBSYSTEM})
+    assert fetcher.refreshRequested.is_set()
+    fetcher.refreshRequested.clear()
+    fetcher.applyConfig()
+    assert fetcher.calendarService is None and fetcher.budget is budget
+    fetcher.reconfigure(Config(calendarId="other"), {CALENDARS_SUBSYSTEM})
+    fetcher.refreshRequested.clear()
+    fetcher.applyConfig()
+    assert fetcher.budget is not budget and fetcher.nextRefresh == {}
+    assert fetcher.dueCalendars(time.time(), False) == ["other"]
+    fetcher.reconfigure(Config(calendarId="other", verbose=True), set())
+    assert fetcher.cfg.verbose and not fetcher.refreshRequested.is_set()
+
+    print("Calendar fetcher test finished.")
+    print()
@@ -1,12 +1,17 @@
 
 import os
+import sys
 import time
+import shutil
+import threading
 import subprocess
 import psutil
 from enum import Enum
-from config import Config
+from config import DEFAULT_BAY_NAME, BayConfig, Config
 from typing import Optional
-from win32 import ensureWindowOnTop
+from scheduler import DisplayState
+from windowManager import WindowManager, getWindowManager
+from metrics import chromeLaunchSeconds, chromeRecycles, chromeRespawns
 
 
 class MessageType(Enum):
@@ -15,6 +20,13 @@ class MessageType(Enum):
     boot = "boot"
 
 
+# page displayed by each locked state
+STATE_MESSAGES: dict[DisplayState, MessageType] = {
+    DisplayState.timesUp: MessageType.timesUp,
+    DisplayState.backToBack: MessageType.backToback,
+    DisplayState.padlock: MessageType.boot,
+}
+
 # Chrome kiosk mode command
 kioskCommand: list[str] = [
     "--kiosk",
@@ -30,114 +42,527 @@ kioskCommand: list[str] = [
     "--disable-features=TranslateUI"
 ]
 
-chromeProfile1: Optional[str] = None
-chromeProfile2: Optional[str] = None
+# user-data directories of the kiosk windows of each bay
+chromeProfiles: dict[str, list[str]] = {}
+# the two sets of user-data directories of each bay: the windows are recycled from one set to the other
+profileSets: dict[str, tuple[list[str], list[str]]] = {}
+# index in profileSets of the set in use by each bay
+activeProfileSets: dict[str, int] = {}
+# caches of a user-data directory, pruned while no window uses it (relative paths)
+PROFILE_CACHE_DIRS = (
+    "GrShaderCache", "GraphiteDawnCache", "ShaderCache", "Crashpad/reports", "Default/Cache", "Default/Code Cache",
+    "Default/GPUCache", "Default/DawnGraphiteCache", "Default/DawnWebGPUCache", "Default/Service Worker/CacheStorage",
+)
+
+# delay before relaunching a kiosk window that exited by itself
+RESPAWN_DELAY = 0.5
+# a window exiting faster than this after its launch counts as a failed launch
+MIN_UPTIME = 3
+# stop relaunching after this many failed launches in a row
+MAX_FAILED_LAUNCHES = 5
+# seconds a launch waits for its windows to be shown before bringing them on top anyway
+READY_TIMEOUT = 20
 
 
-def killChrome(cfg: Config) -> None:
+class KioskWindow:
     """
-    Kill all Chrome processes, if any are running.
+    A Chrome instance launched by the controller and the arguments to launch it again.
     """
 
-    if (cfg.verbose):
-        print("killChrome() called")
+    def __init__(self, windowArgs: list[str], process: subprocess.Popen):
+        self.windowArgs: list[str] = windowArgs
+        self.process: subprocess.Popen = process
+        self.launchTime: float = time.monotonic()
+        self.failedLaunches: int = 0
 
-    alreadyLogged = False
-    try:
-        for process in psutil.process_iter(attrs=["pid", "name"]):
-            if "chrome" in process.info["name"].lower():
 
+class ChromeController:
+    """
+    Owns the Chrome processes it launched: liveness is checked on the Popen handles
+    instead of scanning every process of the system, only the launched process trees
+    are terminated, and a watcher thread per window relaunches it if it exits by itself.
+    """
+
+    def __init__(self):
+        self.windows: list[KioskWindow] = []
+        self.chromePath: str = ""
+        self.windowName: str = "Chrome"
+        self.bayTag: str = ""
+        self.animation: str = ""
+        self.pageUrl: Optional[str] = None
+        self.msgType: MessageType = MessageType.boot
+        self.visible: bool = True
+        self.verbose: bool = False
+        self.windowManager: Optional[WindowManager] = None
+        self.respawns: int = 0
+        self.lock: threading.RLock = threading.RLock()
+
+    def isRunning(self) -> bool:
+        with self.lock:
+            return any(window.process.poll() is None for window in self.windows)
+
+    def pids(self) -> list[int]:
+        with self.lock:
+            return [window.process.pid for window in self.windows if window.process.poll() is None]
+
+    def launch(self, command: list[str], windowArgs: list[str]) -> KioskWindow:
+        """
+        Start a process and watch it. windowArgs are kept to relaunch the window.
+        """
+        window = KioskWindow(windowArgs, subprocess.Popen(command))
+        with self.lock:
+            self.windows.append(window)
+        threading.Thread(target=self.watch, args=(window,), name=f"chromeWatcher{window.process.pid}", daemon=True).start()
+        return window
+
+    def start(self, cfg: Config, msgType: MessageType, windowsArgs: list[list[str]], windowName: str) -> None:
+        with self.lock:
+            self.chromePath = cfg.chromePath
+            self.windowName = windowName
+            self.verbose = cfg.verbose
+            self.msgType = msgType
+            self.windowManager = getWindowManager(cfg)
+            # Popen returns once the process is spawned: the windows boot in parallel. Each window keeps its own
+            # process: a second launch on the same user-data directory is handed over to the running browser,
+            # which ignores its --window-position, and its launcher exits at once, for the watcher to relaunch it
+            for windowArgs in windowsArgs:
+                self.launch(self.command(windowArgs, msgType), windowArgs)
+
+    def command(self, windowArgs: list[str], msgType: MessageType) -> list[str]:
+        url: str = self.pageUrl if self.pageUrl is not None else displayUrl(msgType, self.bayTag, self.animation)
+        return [self.chromePath] + kioskCommand + windowArgs + [url]
+
+    def watch(self, window: KioskWindow) -> None:
+        """
+        Wait for the window process to exit and relaunch it, unless it was stopped by the controller.
+        """
+        window.process.wait()
+        time.sleep(RESPAWN_DELAY)
+
+        with self.lock:
+            if window not in self.windows:
+                return
+            self.windows.remove(window)
+
+            failedLaunches: int = window.failedLaunches + 1 if time.monotonic() - window.launchTime < MIN_UPTIME else 0
+            if failedLaunches >= MAX_FAILED_LAUNCHES:
+                print(f"Chrome kiosk window exited {failedLaunches} times right after its launch. Not relaunching it.")
+                return
+
+            print(f"Chrome kiosk window exited (code {window.process.returncode}). Relaunching it.")
+            try:
+                # on the message it was started with: startChrome does nothing while the other windows run
+                relaunched: KioskWindow = self.launch(self.command(window.windowArgs, self.msgType), window.windowArgs)
+                relaunched.failedLaunches = failedLaunches
+                self.respawns += 1
+                chromeRespawns.inc()
+            except Exception as e:
+                print(f"Error relaunching Chrome: {e}")
+                return
+
+        # the relaunched window has a new handle
+        self.showWhenReady(relaunched.launchTime)
+
+    def showWhenReady(self, launched: float) -> None:
+        """
+        From a background thread: wait for every kiosk window to be shown, then bring them
+        on top, or minimize them if the controller was hidden meanwhile (warm standby).
+        """
+        def show() -> None:
+            with self.lock:
+                windowManager: Optional[WindowManager] = self.windowManager
+                count: int = len(self.windows)
+            if windowManager is None:
+                return
+            if windowManager.waitForWindows(self.windowName, count, READY_TIMEOUT):
+                chromeLaunchSeconds.observe(time.monotonic() - launched)
+            elif (self.verbose):
+                print(f"{self.windowName} windows not shown {READY_TIMEOUT} s after their launch.")
+            if self.visible:
+                windowManager.ensureOnTop(self.windowName, self.verbose)
+            else:
+                windowManager.minimize(self.windowName, self.verbose)
+
+        threading.Thread(target=show, name="chromeReady", daemon=True).start()
+
+    def release(self) -> None:
+        """
+        Stop watching the launched windows and leave them running, for another process to take them over.
+        """
+        with self.lock:
+            self.windows = []
+
+    def stop(self) -> bool:
+        """
+        Terminate the process trees launched by the controller. Returns True if any was running.
+        """
+        with self.lock:
+            windows, self.windows = self.windows, []
+
+        processes: list[psutil.Process] = []
+        for window in windows:
+            if window.process.poll() is not None:
+                continue
+            try:
+                parent = psutil.Process(window.process.pid)
+                processes += parent.children(recursive=True) + [parent]
+            except psutil.NoSuchProcess:
+                pass
+
+        for process in processes:
+            try:
+                if (self.verbose):
+                    print(f"Terminating Chrome process {process.pid}")
+                process.terminate()
+            except psutil.NoSuchProcess:
+                pass
+        _, alive = psutil.wait_procs(processes, timeout=3)
+        for process in alive:
+            try:
+                process.kill()
+            except psutil.NoSuchProcess:
+                pass
+        return len(processes) > 0
+
+
+# one controller per bay
+chromeControllers: dict[str, ChromeController] = {}
+
+
+def bayController(bay: BayConfig) -> ChromeController:
+    if bay.name not in chromeControllers:
+        chromeControllers[bay.name] = ChromeController()
+    return chromeControllers[bay.name]
+
+
+def bayTag(cfg: Config, bay: BayConfig) -> str:
+    """
+    The bay name shown in the page title to tell the windows of the bays apart, empty with a single bay.
+    """
+    return bay.name if len(cfg.bays) > 1 else ""
+
+
+def bayWindowName(cfg: Config, bay: BayConfig) -> str:
+    """
+    The window title substring matching the kiosk windows of the bay, and only them.
+    """
+    tag: str = bayTag(cfg, bay)
+    return f"[{tag}]" if tag else cfg.chromeWindowName
+
+
+def animationQuery(cfg: Config) -> str:
+    """
+    The padlock animation settings, as query parameters of the page.
+    """
+    return f"fps={cfg.padlockFps:g}&idle={cfg.padlockIdleMinutes * 60:g}&idleFps={cfg.padlockIdleFps:g}"
+
+
+def displayUrl(msgType: MessageType, bay: str = "", animation: str = "") -> str:
+    currentPath = os.path.dirname(os.path.realpath(__file__))
+    url: str = f"file:///{currentPath}/display.html?msg={msgType.value}"
+    if bay:
+        url += f"&bay={bay}"
+    return f"{url}&{animation}" if animation else url
+
+
+def killStrayChrome(cfg: Config) -> None:
+    """
+    Kill the kiosk Chrome processes left by a previous run of the daemon,
+    recognized by their user-data-dir. Other Chrome based apps are left alone.
+    """
+    profiles: list[str] = [
+        os.path.realpath(profile) for bayProfiles in profileSets.values() for profiles in bayProfiles for profile in profiles
+    ]
+    try:
+        strayProcesses: list[psutil.Process] = []
+        for process in psutil.process_iter(attrs=["pid", "name", "cmdline"]):
+            cmdline: list[str] = process.info["cmdline"] or []
+            if any(argument.startswith("--user-data-dir=") and
+                   os.path.realpath(argument.split("=", 1)[1]) in profiles for argument in cmdline):
                 if (cfg.verbose):
-                    print(f"Terminating Chrome process {process.info['name']} with PID {process.info['pid']}")
+                    print(f"Terminating stray Chrome process {process.info['name']} with PID {process.info['pid']}")
+                process.terminate()
+                strayProcesses.append(process)
+        # the profiles must be released before a new instance uses them
+        psutil.wait_procs(strayProcesses, timeout=5)
+    except Exception as e:
+        print(f"Error killing stray Chrome processes: {e}")
+
+
+def killChrome(cfg: Config, bay: BayConfig) -> None:
+    """
+    Kill the Chrome processes launched by the screen blocker for the bay, if any are running.
+    """
+
+    if (cfg.verbose):
+        print(f"killChrome() called for bay {bay.name}")
 
-                psutil.Process(process.info["pid"]).terminate()
-                if not alreadyLogged:
-                    print("Chrome processes found. Terminating...")
-                    alreadyLogged = True
+    try:
+        if bayController(bay).stop():
+            print("Chrome processes found. Terminating...")
     except Exception as e:
         print(f"Error killing Chrome processes: {e}")
 
 
-def startChrome(cfg: Config, msgType: MessageType) -> None:
+def windowsArguments(bay: BayConfig, profiles: list[str]) -> list[list[str]]:
+    """
+    The position and user-data directory arguments of each kiosk window of the bay.
+    """
+    windowsArgs: list[list[str]] = []
+    for position, profile in zip(bay.windowPositions, profiles):
+        windowArgs: list[str] = [f"--window-position={position}"] if position else []
+        windowsArgs.append(windowArgs + [f"--user-data-dir={profile}"])
+    return windowsArgs
+
+
+def startChrome(cfg: Config, bay: BayConfig, msgType: MessageType, url: Optional[str] = None) -> None:
     """
-    Start Chrome in kiosk mode. If cfg.dualScreen is True, launch two instances
-    otherwise, launch one.
+    Start Chrome in kiosk mode, one instance per window position of the bay.
+    The page URL is built from msgType unless url is given.
     """
     if cfg.verbose:
-        print("startChrome() called")
+        print(f"startChrome() called for bay {bay.name}")
 
+    chromeController: ChromeController = bayController(bay)
     # Do not start if Chrome it's already running
+    if chromeController.isRunning():
+        return
+
+    print(f"Starting Chrome in kiosk mode. Message type: {msgType.value} | bay: {bay.name} "
+          f"| windows: {len(bay.windowPositions)}")
+
+    chromeController.pageUrl = url
+    chromeController.bayTag = bayTag(cfg, bay)
+    chromeController.animation = animationQuery(cfg)
+    if cfg.verbose:
+        print(f"URL: {url if url is not None else displayUrl(msgType, chromeController.bayTag, chromeController.animation)}")
+
+    launched: float = time.monotonic()
     try:
-        for process in psutil.process_iter(attrs=["pid", "name"]):
-            if "chrome" in process.info["name"].lower():
-                return
+        chromeController.start(cfg, msgType, windowsArguments(bay, chromeProfiles[bay.name]), bayWindowName(cfg, bay))
     except Exception as e:
-        print(f"Error checking Chrome processes: {e}")
+        print(f"Error starting Chrome: {e}")
 
-    print(f"Starting Chrome in kiosk mode. Message type: {msgType.value} | dual screen: {cfg.dualScreen}")
+    # brought on top as soon as the windows are shown: the other bays are not kept waiting
+    chromeController.showWhenReady(launched)
 
-    currentPath = os.path.dirname(os.path.realpath(__file__))
-    url = f"file:///{currentPath}/display.html?msg={msgType.value}"
-    if cfg.verbose:
-        print(f"URL: {url}")
 
-    if cfg.dualScreen:
-        try:
-            subprocess.Popen(
-                [cfg.chromePath] +
-                kioskCommand +
-                ["--window-position=9999,0", f"--user-data-dir={chromeProfile1}", url]
-            )
-            subprocess.Popen(
-                [cfg.chromePath] +
-                kioskCommand +
-                ["--window-position=0,0", f"--user-data-dir={chromeProfile2}", url]
-            )
-        except Exception as e:
-            print(f"Error starting dual-screen Chrome: {e}")
+def setChromeVisible(cfg: Config, bay: BayConfig, visible: bool) -> None:
+    """
+    Show (on top of everything) or minimize the resident kiosk windows of the bay, for the warm standby mode.
+    """
+    bayController(bay).visible = visible
+    if visible:
+        getWindowManager(cfg).ensureOnTop(bayWindowName(cfg, bay), cfg.verbose)
     else:
+        getWindowManager(cfg).minimize(bayWindowName(cfg, bay), cfg.verbose)
+
+
+def createChromeUserProfiles(cfg: Config) -> None:
+    """
+    Create separate user-data directories for each Chrome instance of each bay.
+    """
+    currentPath: str = os.path.dirname(os.path.realpath(__file__))
+    for bay in cfg.bays:
+        # the single bay keeps the directories of the former dual screen mode, the spare set ends with "b"
+        prefix: str = "chromeProfile" if bay.name == DEFAULT_BAY_NAME else f"chromeProfile_{bay.name}_"
+        profileSets[bay.name] = tuple(
+            [os.path.join(currentPath, "..", f"{prefix}{index + 1}{suffix}") for index in range(len(bay.windowPositions))]
+            for suffix in ("", "b")
+        )
+        chromeProfiles[bay.name] = profileSets[bay.name][activeProfileSets.get(bay.name, 0)]
+        for profile in chromeProfiles[bay.name]:
+            os.makedirs(profile, exist_ok=True)
+
+
+def directorySize(path: str) -> int:
+    """
+    Bytes used by the files of the directory and of its subdirectories, 0 if it does not exist.
+    """
+    size: int = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        size += directorySize(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    return size
+
+
+def pruneProfileCaches(profiles: list[str]) -> int:
+    """
+    Delete the caches of user-data directories no window is using. Returns the bytes freed.
+    """
+    freed: int = 0
+    for profile in profiles:
+        for cache in PROFILE_CACHE_DIRS:
+            path: str = os.path.join(profile, cache)
+            size: int = directorySize(path)
+            if size:
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size - directorySize(path)
+    return freed
+
+
+def recycleChrome(cfg: Config, bay: BayConfig, reason: str) -> None:
+    """
+    Replace the running kiosk windows of the bay by fresh ones without showing the desktop, from a
+    background thread: the new windows are launched on the spare user-data directories over the
+    current ones, which are stopped once the new ones are shown, then the caches of the released
+    directories are pruned. Given up if the bay windows are stopped meanwhile (e.g. an unlock).
+    """
+    current: ChromeController = bayController(bay)
+    if not current.isRunning() or bay.name not in profileSets:
+        return
+    spareSet: int = 1 - activeProfileSets.get(bay.name, 0)
+    spareProfiles: list[str] = profileSets[bay.name][spareSet]
+    releasedProfiles: list[str] = chromeProfiles[bay.name]
+    windowName: str = bayWindowName(cfg, bay)
+    fresh = ChromeController()
+    fresh.pageUrl, fresh.bayTag, fresh.animation = current.pageUrl, current.bayTag, current.animation
+    fresh.visible = current.visible
+
+    def recycle() -> None:
         try:
-            subprocess.Popen(
-                [cfg.chromePath] +
-                kioskCommand +
-                [f"--user-data-dir={chromeProfile1}", url]
-            )
+            launched: float = time.monotonic()
+            for profile in spareProfiles:
+                os.makedirs(profile, exist_ok=True)
+            running: int = len(current.pids())
+            fresh.start(cfg, current.msgType, windowsArguments(bay, spareProfiles), windowName)
+            windowManager: WindowManager = getWindowManager(cfg)
+            if windowManager.waitForWindows(windowName, running + len(spareProfiles), READY_TIMEOUT):
+                chromeLaunchSeconds.observe(time.monotonic() - launched)
+
+            with current.lock:
+                swapped: bool = bool(current.windows) and chromeControllers.get(bay.name) is current
+                if swapped:
+                    chromeControllers[bay.name] = fresh
+                    activeProfileSets[bay.name] = spareSet
+                    chromeProfiles[bay.name] = spareProfiles
+            if not swapped:
+                fresh.stop()
+                return
+            # the fresh windows go on top before the former ones are closed
+            if fresh.visible:
+                windowManager.ensureOnTop(windowName, cfg.verbose)
+            current.stop()
+            windowManager.forget(windowName)
+            chromeRecycles.inc(reason=reason)
+            freed: int = pruneProfileCaches(releasedProfiles)
+            print(f"Chrome kiosk windows of bay {bay.name} recycled ({reason}), {freed / 2**20:.0f} MB of cache pruned.")
         except Exception as e:
-            print(f"Error starting Chrome: {e}")
+            print(f"Error recycling Chrome: {e}")
 
-    time.sleep(5)
-    ensureWindowOnTop(cfg.chromeWindowName, cfg.verbose)
+    threading.Thread(target=recycle, name="chromeRecycle", daemon=True).start()
 
 
-def createChromeUserProfiles() -> None:
+def benchmark() -> None:
     """
-    Create separate user-data directories for each Chrome instance.
+    Compare the liveness check of the controller with the former scan of the whole process table.
+    A sleeping Python process stands in for Chrome.
     """
-    global chromeProfile1, chromeProfile2
+    import timeit
 
-    currentPath: str = os.path.dirname(os.path.realpath(__file__))
-    # Create separate user-data directories for each instance.
-    chromeProfile1 = os.path.join(currentPath, "..", "chromeProfile1")
-    chromeProfile2 = os.path.join(currentPath, "..", "chromeProfile2")
-    os.makedirs(chromeProfile1, exist_ok=True)
-    os.makedirs(chromeProfile2, exist_ok=True)
+    def scanProcesses() -> bool:
+        for process in psutil.process_iter(attrs=["pid", "name"]):
+            if "chrome" in process.info["name"].lower():
+                return True
+        return False
+
+    controller = ChromeController()
+    window = controller.launch([sys.executable, "-c", "import time; time.sleep(60)"], [])
+    runs = 200
+    scanTime = timeit.timeit(scanProcesses, number=runs) / runs
+    trackedTime = timeit.timeit(controller.isRunning, number=runs) / runs
+    print(f"Process table scan: {scanTime * 1e6:9.1f} us per check ({len(psutil.pids())} processes)")
+    print(f"Tracked controller: {trackedTime * 1e6:9.1f} us per check")
+
+    # crash detection: the stand-in is killed from outside and relaunched by its watcher, on the same message
+    relaunchedTypes: list[MessageType] = []
+
+    def relaunchCommand(windowArgs: list[str], msgType: MessageType) -> list[str]:
+        relaunchedTypes.append(msgType)
+        return [sys.executable, "-c", "import time; time.sleep(60)"]
+
+    controller.msgType = MessageType.timesUp
+    start = time.perf_counter()
+    window.process.kill()
+    controller.command = relaunchCommand
+    controller.windowName = "benchmark"
+    while controller.respawns == 0:
+        time.sleep(0.01)
+    print(f"Relaunched {(time.perf_counter() - start) * 1000:.0f} ms after the crash")
+    assert relaunchedTypes == [MessageType.timesUp], relaunchedTypes
+    assert controller.isRunning()
+    assert controller.stop()
+    assert not controller.isRunning()
+
+    # lock latency: from the launch of the windows of a bay until they are all shown, each stand-in showing its
+    # window (a marker file) after a boot of BOOT seconds, as Chrome does (median of 5)
+    import shutil
+    import tempfile
+    from windowManager import FakeWindowManager
+
+    BOOT = 0.5
+    directory: str = tempfile.mkdtemp()
+
+    class ShownWindows(FakeWindowManager):
+        def findWindows(self, substring: str) -> list[int]:
+            return [int(name) for name in os.listdir(directory)]
+
+        def windowTitle(self, handle: int) -> Optional[str]:
+            return "benchmark" if os.path.exists(os.path.join(directory, str(handle))) else None
+
+    standIn: str = (f"import os, time; time.sleep({BOOT}); "
+                    f"open(os.path.join({directory!r}, str(os.getpid())), 'w').close(); time.sleep(60)")
+    controller.command = lambda windowArgs, msgType: [sys.executable, "-c", standIn]
+    manager = ShownWindows()
+    cfg = Config()
+    try:
+        for count in (1, 2, 4, 8):
+            latencies: list[float] = []
+            for _ in range(5):
+                start = time.perf_counter()
+                controller.start(cfg, MessageType.boot, [[] for _ in range(count)], "benchmark")
+                assert manager.waitForWindows("benchmark", count, 10)
+                latencies.append(time.perf_counter() - start)
+                controller.stop()
+                for name in os.listdir(directory):
+                    os.remove(os.path.join(directory, name))
+            print(f"{count} windows shown {sorted(latencies)[2] * 1000:6.0f} ms after their launch "
+                  f"({BOOT * 1000:.0f} ms of boot each)")
+    finally:
+        shutil.rmtree(directory)
 
 
 # test module
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
     from config import loadConfig
+    from windowManager import resolveWindowPositions
     cfg: Config = loadConfig()
-    createChromeUserProfiles()
-    startChrome(cfg, MessageType.timesUp)
+    resolveWindowPositions(cfg)
+    createChromeUserProfiles(cfg)
+    bay: BayConfig = cfg.bays[0]
+    startChrome(cfg, bay, MessageType.timesUp)
     time.sleep(5)
-    killChrome(cfg)
+    killChrome(cfg, bay)
     time.sleep(2)
-    startChrome(cfg, MessageType.backToback)
+    startChrome(cfg, bay, MessageType.backToback)
     time.sleep(5)
-    killChrome(cfg)
+    killChrome(cfg, bay)
     time.sleep(2)
-    startChrome(cfg, MessageType.boot)
+    startChrome(cfg, bay, MessageType.boot)
     time.sleep(5)
-    killChrome(cfg)
+    killChrome(cfg, bay)
     time.sleep(2)
     print("Test completed.")
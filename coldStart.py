@@ -0,0 +1,116 @@
+"""
+This module measures the cold start of the daemon: from the process start to the
+first lock applied to the screens (the first Chrome kiosk launch), and until every
+bay is locked. The daemon runs from a copy of the repository with a configuration
+of its own: two bays, Chrome replaced by a process exiting at once, no window
+manager and an unreachable calendar, so the first decision is the padlock.
+The import of the Google client stack is measured apart: it is not on the path of the first lock.
+usage: python coldStart.py [runs]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+from typing import Optional
+
+# the daemon logs this line when it launches the kiosk windows of a bay
+LOCK_LOG = "Starting Chrome in kiosk mode"
+# a daemon not locking within this many seconds is reported as failed
+START_TIMEOUT = 60
+# files of the repository needed to run the daemon
+COPIED_EXTENSIONS = (".py", ".html", ".css", ".png", ".json")
+
+CONFIG = """[google]
+serviceAccountJsonPath = {directory}/missingServiceAccount.json
+api_root_url = http://127.0.0.1:9/
+
+[chrome]
+path = {python}
+window_manager = none
+
+[system]
+verbose = False
+
+[bay.1]
+calendar_id = coldstart1@fake
+window_positions = 0,0
+
+[bay.2]
+calendar_id = coldstart2@fake
+window_positions = 1920,0
+"""
+BAYS = 2
+
+
+def copyDaemon(directory: str) -> str:
+    """
+    Copy the daemon into directory/golfScreenBlocker with its configuration beside it. Returns the copy folder.
+    """
+    source: str = os.path.dirname(os.path.realpath(__file__))
+    target: str = os.path.join(directory, "golfScreenBlocker")
+    os.makedirs(target)
+    for name in os.listdir(source):
+        if name.endswith(COPIED_EXTENSIONS) and name != "requests.jsonl":
+            shutil.copy(os.path.join(source, name), target)
+    with open(os.path.join(directory, "screenBlockerConfig.cfg"), "w", encoding="utf-8") as file:
+        file.write(CONFIG.format(directory=directory.replace("\\", "/"), python=sys.executable.replace("\\", "/")))
+    return target
+
+
+def timeLocks(folder: str) -> Optional[list[float]]:
+    """
+    Start the daemon and return the seconds until it launched the kiosk windows of each bay, None on timeout.
+    """
+    locks: list[float] = []
+    started: float = time.perf_counter()
+    daemon = subprocess.Popen([sys.executable, "screenBlocker.py"], cwd=folder, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, text=True, encoding="utf-8", errors="replace")
+    try:
+        assert daemon.stdout is not None
+        for line in daemon.stdout:
+            if LOCK_LOG in line:
+                locks.append(time.perf_counter() - started)
+                if len(locks) == BAYS:
+                    return locks
+            if time.perf_counter() - started > START_TIMEOUT:
+                break
+        return None
+    finally:
+        daemon.kill()
+        daemon.wait()
+
+
+def timeImport(folder: str, module: str) -> float:
+    """
+    Seconds to import the module in a fresh interpreter.
+    """
+    script: str = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+    return float(subprocess.check_output([sys.executable, "-c", script], cwd=folder, text=True).split()[-1])
+
+
+def benchmark(runs: int = 5) -> None:
+    directory: str = tempfile.mkdtemp()
+    try:
+        folder: str = copyDaemon(directory)
+        # a first run fills the file system cache, as for the following boots of the bay PC
+        timeLocks(folder)
+        runsLocks: list[list[float]] = []
+        for _ in range(runs):
+            locks: Optional[list[float]] = timeLocks(folder)
+            assert locks is not None, f"bays not locked within {START_TIMEOUT} s"
+            runsLocks.append(locks)
+        for name, index in (("first lock", 0), ("every bay locked", BAYS - 1)):
+            times: list[float] = sorted(locks[index] for locks in runsLocks)
+            print(f"Process start to {name:16s}: median {times[len(times) // 2] * 1000:6.0f} ms, "
+                  f"min {times[0] * 1000:6.0f} ms, max {times[-1] * 1000:6.0f} ms ({runs} runs)")
+        print(f"Google client import (off the boot path): {timeImport(folder, 'googleCalendar') * 1000:6.0f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+# test module
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -8,7 +8,8 @@ location: "../screenBlockerConfig.cfg"
 
 import os
 from configparser import ConfigParser
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Callable, Optional
 from logger import Logger
 Logger("SCREEN BLOCKER", True)
 
@@ -18,16 +19,83 @@ CONFIG_FILE_NAME = "screenBlockerConfig.cfg"
 GOOGLE_SECTION = "google"
 SERVICE_ACCOUNT_KEY = "serviceAccountJsonPath"
 CALENDAR_ID_TAG = "calendar_id"
+API_ROOT_URL_TAG = "api_root_url"
+REFRESH_MIN_SECONDS_TAG = "refresh_min_seconds"
+REFRESH_MAX_SECONDS_TAG = "refresh_max_seconds"
+REFRESH_DAILY_BUDGET_TAG = "refresh_daily_budget"
 
 # configuration file [chrome] section and tags
 CHROME_SECTION = "chrome"
 CHROME_PATH_TAG = "path"
 WINDOW_NAME_TAG = "window_name"
+WARM_STANDBY_TAG = "warm_standby"
+DISPLAY_PORT_TAG = "display_port"
+WINDOW_MANAGER_TAG = "window_manager"
+PADLOCK_FPS_TAG = "padlock_fps"
+PADLOCK_IDLE_MINUTES_TAG = "padlock_idle_minutes"
+PADLOCK_IDLE_FPS_TAG = "padlock_idle_fps"
 
 # Configuration file [system] section and tags
 SYSTEM_SECTION = "system"
 DUAL_SCREEN_TAG = "dual_screen"
 VERBOSE_TAG = "verbose"
+SNAPSHOT_HOURS_TAG = "snapshot_hours"
+METRICS_PORT_TAG = "metrics_port"
+JSON_LOGS_TAG = "json_logs"
+CHROME_MEMORY_BUDGET_TAG = "chrome_memory_budget_mb"
+PROFILE_BUDGET_TAG = "profile_budget_mb"
+CONTROL_PORT_TAG = "control_port"
+CONTROL_TOKEN_TAG = "control_token"
+
+# Configuration file [push] section and tags
+PUSH_SECTION = "push"
+WEBHOOK_URL_TAG = "webhook_url"
+RECEIVER_PORT_TAG = "receiver_port"
+
+# Configuration file [bay.<name>] sections and tags, one section per simulator bay
+BAY_SECTION_PREFIX = "bay."
+WINDOW_POSITIONS_TAG = "window_positions"
+# window positions resolved from the displays found (see windowManager.resolveWindowPositions): a window on every
+# display, or on the nth display (@1 is the primary display, the others follow from left to right)
+AUTO_POSITIONS = "auto"
+DISPLAY_POSITION_PREFIX = "@"
+# name of the bay when the configuration has no [bay.<name>] section
+DEFAULT_BAY_NAME = "main"
+
+# subsystems restarted when their settings change in a reloaded configuration
+CALENDAR_CLIENT_SUBSYSTEM = "calendar client"
+CALENDARS_SUBSYSTEM = "calendars"
+REFRESH_SUBSYSTEM = "refresh"
+PUSH_SUBSYSTEM = "push"
+KIOSK_SUBSYSTEM = "kiosk"
+DISPLAY_SUBSYSTEM = "display server"
+WINDOW_MANAGER_SUBSYSTEM = "window manager"
+METRICS_SUBSYSTEM = "metrics"
+CONTROL_SUBSYSTEM = "control API"
+LOGS_SUBSYSTEM = "logs"
+# Config fields of each subsystem, the others (verbose, snapshot_hours...) are only swapped in
+SUBSYSTEM_FIELDS: dict[str, tuple[str, ...]] = {
+    CALENDAR_CLIENT_SUBSYSTEM: ("serviceAccountJsonPath", "apiRootUrl"),
+    REFRESH_SUBSYSTEM: ("refreshMinSeconds", "refreshMaxSeconds", "refreshDailyBudget"),
+    PUSH_SUBSYSTEM: ("webhookUrl", "receiverPort"),
+    KIOSK_SUBSYSTEM: ("chromePath", "chromeWindowName", "padlockFps", "padlockIdleMinutes", "padlockIdleFps"),
+    DISPLAY_SUBSYSTEM: ("warmStandby", "displayPort"),
+    WINDOW_MANAGER_SUBSYSTEM: ("windowManager",),
+    METRICS_SUBSYSTEM: ("metricsPort",),
+    CONTROL_SUBSYSTEM: ("controlPort", "controlToken"),
+    LOGS_SUBSYSTEM: ("jsonLogs",),
+}
+
+
+@dataclass
+class BayConfig:
+    """
+    A simulator bay: its calendar and the position of each of its kiosk windows ("x,y", negative left of
+    or above the primary display, "auto" or "@n" until resolved, empty for the default).
+    """
+    name: str = DEFAULT_BAY_NAME
+    calendarId: str = ""
+    windowPositions: list[str] = field(default_factory=lambda: [""])
 
 
 @dataclass
@@ -37,18 +105,51 @@ class Config:
     """
     serviceAccountJsonPath: str = ""
     calendarId: str = ""
+    apiRootUrl: str = ""
+    refreshMinSeconds: float = 20
+    refreshMaxSeconds: float = 15 * 60
+    refreshDailyBudget: float = 1500
     chromePath: str = "C:/Program Files/Google/Chrome/Application/chrome.exe"
     dualScreen: bool = False
     verbose: bool = False
+    snapshotHours: float = 12
+    metricsPort: int = 0
+    jsonLogs: bool = False
+    chromeMemoryBudgetMb: float = 1024
+    profileBudgetMb: float = 512
+    controlPort: int = 0
+    controlToken: str = ""
     chromeWindowName: str = "Google Chrome"
+    windowManager: str = "auto"
+    padlockFps: float = 30
+    padlockIdleMinutes: float = 10
+    padlockIdleFps: float = 1
+    warmStandby: bool = False
+    displayPort: int = 8765
+    webhookUrl: str = ""
+    receiverPort: int = 8080
+    bays: list[BayConfig] = field(default_factory=list)
+
+    def calendarIds(self) -> list[str]:
+        """
+        The calendars of every bay, each one once.
+        """
+        if not self.bays:
+            return [self.calendarId]
+        return list(dict.fromkeys(bay.calendarId for bay in self.bays))
 
 
-def loadConfig() -> Config:
+def defaultConfigPath() -> str:
+    return os.path.join(os.path.dirname(__file__), "..", CONFIG_FILE_NAME)
+
+
+def loadConfig(configPath: Optional[str] = None) -> Config:
     """
     Load configuration values from the TOML (.cfg) file located beside
-    the repository folder for this project.
+    the repository folder for this project (or from configPath).
     """
-    configPath: str = os.path.join(os.path.dirname(__file__), "..", CONFIG_FILE_NAME)
+    if configPath is None:
+        configPath = defaultConfigPath()
     configParsed: ConfigParser = ConfigParser()
 
     if not configParsed.read(configPath):
@@ -64,17 +165,40 @@ def loadConfig() -> Config:
     else:
         raise ValueError("Google service account key (json path) not found in configuration file.")
 
+    baySections: list[str] = [section for section in configParsed.sections() if section.startswith(BAY_SECTION_PREFIX)]
+
     if configParsed.has_option(GOOGLE_SECTION, CALENDAR_ID_TAG):
         cfg.calendarId = configParsed.get(GOOGLE_SECTION, CALENDAR_ID_TAG)
-    else:
+    elif not baySections:
         raise ValueError("Google Calendar ID not found in configuration file.")
 
+    if configParsed.has_option(GOOGLE_SECTION, API_ROOT_URL_TAG):
+        cfg.apiRootUrl = configParsed.get(GOOGLE_SECTION, API_ROOT_URL_TAG)
+    if configParsed.has_option(GOOGLE_SECTION, REFRESH_MIN_SECONDS_TAG):
+        cfg.refreshMinSeconds = configParsed.getfloat(GOOGLE_SECTION, REFRESH_MIN_SECONDS_TAG)
+    if configParsed.has_option(GOOGLE_SECTION, REFRESH_MAX_SECONDS_TAG):
+        cfg.refreshMaxSeconds = configParsed.getfloat(GOOGLE_SECTION, REFRESH_MAX_SECONDS_TAG)
+    if configParsed.has_option(GOOGLE_SECTION, REFRESH_DAILY_BUDGET_TAG):
+        cfg.refreshDailyBudget = configParsed.getfloat(GOOGLE_SECTION, REFRESH_DAILY_BUDGET_TAG)
+
     # Optional values for the Chrome path
     if configParsed.has_section(CHROME_SECTION):
         if configParsed.has_option(CHROME_SECTION, CHROME_PATH_TAG):
             cfg.chromePath = configParsed.get(CHROME_SECTION, CHROME_PATH_TAG)
         if configParsed.has_option(CHROME_SECTION, WINDOW_NAME_TAG):
             cfg.chromeWindowName = configParsed.get(CHROME_SECTION, WINDOW_NAME_TAG)
+        if configParsed.has_option(CHROME_SECTION, WARM_STANDBY_TAG):
+            cfg.warmStandby = configParsed.getboolean(CHROME_SECTION, WARM_STANDBY_TAG)
+        if configParsed.has_option(CHROME_SECTION, DISPLAY_PORT_TAG):
+            cfg.displayPort = configParsed.getint(CHROME_SECTION, DISPLAY_PORT_TAG)
+        if configParsed.has_option(CHROME_SECTION, WINDOW_MANAGER_TAG):
+            cfg.windowManager = configParsed.get(CHROME_SECTION, WINDOW_MANAGER_TAG)
+        if configParsed.has_option(CHROME_SECTION, PADLOCK_FPS_TAG):
+            cfg.padlockFps = configParsed.getfloat(CHROME_SECTION, PADLOCK_FPS_TAG)
+        if configParsed.has_option(CHROME_SECTION, PADLOCK_IDLE_MINUTES_TAG):
+            cfg.padlockIdleMinutes = configParsed.getfloat(CHROME_SECTION, PADLOCK_IDLE_MINUTES_TAG)
+        if configParsed.has_option(CHROME_SECTION, PADLOCK_IDLE_FPS_TAG):
+            cfg.padlockIdleFps = configParsed.getfloat(CHROME_SECTION, PADLOCK_IDLE_FPS_TAG)
 
     # Optional values for the system settings
     if configParsed.has_section(SYSTEM_SECTION):
@@ -82,10 +206,151 @@ def loadConfig() -> Config:
             cfg.dualScreen = configParsed.getboolean(SYSTEM_SECTION, DUAL_SCREEN_TAG)
         if configParsed.has_option(SYSTEM_SECTION, VERBOSE_TAG):
             cfg.verbose = configParsed.getboolean(SYSTEM_SECTION, VERBOSE_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, SNAPSHOT_HOURS_TAG):
+            cfg.snapshotHours = configParsed.getfloat(SYSTEM_SECTION, SNAPSHOT_HOURS_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, METRICS_PORT_TAG):
+            cfg.metricsPort = configParsed.getint(SYSTEM_SECTION, METRICS_PORT_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, JSON_LOGS_TAG):
+            cfg.jsonLogs = configParsed.getboolean(SYSTEM_SECTION, JSON_LOGS_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, CHROME_MEMORY_BUDGET_TAG):
+            cfg.chromeMemoryBudgetMb = configParsed.getfloat(SYSTEM_SECTION, CHROME_MEMORY_BUDGET_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, PROFILE_BUDGET_TAG):
+            cfg.profileBudgetMb = configParsed.getfloat(SYSTEM_SECTION, PROFILE_BUDGET_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, CONTROL_PORT_TAG):
+            cfg.controlPort = configParsed.getint(SYSTEM_SECTION, CONTROL_PORT_TAG)
+        if configParsed.has_option(SYSTEM_SECTION, CONTROL_TOKEN_TAG):
+            cfg.controlToken = configParsed.get(SYSTEM_SECTION, CONTROL_TOKEN_TAG)
+
+    # Optional multi-bay mode: one [bay.<name>] section per bay, otherwise a single bay
+    for section in baySections:
+        bay: BayConfig = BayConfig(name=section[len(BAY_SECTION_PREFIX):])
+        if configParsed.has_option(section, CALENDAR_ID_TAG):
+            bay.calendarId = configParsed.get(section, CALENDAR_ID_TAG)
+        else:
+            raise ValueError(f"Google Calendar ID not found in configuration section [{section}].")
+        if configParsed.has_option(section, WINDOW_POSITIONS_TAG):
+            positions: str = configParsed.get(section, WINDOW_POSITIONS_TAG)
+            bay.windowPositions = [position.strip() for position in positions.split(";")]
+        cfg.bays.append(bay)
+    if not cfg.bays:
+        # dual screen: a window on the second display, another one on the primary display
+        windowPositions: list[str] = [""]
+        if cfg.dualScreen:
+            windowPositions = [f"{DISPLAY_POSITION_PREFIX}2", f"{DISPLAY_POSITION_PREFIX}1"]
+        cfg.bays.append(BayConfig(DEFAULT_BAY_NAME, cfg.calendarId, windowPositions))
+
+    # Optional values for the push notifications
+    if configParsed.has_section(PUSH_SECTION):
+        if configParsed.has_option(PUSH_SECTION, WEBHOOK_URL_TAG):
+            cfg.webhookUrl = configParsed.get(PUSH_SECTION, WEBHOOK_URL_TAG)
+        if configParsed.has_option(PUSH_SECTION, RECEIVER_PORT_TAG):
+            cfg.receiverPort = configParsed.getint(PUSH_SECTION, RECEIVER_PORT_TAG)
 
     return cfg
 
 
+def validateConfig(cfg: Config) -> list[str]:
+    """
+    The problems of a loaded configuration which would leave a bay unprotected, empty if none.
+    """
+    problems: list[str] = []
+    if not os.path.isfile(cfg.chromePath):
+        problems.append(f"Chrome not found at {cfg.chromePath}")
+    if not os.path.isfile(cfg.serviceAccountJsonPath):
+        problems.append(f"Google service account key not found at {cfg.serviceAccountJsonPath}")
+    if not 0 < cfg.refreshMinSeconds <= cfg.refreshMaxSeconds or cfg.refreshDailyBudget <= 0:
+        problems.append("Calendar refresh intervals or budget out of range")
+    if cfg.padlockFps <= 0 or cfg.padlockIdleFps <= 0 or cfg.padlockIdleMinutes < 0:
+        problems.append("Padlock frame rates out of range")
+    if cfg.chromeMemoryBudgetMb < 0 or cfg.profileBudgetMb < 0:
+        problems.append("Chrome resource budgets out of range")
+    for port in (cfg.displayPort, cfg.metricsPort, cfg.receiverPort, cfg.controlPort):
+        if not 0 <= port <= 65535:
+            problems.append(f"Invalid port {port}")
+    if cfg.controlPort and not cfg.controlToken:
+        problems.append("The control API needs a control_token")
+    for bay in cfg.bays:
+        for position in bay.windowPositions:
+            try:
+                if position.startswith(DISPLAY_POSITION_PREFIX):
+                    if int(position[len(DISPLAY_POSITION_PREFIX):]) < 1:
+                        raise ValueError(position)
+                elif position and position != AUTO_POSITIONS:
+                    x, y = position.split(",")
+                    int(x), int(y)
+            except ValueError:
+                problems.append(f"Invalid window position \"{position}\" of bay {bay.name}")
+    return problems
+
+
+def changedSubsystems(old: Config, new: Config) -> set[str]:
+    """
+    The subsystems whose settings differ between the two configurations.
+    """
+    changed: set[str] = {
+        subsystem for subsystem, fields in SUBSYSTEM_FIELDS.items()
+        if any(getattr(old, name) != getattr(new, name) for name in fields)
+    }
+    if old.calendarIds() != new.calendarIds():
+        changed.add(CALENDARS_SUBSYSTEM)
+    return changed
+
+
+def changedBays(old: Config, new: Config) -> set[str]:
+    """
+    The bays kept in the new configuration whose kiosk windows changed (number or positions).
+    """
+    oldBays: dict[str, BayConfig] = {bay.name: bay for bay in old.bays}
+    return {
+        bay.name for bay in new.bays if bay.name in oldBays and bay.windowPositions != oldBays[bay.name].windowPositions
+    }
+
+
+class ConfigWatcher:
+    """
+    Detects the changes of the configuration file from its modification time and size (one stat per check),
+    then loads and validates the new configuration. A file which does not load or validate is reported
+    and ignored: the running configuration is kept until the file is fixed.
+    resolve completes a loaded configuration before it is compared (e.g. the window positions of the displays).
+    """
+
+    def __init__(self, cfg: Config, configPath: Optional[str] = None, resolve: Optional[Callable[[Config], None]] = None):
+        self.configPath: str = configPath if configPath is not None else defaultConfigPath()
+        self.cfg: Config = cfg
+        self.resolve: Optional[Callable[[Config], None]] = resolve
+        self.signature: Optional[tuple[int, int]] = self.fileSignature()
+
+    def fileSignature(self) -> Optional[tuple[int, int]]:
+        try:
+            stat: os.stat_result = os.stat(self.configPath)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self) -> Optional[Config]:
+        """
+        Returns the new configuration if the file changed and is valid, otherwise None.
+        """
+        signature: Optional[tuple[int, int]] = self.fileSignature()
+        if signature == self.signature:
+            return None
+        self.signature = signature
+        try:
+            cfg: Config = loadConfig(self.configPath)
+            problems: list[str] = validateConfig(cfg)
+            if problems:
+                raise ValueError(", ".join(problems))
+            if self.resolve is not None:
+                self.resolve(cfg)
+        except Exception as e:
+            print(f"Configuration change ignored, keeping the running configuration: {e}")
+            return None
+        if cfg == self.cfg:
+            return None
+        self.cfg = cfg
+        return cfg
+
+
 def printConfig(cfg: Config):
     """
     Print the configuration values to the console.
@@ -93,15 +358,67 @@ def printConfig(cfg: Config):
     print("Configuration Values:")
     print(f"Google Key:  {cfg.serviceAccountJsonPath}")
     print(f"Calendar ID: {cfg.calendarId}")
+    if cfg.apiRootUrl:
+        print(f"API Root:    {cfg.apiRootUrl}")
+    print(f"Refresh:     every {cfg.refreshMinSeconds:g} to {cfg.refreshMaxSeconds:g} s, "
+          f"{cfg.refreshDailyBudget:g} per calendar and per day at most")
     print(f"Chrome Path: {cfg.chromePath}")
     print(f"Window Name: {cfg.chromeWindowName}")
+    print(f"Window Mgr:  {cfg.windowManager}")
+    print(f"Padlock:     {cfg.padlockFps:g} fps, {cfg.padlockIdleFps:g} fps after {cfg.padlockIdleMinutes:g} minutes")
+    print(f"Warm Standby:{cfg.warmStandby} (port {cfg.displayPort})")
     print(f"Dual Screen: {cfg.dualScreen}")
     print(f"Verbose:     {cfg.verbose}")
+    print(f"Snapshot:    {cfg.snapshotHours} hours")
+    print(f"Metrics:     {f'port {cfg.metricsPort}' if cfg.metricsPort else 'disabled'}")
+    print(f"JSON Logs:   {cfg.jsonLogs}")
+    print(f"Control API: {f'port {cfg.controlPort}' if cfg.controlPort else 'disabled'}")
+    print(f"Budgets:     Chrome {f'{cfg.chromeMemoryBudgetMb:g} MB' if cfg.chromeMemoryBudgetMb else 'unlimited'} "
+          f"per bay, profiles {f'{cfg.profileBudgetMb:g} MB' if cfg.profileBudgetMb else 'unlimited'} per bay")
+    print(f"Webhook URL: {cfg.webhookUrl}")
+    print(f"Push Port:   {cfg.receiverPort}")
+    for bay in cfg.bays:
+        print(f"Bay {bay.name}: {bay.calendarId} | windows: {bay.windowPositions}")
     print()
 
 
 # test module
 if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    # live reload: a change is seen from the file stat, an invalid file is ignored
+    directory: str = tempfile.mkdtemp()
+    testPath: str = os.path.join(directory, CONFIG_FILE_NAME)
+    keyPath: str = os.path.join(directory, "key.json").replace("\\", "/")
+    open(keyPath, "w").close()
+    testConfig: str = (f"[google]\nserviceAccountJsonPath = {keyPath}\n[chrome]\npath = {sys.executable}\n"
+                       "[bay.1]\ncalendar_id = one@test\nwindow_positions = 0,0\n")
+    with open(testPath, "w", encoding="utf-8") as file:
+        file.write(testConfig)
+    old: Config = loadConfig(testPath)
+    assert validateConfig(old) == []
+    watcher = ConfigWatcher(old, testPath)
+    assert watcher.poll() is None
+
+    with open(testPath, "w", encoding="utf-8") as file:
+        file.write(testConfig.replace("0,0", "-1920,0") + "[bay.2]\ncalendar_id = two@test\nwindow_positions = 1920,0\n"
+                   "[system]\nmetrics_port = 9464\n")
+    new = watcher.poll()
+    assert new is not None and [bay.name for bay in new.bays] == ["1", "2"]
+    assert changedSubsystems(old, new) == {CALENDARS_SUBSYSTEM, METRICS_SUBSYSTEM}
+    assert changedBays(old, new) == {"1"}
+    assert watcher.poll() is None
+
+    with open(testPath, "w", encoding="utf-8") as file:
+        file.write(testConfig.replace("0,0", "left"))
+    assert watcher.poll() is None and watcher.cfg is new
+    os.remove(keyPath)
+    assert len(validateConfig(new)) == 1
+    os.remove(testPath)
+    os.rmdir(directory)
+    print("Configuration reload test finished.")
+
     cfg = loadConfig()
     printConfig(cfg)
     print("Configuration loaded successfully.")
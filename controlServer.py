@@ -0,0 +1,231 @@
+"""
+This module serves the operator control API on a local port: staff can lock or unlock
+a bay right away, extend the session in progress by a few minutes or query the state
+and upcoming transitions of the bays, without editing the calendar.
+The commands are queued to the planner and applied by the main loop, woken up at once.
+The overrides are layered over the calendar (see scheduler.TransitionScheduler): a refresh
+does not undo them. They are kept in memory only: a restarted daemon follows the calendar.
+Every request needs the control token: "Authorization: Bearer <control_token>".
+    GET  /status[?bay=<name>]
+    POST /lock?bay=<name>[&minutes=<n>]     (until released without minutes)
+    POST /unlock?bay=<name>[&minutes=<n>]
+    POST /extend?bay=<name>&minutes=<n>
+    POST /release?bay=<name>                (back to the calendar)
+usage: python controlServer.py status | lock <bay> [minutes] | unlock <bay> [minutes] | extend <bay> <minutes>
+       | release <bay> (python controlServer.py test to run the tests)
+"""
+
+import sys
+import hmac
+import json
+import threading
+from datetime import datetime
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from scheduler import (EXTEND_COMMAND, LOCK_COMMAND, RELEASE_COMMAND, STATUS_COMMAND, UNLOCK_COMMAND, BayStatus, Command,
+                       Planner)
+
+# seconds a request waits for the main loop to apply its command
+COMMAND_TIMEOUT = 5
+# commands sent with POST
+POST_COMMANDS = (LOCK_COMMAND, UNLOCK_COMMAND, EXTEND_COMMAND, RELEASE_COMMAND)
+
+
+def statusJson(status: BayStatus) -> dict[str, Any]:
+    return {
+        "bay": status.bay,
+        "state": status.state.value,
+        "override": ({"state": status.override.state.value, "until": status.override.until}
+                     if status.override is not None else None),
+        "session": status.session._asdict() if status.session is not None else None,
+        "transitions": [{"time": time, "state": state.value} for time, state in status.transitions],
+    }
+
+
+class ControlServer(ThreadingHTTPServer):
+    """
+    Local HTTP server of the control API, started on a background thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int, token: str, planner: Planner):
+        super().__init__(("127.0.0.1", port), ControlHandler)
+        self.token: str = token
+        self.planner: Planner = planner
+        self.thread: threading.Thread = threading.Thread(target=self.serve_forever, name="controlServer", daemon=True)
+        self.thread.start()
+        print(f"Control API served on http://127.0.0.1:{self.server_address[1]}/")
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+
+    server: ControlServer
+
+    def do_GET(self) -> None:
+        self.handleCommand(STATUS_COMMAND)
+
+    def do_POST(self) -> None:
+        self.handleCommand(None)
+
+    def handleCommand(self, action: Optional[str]) -> None:
+        url = urlparse(self.path)
+        # the Authorization header is compared in constant time
+        if not hmac.compare_digest(self.headers.get("Authorization", "").encode(), f"Bearer {self.server.token}".encode()):
+            self.sendJson(401, {"error": "Invalid or missing control token"})
+            return
+        path: str = url.path.strip("/")
+        if (action is None and path not in POST_COMMANDS) or (action is not None and path != action):
+            self.sendJson(404, {"error": f"Unknown path /{path}"})
+            return
+        query: dict[str, list[str]] = parse_qs(url.query)
+        bay: Optional[str] = query.get("bay", [None])[0]
+        try:
+            minutes: Optional[float] = float(query["minutes"][0]) if "minutes" in query else None
+        except ValueError:
+            self.sendJson(400, {"error": "Invalid minutes"})
+            return
+        if minutes is not None and not 0 < minutes <= 24 * 60:
+            self.sendJson(400, {"error": "Minutes out of range"})
+            return
+
+        command = Command(path, bay, minutes)
+        if path != STATUS_COMMAND:
+            print(f"Operator command: {path} bay {bay}{f' for {minutes:g} minutes' if minutes is not None else ''}")
+        if not self.server.planner.submit(command, COMMAND_TIMEOUT):
+            self.sendJson(503, {"error": "Command not applied yet, the main loop is busy"})
+        elif command.error is not None:
+            print(f"Operator command refused: {command.error}")
+            self.sendJson(404 if command.error.startswith("Unknown bay") else 400, {"error": command.error})
+        else:
+            self.sendJson(200, {"bays": [statusJson(status) for status in command.result]})
+
+    def sendJson(self, status: int, content: dict[str, Any]) -> None:
+        body: bytes = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def sendCommand(port: int, token: str, action: str, bay: Optional[str] = None,
+                minutes: Optional[float] = None) -> tuple[int, dict[str, Any]]:
+    """
+    Send a command to the control API of the daemon. Returns the HTTP status and the JSON answer.
+    """
+    import http.client
+    from urllib.parse import urlencode
+
+    query: dict[str, Any] = {key: value for key, value in (("bay", bay), ("minutes", minutes)) if value is not None}
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=COMMAND_TIMEOUT + 5)
+    try:
+        connection.request("GET" if action == STATUS_COMMAND else "POST",
+                           f"/{action}{'?' + urlencode(query) if query else ''}",
+                           headers={"Authorization": f"Bearer {token}"})
+        response = connection.getresponse()
+        return response.status, json.loads(response.read() or b"{}")
+    finally:
+        connection.close()
+
+
+def printStatus(bays: list[dict[str, Any]]) -> None:
+    def clock(epoch: float) -> str:
+        return datetime.fromtimestamp(epoch).strftime("%H:%M:%S")
+
+    for bay in bays:
+        override: Optional[dict[str, Any]] = bay["override"]
+        forced: str = ""
+        if override is not None:
+            until: str = clock(override["until"]) if override["until"] is not None else "released"
+            forced = f", forced {'lock' if override['state'] == 'padlock' else 'unlock'} until {until}"
+        session: str = f", session until {clock(bay['session']['end'])}" if bay["session"] is not None else ""
+        transitions: str = ", ".join(f"{clock(change['time'])} {change['state']}" for change in bay["transitions"])
+        print(f"Bay {bay['bay']}: {bay['state']}{session}{forced} | next: {transitions or 'nothing planned'}")
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        import time
+        from scheduler import Booking, DisplayState
+
+        # the main loop: the planner steps whenever it wakes up
+        now: float = time.time()
+        planner = Planner()
+        planner.step({"1": [Booking(now + 3600, now + 7200, "later")], "2": [Booking(now - 600, now + 600, "current")]})
+        running: bool = True
+        applied: list[tuple[float, str, DisplayState]] = []
+
+        def mainLoop() -> None:
+            while running:
+                for action in planner.step():
+                    if not action.enforce:
+                        applied.append((time.monotonic(), action.bay, action.state))
+                planner.wait()
+
+        loop = threading.Thread(target=mainLoop)
+        loop.start()
+        server = ControlServer(0, "secret", planner)
+        port: int = server.server_address[1]
+        try:
+            assert sendCommand(port, "wrong", STATUS_COMMAND)[0] == 401
+            status, answer = sendCommand(port, "secret", STATUS_COMMAND)
+            assert status == 200 and [bay["state"] for bay in answer["bays"]] == ["padlock", "hidden"], answer
+            assert answer["bays"][1]["transitions"][0] == {"time": now + 600, "state": "timesUp"}
+
+            # a forced lock reaches the main loop while it sleeps until its next enforcement
+            started: float = time.monotonic()
+            status, answer = sendCommand(port, "secret", LOCK_COMMAND, "2", 5)
+            latency: float = time.monotonic() - started
+            assert status == 200 and answer["bays"][0]["state"] == "padlock", answer
+            while not applied:
+                time.sleep(0.001)
+            assert applied[0][1:] == ("2", DisplayState.padlock)
+            print(f"Forced lock answered in {latency * 1000:.1f} ms, applied by the main loop "
+                  f"{(applied[0][0] - started) * 1000:.1f} ms after the request")
+            assert latency < 0.5
+
+            # an extension, then back to the calendar
+            status, answer = sendCommand(port, "secret", EXTEND_COMMAND, "2", 10)
+            assert status == 200 and answer["bays"][0]["session"]["end"] == now + 1200, answer
+            printStatus(answer["bays"])
+            assert sendCommand(port, "secret", RELEASE_COMMAND, "2")[1]["bays"][0]["session"]["end"] == now + 600
+
+            # invalid requests
+            assert sendCommand(port, "secret", LOCK_COMMAND, "3")[0] == 404
+            assert sendCommand(port, "secret", EXTEND_COMMAND, "1")[0] == 400
+            assert sendCommand(port, "secret", EXTEND_COMMAND, "1", -5)[0] == 400
+            assert sendCommand(port, "secret", "reboot", "1")[0] == 404
+        finally:
+            running = False
+            planner.scheduler.wakeUp.set()
+            loop.join()
+            server.stop()
+
+        print("Control server test finished.")
+        print()
+        sys.exit(0)
+
+    # the commands are not written to the log files of the daemon
+    from logger import Logger
+    Logger("CONTROL", False)
+    from config import loadConfig
+    cfg = loadConfig()
+    if not cfg.controlPort or not cfg.controlToken:
+        print("The control API is disabled: set control_port and control_token in the configuration file.")
+        sys.exit(1)
+    action: str = sys.argv[1] if len(sys.argv) > 1 else STATUS_COMMAND
+    status, answer = sendCommand(cfg.controlPort, cfg.controlToken, action, sys.argv[2] if len(sys.argv) > 2 else None,
+                                 float(sys.argv[3]) if len(sys.argv) > 3 else None)
+    if status != 200:
+        print(f"Error {status}: {answer.get('error', '')}")
+        sys.exit(1)
+    printStatus(answer["bays"])
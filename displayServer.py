@@ -0,0 +1,218 @@
+"""
+This module serves the screen blocker page from a small local HTTP server and
+pushes the message to display through a Server-Sent Events stream (/events).
+In warm standby mode Chrome stays resident on this page: a lock or unlock only
+switches the page state and shows or hides the window, no Chrome launch needed.
+Each bay has its own state, the page of a bay subscribes with /events?bay=<name>.
+The pages report the frame timing of the padlock animation, served back on /stats.
+"""
+
+import os
+import json
+import threading
+from typing import Any
+from urllib.parse import parse_qs, quote, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# hidden is not a MessageType: the page is blank while its window is hidden
+HIDDEN_STATE = "hidden"
+# a comment line is sent on idle streams so a dead client is noticed
+KEEP_ALIVE_INTERVAL = 15
+
+STATIC_FILES: dict[str, str] = {
+    "/display.html": "text/html; charset=utf-8",
+    "/styles.css": "text/css",
+    "/padlock.png": "image/png",
+}
+
+
+class DisplayServer(ThreadingHTTPServer):
+    """
+    HTTP server of the screen blocker page and of its state stream.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int, verbose: bool = False, animation: str = ""):
+        super().__init__(("127.0.0.1", port), DisplayHandler)
+        self.verbose: bool = verbose
+        # padlock animation query parameters of the page
+        self.animation: str = animation
+        self.folder: str = os.path.dirname(os.path.realpath(__file__))
+        self.states: dict[str, str] = {}
+        # last frame stats reported by the page of each bay
+        self.frameStats: dict[str, Any] = {}
+        self.version: int = 0
+        self.changed: threading.Condition = threading.Condition()
+        self.running: bool = True
+        self.thread: threading.Thread = threading.Thread(target=self.serve_forever, name="displayServer", daemon=True)
+        self.thread.start()
+
+    def url(self, bay: str) -> str:
+        url: str = f"http://127.0.0.1:{self.server_address[1]}/display.html?live=1&bay={quote(bay)}"
+        return f"{url}&{self.animation}" if self.animation else url
+
+    def state(self, bay: str) -> str:
+        return self.states.get(bay, HIDDEN_STATE)
+
+    def setState(self, state: str, bay: str) -> None:
+        """
+        Push a new state (a MessageType value or hidden) to every connected page of the bay.
+        """
+        with self.changed:
+            if state == self.state(bay):
+                return
+            self.states[bay] = state
+            self.version += 1
+            self.changed.notify_all()
+
+    def stop(self) -> None:
+        with self.changed:
+            self.running = False
+            self.changed.notify_all()
+        self.shutdown()
+        self.server_close()
+
+
+class DisplayHandler(BaseHTTPRequestHandler):
+
+    server: DisplayServer
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        path: str = url.path
+        if path == "/events":
+            self.streamEvents(parse_qs(url.query).get("bay", [""])[0])
+        elif path == "/stats":
+            self.sendContent("application/json", json.dumps(self.server.frameStats).encode())
+        elif path in STATIC_FILES:
+            self.sendFile(path)
+        else:
+            self.send_error(404)
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path != "/stats":
+            self.send_error(404)
+            return
+        try:
+            self.server.frameStats[parse_qs(url.query).get("bay", [""])[0]] = json.loads(body)
+        except ValueError:
+            self.send_error(400)
+            return
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def sendFile(self, path: str) -> None:
+        with open(os.path.join(self.server.folder, path.lstrip("/")), "rb") as file:
+            content: bytes = file.read()
+        self.sendContent(STATIC_FILES[path], content)
+
+    def sendContent(self, contentType: str, content: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(content)
+
+    def streamEvents(self, bay: str) -> None:
+        """
+        Send the current state of the bay, then every state change, until the page disconnects.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        server: DisplayServer = self.server
+        version: int = -1
+        sentState: str = ""
+        try:
+            while True:
+                with server.changed:
+                    idle: bool = False
+                    if server.version == version:
+                        server.changed.wait(KEEP_ALIVE_INTERVAL)
+                        idle = server.version == version
+                    if not server.running:
+                        return
+                    state, version = server.state(bay), server.version
+                if state != sentState:
+                    sentState = state
+                    self.wfile.write(f"data: {state}\n\n".encode())
+                    if (server.verbose):
+                        print(f"Display state sent to bay {bay}: {state}")
+                elif idle:
+                    self.wfile.write(b": keep-alive\n\n")
+                else:
+                    # another bay changed
+                    continue
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+# test module
+if __name__ == "__main__":
+    import http.client
+
+    server = DisplayServer(0, verbose=True)
+    port: int = server.server_address[1]
+
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", "/display.html?live=1")
+    response = connection.getresponse()
+    assert response.status == 200 and b"EventSource" in response.read()
+    connection.request("GET", "/../config.py")
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 404
+
+    def openStream(bay: str) -> http.client.HTTPResponse:
+        stream = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        stream.request("GET", f"/events?bay={bay}")
+        events = stream.getresponse()
+        assert events.getheader("Content-Type") == "text/event-stream"
+        return events
+
+    def nextEvent(events: http.client.HTTPResponse) -> str:
+        line: bytes = events.readline()
+        events.readline()
+        return line.decode().strip()
+
+    bay1, bay2 = openStream("1"), openStream("2")
+    assert nextEvent(bay1) == "data: hidden"
+    assert nextEvent(bay2) == "data: hidden"
+    server.setState("timesUp ", "1")
+    assert nextEvent(bay1) == "data: timesUp"
+    # each page only receives the state of its bay
+    server.setState("boot", "2")
+    assert nextEvent(bay2) == "data: boot"
+    server.setState("boot", "1")
+    assert nextEvent(bay1) == "data: boot"
+    assert server.url("bay 1").endswith("?live=1&bay=bay%201")
+    server.animation = "fps=30"
+    assert server.url("1").endswith("?live=1&bay=1&fps=30")
+
+    # frame stats reported by the pages
+    connection.request("POST", "/stats?bay=1", body=b'{"mode": "idle", "fps": 1.0}')
+    response = connection.getresponse()
+    response.read()
+    assert response.status == 204
+    connection.request("GET", "/stats")
+    response = connection.getresponse()
+    assert json.loads(response.read()) == {"1": {"mode": "idle", "fps": 1.0}}
+
+    bay1.close()
+    bay2.close()
+    server.stop()
+    print("Display server test finished.")
+    print()
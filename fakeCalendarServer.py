@@ -0,0 +1,673 @@
+"""
+This module is a local stand-in for the Google Calendar API v3, used to
+benchmark and test the daemon without a Google account.
+It serves events.list (timeMin/timeMax, singleEvents, orderBy, paging, sync
+tokens) for synthetic full size events, the service account OAuth token
+exchange and batch requests, with partial responses (fields=) and gzip like
+Google does. Latency, server errors, 429 throttling and hung requests can be
+injected. It counts the HTTP requests, the API calls and the bytes sent.
+usage: python fakeCalendarServer.py serve [port] [faults]
+       python fakeCalendarServer.py loadtest [seconds] [bays] [faults]
+faults: e.g. latency=0.2,error=0.05,throttle=0.05,hang=0.01
+"""
+
+import gzip
+import json
+import time
+import base64
+import random
+import threading
+from http import HTTPStatus
+from dataclasses import dataclass
+from email.parser import BytesParser
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EVENTS_PATH = "/calendar/v3/calendars/"
+BATCH_PATH = "/batch/calendar/v3"
+TOKEN_PATH = "/token"
+JWT_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:jwt-bearer"
+# google-auth addresses the assertions to Google whatever the token_uri of the key
+GOOGLE_TOKEN_AUDIENCE = "https://oauth2.googleapis.com/token"
+# events.list page size limits
+DEFAULT_MAX_RESULTS = 250
+MAX_MAX_RESULTS = 2500
+# lifetime of the issued access tokens, in seconds
+TOKEN_LIFETIME = 3600
+
+
+@dataclass
+class Faults:
+    """
+    Faults injected by the server, drawn at random for each request.
+    """
+    latency: float = 0  # seconds added to every HTTP request
+    errorRate: float = 0  # fraction of the API calls answered 503 backendError
+    throttleRate: float = 0  # fraction of the API calls answered 429 rateLimitExceeded
+    hangRate: float = 0  # fraction of the HTTP requests left unanswered for hangSeconds
+    hangSeconds: float = 60
+
+
+def parseFaults(text: str) -> Faults:
+    """
+    Parse "latency=0.2,error=0.05,throttle=0.05,hang=0.01" (any subset).
+    """
+    names: dict[str, str] = {"latency": "latency", "error": "errorRate", "throttle": "throttleRate", "hang": "hangRate"}
+    faults = Faults()
+    for item in filter(None, text.split(",")):
+        name, value = item.split("=", 1)
+        setattr(faults, names[name.strip()], float(value))
+    return faults
+
+
+def apiError(status: int, reason: str, message: str, domain: str = "global") -> dict[str, Any]:
+    """
+    An error response body as the Calendar API returns it.
+    """
+    return {"error": {
+        "errors": [{"domain": domain, "reason": reason, "message": message}], "code": status, "message": message}}
+
+
+def parseFields(fields: str) -> dict[str, Any]:
+    """
+    Parse a partial response selector, e.g. "items(id,start),nextPageToken",
+    into a tree: {"items": {"id": {}, "start": {}}, "nextPageToken": {}}.
+    """
+    tree: dict[str, Any] = {}
+    name: str = ""
+    depth: int = 0
+    sub: str = ""
+    for char in fields + ",":
+        if depth > 0:
+            if char == "(":
+                depth += 1
+            elif char == ")":
+                depth -= 1
+                if depth == 0:
+                    continue
+            sub += char
+        elif char == "(":
+            depth = 1
+        elif char == ",":
+            if name.strip():
+                tree[name.strip()] = parseFields(sub) if sub else {}
+            name, sub = "", ""
+        else:
+            name += char
+    return tree
+
+
+def selectFields(value: Any, tree: dict[str, Any]) -> Any:
+    """
+    Keep only the selected fields of a response.
+    """
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [selectFields(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {key: selectFields(value[key], subTree) for key, subTree in tree.items() if key in value}
+    return value
+
+
+def googleTime(moment: datetime) -> str:
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def fullEvent(eventId: str, calendarId: str, summary: str, start: datetime, end: datetime) -> dict[str, Any]:
+    """
+    A synthetic event resource with the fields Google returns when no fields= is given.
+    """
+    stamp: str = googleTime(start - timedelta(days=2))
+    return {
+        "kind": "calendar#event",
+        "etag": f"\"33{abs(hash(eventId)) % 10 ** 13:013d}\"",
+        "id": eventId,
+        "status": "confirmed",
+        "htmlLink": f"https://www.google.com/calendar/event?eid={eventId}bG9uZ2VuY29kZWRpZGVudGlmaWVy",
+        "created": stamp,
+        "updated": stamp,
+        "summary": summary,
+        "description": "Réservation Le Birdie - simulateur de golf / golf simulator booking",
+        "creator": {"email": "booking-system@example.com"},
+        "organizer": {"email": calendarId, "displayName": "Simulator", "self": True},
+        "start": {"dateTime": start.isoformat(), "timeZone": "America/Toronto"},
+        "end": {"dateTime": end.isoformat(), "timeZone": "America/Toronto"},
+        "iCalUID": f"{eventId}@google.com",
+        "sequence": 0,
+        "reminders": {"useDefault": True},
+        "eventType": "default",
+    }
+
+
+def eventStart(event: dict[str, Any]) -> datetime:
+    return datetime.fromisoformat(event["start"]["dateTime"])
+
+
+def eventEnd(event: dict[str, Any]) -> datetime:
+    return datetime.fromisoformat(event["end"]["dateTime"])
+
+
+class FakeCalendarServer(ThreadingHTTPServer):
+    """
+    Local Calendar API stand-in, started on a background thread.
+    Every change of an event is numbered: a sync token is the number of the last change it covers.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, faults: Optional[Faults] = None, seed: int = 0):
+        super().__init__(("127.0.0.1", port), FakeCalendarHandler)
+        self.events: dict[str, dict[str, dict[str, Any]]] = {}
+        # number of the last change of each event, by calendar
+        self.changes: dict[str, dict[str, int]] = {}
+        self.sequence: int = 0
+        # sync tokens older than this change number are answered 410 Gone
+        self.oldestSyncToken: int = 0
+        self.faults: Faults = faults if faults is not None else Faults()
+        self.random: random.Random = random.Random(seed)
+        # API calls need an access token issued by the token endpoint
+        self.requireToken: bool = False
+        self.tokens: dict[str, float] = {}
+        self.requests: int = 0
+        self.bytesSent: int = 0
+        self.calls: dict[str, int] = {}
+        self.injected: dict[str, int] = {}
+        self.lock: threading.Lock = threading.Lock()
+        self.stopping: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.serve_forever, name="fakeCalendar", daemon=True)
+        self.thread.start()
+
+    def rootUrl(self) -> str:
+        """
+        Root URL to give to the Calendar client, in place of https://www.googleapis.com/.
+        """
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def shutdown(self) -> None:
+        # hung requests are released
+        self.stopping.set()
+        super().shutdown()
+
+    def count(self, table: dict[str, int], key: str) -> None:
+        with self.lock:
+            table[key] = table.get(key, 0) + 1
+
+    def draw(self, rate: float) -> bool:
+        with self.lock:
+            return rate > 0 and self.random.random() < rate
+
+    def resetCounters(self) -> None:
+        with self.lock:
+            self.requests, self.bytesSent = 0, 0
+            self.calls, self.injected = {}, {}
+
+    def addEvent(self, calendarId: str, summary: str, start: datetime, end: datetime, eventId: Optional[str] = None) -> str:
+        with self.lock:
+            calendar = self.events.setdefault(calendarId, {})
+            eventId = eventId if eventId is not None else f"event{len(calendar):06d}"
+            calendar[eventId] = fullEvent(eventId, calendarId, summary, start, end)
+            self.changed(calendarId, eventId)
+        return eventId
+
+    def cancelEvent(self, calendarId: str, eventId: str) -> None:
+        """
+        Delete an event: like Google, it is kept as cancelled for the incremental syncs.
+        """
+        with self.lock:
+            self.events[calendarId][eventId]["status"] = "cancelled"
+            self.changed(calendarId, eventId)
+
+    def changed(self, calendarId: str, eventId: str) -> None:
+        self.sequence += 1
+        self.changes.setdefault(calendarId, {})[eventId] = self.sequence
+        self.events[calendarId][eventId]["updated"] = googleTime(datetime.now(timezone.utc))
+
+    def expireSyncTokens(self) -> None:
+        """
+        Invalidate every sync token issued so far: the clients must do a full sync.
+        """
+        with self.lock:
+            self.oldestSyncToken = self.sequence + 1
+
+    def issueToken(self) -> str:
+        with self.lock:
+            token: str = f"ya29.fake{len(self.tokens):06d}"
+            self.tokens[token] = time.time() + TOKEN_LIFETIME
+        return token
+
+    def tokenValid(self, authorization: str) -> bool:
+        if not self.requireToken:
+            return True
+        token: str = authorization[len("Bearer "):] if authorization.startswith("Bearer ") else ""
+        with self.lock:
+            return self.tokens.get(token, 0) > time.time()
+
+    def listEvents(self, calendarId: str, query: dict[str, str]) -> tuple[int, dict[str, Any]]:
+        """
+        events.list: returns the status and the response.
+        """
+        if calendarId not in self.events:
+            return 404, apiError(404, "notFound", "Not Found")
+        syncToken: Optional[str] = query.get("syncToken")
+        if syncToken is not None and any(name in query for name in ("timeMin", "timeMax", "orderBy", "q", "updatedMin")):
+            return 400, apiError(400, "invalid", "Sync token cannot be used with other filters.")
+        if query.get("orderBy") == "startTime" and query.get("singleEvents") != "true":
+            return 400, apiError(400, "invalid", "The requested ordering is not available for the particular query.")
+        maxResults: int = min(int(query.get("maxResults", DEFAULT_MAX_RESULTS)), MAX_MAX_RESULTS)
+
+        # a page token keeps the change number of the first page: changes made while paging go to the next sync
+        offset, sequence = (int(part) for part in query["pageToken"].split(".")) if "pageToken" in query else (0, -1)
+        with self.lock:
+            if sequence < 0:
+                sequence = self.sequence
+            changes: dict[str, int] = self.changes.get(calendarId, {})
+            if syncToken is not None:
+                if int(syncToken) < self.oldestSyncToken:
+                    return 410, apiError(410, "fullSyncRequired", "Sync token is no longer valid, a full sync is required.")
+                items: list[dict[str, Any]] = [
+                    event for eventId, event in self.events[calendarId].items()
+                    if int(syncToken) < changes[eventId] <= sequence
+                ]
+            else:
+                showDeleted: bool = query.get("showDeleted") == "true"
+                items = [
+                    event for event in self.events[calendarId].values() if showDeleted or event["status"] != "cancelled"
+                ]
+
+        if "timeMin" in query:
+            timeMin = datetime.fromisoformat(query["timeMin"])
+            items = [item for item in items if eventEnd(item) > timeMin]
+        if "timeMax" in query:
+            timeMax = datetime.fromisoformat(query["timeMax"])
+            items = [item for item in items if eventStart(item) < timeMax]
+        if query.get("orderBy") == "startTime":
+            items.sort(key=eventStart)
+        elif query.get("orderBy") == "updated":
+            items.sort(key=lambda item: item["updated"])
+
+        response: dict[str, Any] = {
+            "kind": "calendar#events",
+            "etag": "\"p33c9ddrr0ugpe0o\"",
+            "summary": calendarId,
+            "updated": googleTime(datetime.now(timezone.utc)),
+            "timeZone": "America/Toronto",
+            "accessRole": "reader",
+            "defaultReminders": [],
+            "items": items[offset:offset + maxResults],
+        }
+        if offset + maxResults < len(items):
+            response["nextPageToken"] = f"{offset + maxResults}.{sequence}"
+        else:
+            response["nextSyncToken"] = str(sequence)
+        return 200, response
+
+    def exchangeToken(self, form: dict[str, str]) -> tuple[int, dict[str, Any]]:
+        """
+        OAuth 2.0 token endpoint of the service accounts: a JWT assertion for an access token.
+        The assertion claims are checked, not its signature.
+        """
+        if form.get("grant_type") != JWT_GRANT_TYPE or "assertion" not in form:
+            return 400, {"error": "unsupported_grant_type", "error_description": "Invalid grant_type."}
+        try:
+            payload: str = form["assertion"].split(".")[1]
+            claims: dict[str, Any] = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except Exception:
+            return 400, {"error": "invalid_grant", "error_description": "Invalid JWT."}
+        audiences: tuple[str, str] = (GOOGLE_TOKEN_AUDIENCE, self.rootUrl() + TOKEN_PATH[1:])
+        if claims.get("aud") not in audiences or "calendar" not in claims.get("scope", ""):
+            return 400, {"error": "invalid_grant", "error_description": "Invalid JWT: audience or scope."}
+        if claims.get("exp", 0) < time.time():
+            return 400, {"error": "invalid_grant", "error_description": "Invalid JWT: token must be a short-lived token."}
+        return 200, {"access_token": self.issueToken(), "expires_in": TOKEN_LIFETIME, "token_type": "Bearer"}
+
+    def writeServiceAccountKey(self, path: str) -> None:
+        """
+        Write a service account key file whose token exchange goes to this server,
+        with a freshly generated RSA key so google-auth can sign its assertions.
+        """
+        import rsa
+        _, privateKey = rsa.newkeys(1024)
+        key: dict[str, str] = {
+            "type": "service_account",
+            "project_id": "fake-project",
+            "private_key_id": "fake",
+            "private_key": privateKey.save_pkcs1().decode(),
+            "client_email": "screenblocker@fake-project.iam.gserviceaccount.com",
+            "client_id": "100000000000000000000",
+            "token_uri": self.rootUrl() + TOKEN_PATH[1:],
+        }
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(key, file)
+
+
+class FakeCalendarHandler(BaseHTTPRequestHandler):
+
+    server: FakeCalendarServer
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately: avoid the delayed ACK stall on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def do_GET(self) -> None:
+        if not self.injectDelay():
+            return
+        if not self.server.tokenValid(self.headers.get("Authorization", "")):
+            self.sendJson(401, apiError(401, "authError", "Invalid Credentials"))
+            return
+        status, response = self.route("GET", self.path)
+        self.sendJson(status, response)
+
+    def do_POST(self) -> None:
+        body: bytes = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if not self.injectDelay():
+            return
+        path: str = urlparse(self.path).path
+        if path == TOKEN_PATH:
+            self.server.count(self.server.calls, "token")
+            status, response = self.server.exchangeToken(
+                {key: values[0] for key, values in parse_qs(body.decode()).items()})
+            self.sendJson(status, response)
+        elif not self.server.tokenValid(self.headers.get("Authorization", "")):
+            self.sendJson(401, apiError(401, "authError", "Invalid Credentials"))
+        elif path == BATCH_PATH:
+            self.server.count(self.server.calls, "batch")
+            self.sendBatch(body)
+        else:
+            self.sendJson(404, apiError(404, "notFound", "Not Found"))
+
+    def injectDelay(self) -> bool:
+        """
+        Apply the latency, and the hangs: returns False if the request is left unanswered.
+        """
+        faults: Faults = self.server.faults
+        if faults.latency > 0:
+            time.sleep(faults.latency)
+        if self.server.draw(faults.hangRate):
+            self.server.count(self.server.injected, "hang")
+            self.server.stopping.wait(faults.hangSeconds)
+            self.close_connection = True
+            return False
+        return True
+
+    def route(self, method: str, path: str) -> tuple[int, Any]:
+        """
+        Returns the status and the response of an API call.
+        """
+        url = urlparse(path)
+        query: dict[str, str] = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if method == "GET" and url.path.startswith(EVENTS_PATH) and url.path.endswith("/events"):
+            faults: Faults = self.server.faults
+            if self.server.draw(faults.throttleRate):
+                self.server.count(self.server.injected, "throttle")
+                return 429, apiError(429, "rateLimitExceeded", "Rate Limit Exceeded", "usageLimits")
+            if self.server.draw(faults.errorRate):
+                self.server.count(self.server.injected, "error")
+                return 503, apiError(503, "backendError", "Backend Error")
+            self.server.count(self.server.calls, "list (sync)" if "syncToken" in query else "list")
+            calendarId: str = unquote(url.path[len(EVENTS_PATH):-len("/events")])
+            status, response = self.server.listEvents(calendarId, query)
+            if status == 200 and "fields" in query:
+                response = selectFields(response, parseFields(query["fields"]))
+            return status, response
+        return 404, apiError(404, "notFound", "Not Found")
+
+    def sendBatch(self, body: bytes) -> None:
+        """
+        Answer a multipart/mixed batch request: each part is a whole HTTP request.
+        """
+        contentType: str = self.headers.get("Content-Type", "")
+        message = BytesParser().parsebytes(f"Content-Type: {contentType}\r\n\r\n".encode() + body)
+        boundary: str = "batch_boundary"
+        parts: list[str] = []
+        for part in message.get_payload():
+            requestLine: str = part.get_payload().split("\n", 1)[0]
+            method, path, _ = requestLine.split(" ", 2)
+            status, response = self.route(method, path)
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:-1]}>\r\n\r\n"
+                f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                f"Content-Type: application/json; charset=UTF-8\r\n\r\n{json.dumps(response)}\r\n"
+            )
+        content: bytes = ("".join(parts) + f"--{boundary}--\r\n").encode()
+        self.sendBody(200, f"multipart/mixed; boundary={boundary}", content)
+
+    def sendJson(self, status: int, response: Any) -> None:
+        self.sendBody(status, "application/json; charset=UTF-8", json.dumps(response).encode())
+
+    def sendBody(self, status: int, contentType: str, body: bytes) -> None:
+        # like Google, gzip needs both the Accept-Encoding header and "gzip" in the User-Agent
+        compressed: bool = (
+            "gzip" in self.headers.get("Accept-Encoding", "")
+            and "gzip" in self.headers.get("User-Agent", "")
+        )
+        if compressed:
+            body = gzip.compress(body)
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        # counted before the client can read the response
+        with self.server.lock:
+            self.server.requests += 1
+            self.server.bytesSent += len(body)
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(port: int, faults: Faults) -> None:
+    """
+    Serve the calendars of the configured bays, each with a 10 minutes booking every 20 minutes,
+    and print the configuration pointing the daemon at the server.
+    """
+    import os
+    from config import loadConfig
+
+    cfg = loadConfig()
+    server = FakeCalendarServer(port, faults)
+    server.requireToken = True
+    now = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+    for calendarId in cfg.calendarIds():
+        for index in range(-3, 72):
+            start = now + timedelta(minutes=20 * index)
+            server.addEvent(calendarId, f"Booking {index}", start, start + timedelta(minutes=10))
+    keyPath = os.path.abspath("fakeServiceAccount.json")
+    server.writeServiceAccountKey(keyPath)
+    print(f"Fake Calendar API on {server.rootUrl()} ({faults}), in screenBlockerConfig.cfg:")
+    print(f"[google]\nserviceAccountJsonPath = {keyPath}\napi_root_url = {server.rootUrl()}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"{server.requests} HTTP requests, API calls: {server.calls}, injected faults: {server.injected}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+def loadTest(duration: float, bays: int, faults: Faults, seed: int = 0) -> None:
+    """
+    End to end load test of the daemon (Chrome excepted): the calendar fetcher with the real Google client
+    and token exchange, and the planner, against the server with injected faults while bookings are added
+    and cancelled. Reports the API call volume and how late the transitions were compared to an ideal
+    daemon knowing every change instantly.
+    """
+    import os
+    import tempfile
+    from calendarFetcher import CalendarFetcher, Schedule
+    from config import BayConfig, Config
+    from metrics import calendarApiErrors
+    from replay import Change, Day, lateness, mismatchSeconds, percentile, replay
+    from scheduler import Action, Booking, Planner
+
+    rng = random.Random(seed)
+    server = FakeCalendarServer(faults=faults, seed=seed)
+    server.requireToken = True
+    directory = tempfile.mkdtemp()
+    keyPath = os.path.join(directory, "serviceAccount.json")
+    server.writeServiceAccountKey(keyPath)
+    # a booking every 3 seconds is far beyond a real bay: the adaptive refresh is kept within a minute
+    cfg = Config(serviceAccountJsonPath=keyPath, apiRootUrl=server.rootUrl(), refreshMaxSeconds=60,
+                 bays=[BayConfig(f"bay{index + 1}", f"bay{index + 1}@fake") for index in range(bays)])
+    calendarBays: dict[str, str] = {bay.calendarId: bay.name for bay in cfg.bays}
+
+    # bookings of whole seconds: the replay compares them with the fetched ones
+    start: float = float(int(time.time()))
+    end: float = start + duration
+    live: dict[str, dict[str, Booking]] = {bay.name: {} for bay in cfg.bays}
+    initial: dict[str, list[Booking]] = {bay.name: [] for bay in cfg.bays}
+    changes: list[Change] = []
+
+    def book(bay: BayConfig, bookingStart: float, index: int) -> Booking:
+        booking = Booking(bookingStart, bookingStart + rng.randint(1, 4) * 60, f"Booking {index}")
+        eventId: str = server.addEvent(bay.calendarId, booking.summary, datetime.fromtimestamp(booking.start, timezone.utc),
+                                       datetime.fromtimestamp(booking.end, timezone.utc))
+        live[bay.name][eventId] = booking
+        return booking
+
+    for bay in cfg.bays:
+        cursor: float = start - 600
+        while cursor < end + 600:
+            initial[bay.name].append(book(bay, cursor, len(live[bay.name])))
+            cursor = initial[bay.name][-1].end + rng.choice((0, 0, 60, 420, 600))
+
+    stopChurn = threading.Event()
+
+    def churn() -> None:
+        # every 3 seconds a bay gets a booking starting within 6 minutes, or loses its current or next one
+        while not stopChurn.wait(3):
+            bay: BayConfig = rng.choice(cfg.bays)
+            upcoming: list[str] = [eventId for eventId, booking in live[bay.name].items() if booking.end > time.time()]
+            if rng.random() < 0.5 and upcoming:
+                eventId: str = min(upcoming, key=lambda eventId: live[bay.name][eventId].start)
+                server.cancelEvent(bay.calendarId, eventId)
+                changes.append(Change(time.time(), bay.name, live[bay.name].pop(eventId), True))
+            else:
+                bookingStart: float = float(int(time.time())) + rng.randint(0, 6) * 60
+                booking: Booking = book(bay, bookingStart, len(server.events[bay.calendarId]))
+                changes.append(Change(time.time(), bay.name, booking, False))
+
+    planner = Planner()
+    fetcher = CalendarFetcher(cfg, Schedule({}, 0, True), lambda published: planner.scheduler.wakeUp.set(),
+                              snapshotFile=os.path.join(directory, "schedule.json"))
+    server.resetCounters()
+    threading.Thread(target=churn, name="churn", daemon=True).start()
+    fetcher.start()
+    print(f"Load test: {bays} bays, {duration:.0f} s, {faults}")
+
+    timeline: list[Action] = []
+    schedule: Schedule = fetcher.schedule
+    fetches: int = 0
+    bookings: Optional[dict[str, list[Booking]]] = {bay.name: [] for bay in cfg.bays}
+    while planner.clock.now() < end:
+        if fetcher.schedule is not schedule:
+            schedule = fetcher.schedule
+            fetches += 1
+            bookings = {calendarBays[calendarId]: list(events) for calendarId, events in schedule.calendars.items()}
+        timeline += [action for action in planner.step(bookings) if not action.enforce]
+        bookings = None
+        planner.wait(end)
+    stopChurn.set()
+    fetcher.stop()
+    server.shutdown()
+
+    ideal = replay(Day(start, end, initial, [change for change in changes if change.time < end]), None)
+    late, missed = lateness(ideal.timeline, timeline)
+    mismatch: float = mismatchSeconds(ideal.timeline, timeline, start, end)
+    minutes: float = duration / 60
+    print(f"API: {server.requests} HTTP requests ({server.requests / minutes:.1f}/min), "
+          f"{server.bytesSent / 1024:.0f} kB sent, calls: {dict(sorted(server.calls.items()))}")
+    clientErrors: dict[str, float] = {labels[0][1]: value for labels, value in sorted(calendarApiErrors.values.items())}
+    print(f"Injected faults: {dict(sorted(server.injected.items()))}, client errors: {clientErrors}, "
+          f"schedules published: {fetches}")
+    print(f"Transitions: {len(ideal.timeline)} ideal, {len(timeline)} done, {missed} missed, "
+          f"{len(changes)} calendar changes")
+    print(f"Lateness vs ideal: p50 {percentile(late, 0.5):.1f} s, p95 {percentile(late, 0.95):.1f} s, "
+          f"max {max(late, default=0):.1f} s, wrong state {mismatch / (duration * bays) * 100:.2f} % of the bay time")
+
+
+# test module
+if __name__ == "__main__":
+    import sys
+    import urllib.error
+    import urllib.request
+    from urllib.parse import urlencode
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(int(sys.argv[2]) if len(sys.argv) > 2 else 8081, parseFaults(sys.argv[3] if len(sys.argv) > 3 else ""))
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "loadtest":
+        loadTest(float(sys.argv[2]) if len(sys.argv) > 2 else 120, int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+                 parseFaults(sys.argv[4] if len(sys.argv) > 4 else "latency=0.05,error=0.05,throttle=0.05,hang=0.02"))
+        sys.exit(0)
+
+    def get(url: str, token: Optional[str] = None) -> tuple[int, Any]:
+        request = urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"} if token else {})
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read())
+
+    assert parseFields("items(id,start(dateTime)),nextSyncToken") == {
+        "items": {"id": {}, "start": {"dateTime": {}}}, "nextSyncToken": {}}
+    assert parseFaults("latency=0.2,throttle=0.5") == Faults(latency=0.2, throttleRate=0.5)
+
+    server = FakeCalendarServer()
+    now = datetime.now(timezone.utc)
+    later = server.addEvent("bay", "later", now + timedelta(hours=1), now + timedelta(hours=2))
+    server.addEvent("bay", "booking", now, now + timedelta(minutes=15))
+    events = f"{server.rootUrl()}calendar/v3/calendars/bay/events"
+
+    status, data = get(f"{events}?fields=items(id,summary),nextSyncToken")
+    assert (status, data) == (200, {"items": [{"id": "event000000", "summary": "later"},
+                                              {"id": "event000001", "summary": "booking"}], "nextSyncToken": "2"})
+    assert server.requests == 1
+
+    # ordered by start, time range and paging
+    window = urlencode({"timeMin": now.isoformat(), "timeMax": (now + timedelta(hours=3)).isoformat()})
+    status, data = get(f"{events}?singleEvents=true&orderBy=startTime&maxResults=1&{window}")
+    assert data["items"][0]["summary"] == "booking" and data["nextPageToken"] == "1.2" and "nextSyncToken" not in data
+    server.cancelEvent("bay", later)
+    status, data = get(f"{events}?singleEvents=true&orderBy=startTime&maxResults=1&pageToken=1.2&{window}")
+    assert data["items"] == [] and data["nextSyncToken"] == "2"
+    assert get(f"{events}?orderBy=startTime")[0] == 400
+
+    # sync tokens: only the changes, deletions included, and 410 once expired
+    status, data = get(f"{events}?syncToken=2&fields=items(id,status),nextSyncToken")
+    assert data == {"items": [{"id": later, "status": "cancelled"}], "nextSyncToken": "3"}
+    assert get(f"{events}?syncToken=2&{window}")[0] == 400
+    server.expireSyncTokens()
+    assert get(f"{events}?syncToken=3")[0] == 410
+
+    # token exchange and authenticated calls
+    server.requireToken = True
+    assert get(events)[0] == 401
+    claims = {"aud": GOOGLE_TOKEN_AUDIENCE, "scope": "https://www.googleapis.com/auth/calendar", "exp": time.time() + 60}
+    assertion = "e30." + base64.urlsafe_b64encode(json.dumps(claims).encode()).decode().rstrip("=") + ".c2ln"
+    form = urlencode({"grant_type": JWT_GRANT_TYPE, "assertion": assertion}).encode()
+    with urllib.request.urlopen(f"{server.rootUrl()}token", form, timeout=5) as response:
+        token = json.loads(response.read())["access_token"]
+    assert get(events, token)[0] == 200
+
+    # injected faults
+    server.faults = Faults(throttleRate=1)
+    status, data = get(events, token)
+    assert status == 429 and data["error"]["errors"][0]["reason"] == "rateLimitExceeded"
+    server.faults = Faults(hangRate=1, hangSeconds=0.2)
+    started = time.monotonic()
+    try:
+        get(events, token)
+        assert False, "a hung request is never answered"
+    except Exception:
+        pass
+    assert time.monotonic() - started >= 0.2
+    assert server.injected == {"throttle": 1, "hang": 1}, server.injected
+
+    server.shutdown()
+    print("Fake calendar server test finished.")
+    print()
@@ -1,85 +1,335 @@
 
+import os
+import json
 import time
+import threading
+import httplib2
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp, Request
+from googleapiclient.discovery import build_from_document
 from googleapiclient.errors import HttpError
-from typings_google_calendar_api.events import Event
 from typing import Any, Optional, Tuple
 from datetime import datetime, timedelta, timezone
 from config import Config
+from scheduleCache import EVENT_FIELDS, ScheduleCache
+from metrics import calendarApiErrors, calendarApiSeconds
+from scheduler import Booking
 
 SCOPES = ['https://www.googleapis.com/auth/calendar']
+# the next event is only reported if it starts within this delay
+LOOK_AHEAD = timedelta(minutes=10)
+# socket timeout of the Calendar API requests, in seconds
+REQUEST_TIMEOUT = 10
+# the access token is refreshed this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 5 * 60
+# delay before trying again a failed token refresh, in seconds
+TOKEN_RETRY_DELAY = 30
+# trimmed Calendar v3 discovery document: only the methods used by the daemon
+DISCOVERY_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "calendarDiscovery.json")
 
+# the Calendar API accepts at most this many requests in a batch request
+BATCH_LIMIT = 50
 
-def getCalendarService(cfg: Config) -> Any:  # google build is impossible to type
+scheduleCaches: dict[str, ScheduleCache] = {}
+tokenRefresher: Optional["TokenRefresher"] = None
+
+
+class TokenRefresher:
+    """
+    Refreshes the service account access token from a background thread before it expires,
+    so no Calendar API call pays for the token exchange.
+    """
+
+    def __init__(self, keyPath: str, credentials: Any, verbose: bool = False):
+        self.keyPath: str = keyPath
+        self.credentials: Any = credentials
+        self.verbose: bool = verbose
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.run, name="tokenRefresher", daemon=True)
+        self.thread.start()
+
+    def run(self) -> None:
+        request = Request(httplib2.Http(timeout=REQUEST_TIMEOUT))
+        delay: float = 0
+        while not self.stopped.wait(delay):
+            try:
+                self.credentials.refresh(request)
+                # google-auth keeps the expiry as a naive UTC datetime
+                now: datetime = datetime.now(timezone.utc).replace(tzinfo=None)
+                expiresIn: float = (self.credentials.expiry - now).total_seconds()
+                delay = max(expiresIn - TOKEN_REFRESH_MARGIN, TOKEN_RETRY_DELAY)
+                if (self.verbose):
+                    print(f"Google access token refreshed, next refresh in {delay / 60:.0f} minutes")
+            except Exception as e:
+                print(f"Error refreshing the Google access token: {e}")
+                delay = TOKEN_RETRY_DELAY
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def getCredentials(cfg: Config) -> Any:
+    """
+    Returns the service account credentials, loaded once and kept fresh by the token refresher.
+    """
+    global tokenRefresher
+
+    if tokenRefresher is None or tokenRefresher.keyPath != cfg.serviceAccountJsonPath:
+        credentials = service_account.Credentials.from_service_account_file(cfg.serviceAccountJsonPath, scopes=SCOPES)
+        if tokenRefresher is not None:
+            tokenRefresher.stop()
+        tokenRefresher = TokenRefresher(cfg.serviceAccountJsonPath, credentials, cfg.verbose)
+    return tokenRefresher.credentials
+
+
+def buildCalendarService(credentials: Any, rootUrl: Optional[str] = None) -> Any:
+    """
+    Build the Calendar API service from the bundled discovery document (no discovery
+    request, cheap build), on a single keep-alive HTTP connection with a socket timeout.
+    rootUrl replaces https://www.googleapis.com/ for the API and the batch requests (local test server).
+    """
+    with open(DISCOVERY_FILE, "r", encoding="utf-8") as file:
+        discovery: dict[str, Any] = json.load(file)
+    if rootUrl:
+        # client_options api_endpoint would not move the batch endpoint
+        discovery["rootUrl"] = rootUrl
+        discovery["baseUrl"] = rootUrl + discovery["servicePath"]
+    http = AuthorizedHttp(credentials, http=httplib2.Http(timeout=REQUEST_TIMEOUT))
+    return build_from_document(discovery, http=http)
+
+
+def getCalendarService(cfg: Config, retry: bool = True) -> Any:  # google build is impossible to type
     """
     Try to build and return the Google Calendar API service using service account credentials.
-    Retries every 30 seconds if connection fails.
+    Retries every 30 seconds if connection fails, or returns None if retry is False.
     """
     while True:
         try:
             # Load credentials from the JSON file
-            credentials = service_account.Credentials.from_service_account_file(cfg.serviceAccountJsonPath, scopes=SCOPES)
-            serviceInstance = build("calendar", "v3", credentials=credentials)
+            serviceInstance = buildCalendarService(getCredentials(cfg), cfg.apiRootUrl or None)
             print("Google Calendar service initialized successfully.")
             return serviceInstance
         except Exception as e:
             print(f"Error initializing Google Calendar service: {e}")
+            calendarApiErrors.inc(kind="service")
+            if not retry:
+                return None
             print("Retrying in 30 seconds...")
             time.sleep(30)
 
 
-def getEvents(cfg: Config, calendarService: Any) -> Tuple[Optional[Event], Optional[Event]]:
+def refreshSchedules(cfg: Config, calendarService: Any,
+                     refreshIds: Optional[list[str]] = None) -> Tuple[Optional[dict[str, ScheduleCache]], int]:
     """
-    Returns a tuple: (currentEvent, nextEvent) by checking only a narrow time window.
+    Bring the schedule cache of every calendar (or of the refreshIds calendars and those never fetched)
+    up to date, using incremental sync after the first full fetch.
+    With several calendars, their requests are sent together in one HTTP batch request.
+    Returns the caches of every calendar by calendar ID, or None if a Calendar API call failed, and the
+    HTTP status of the failure (0 after a success or an error without HTTP answer). The status is returned
+    rather than kept in a global: a request abandoned at its deadline may still fail after the next one.
     """
-    now: datetime = datetime.now(timezone.utc)
-    timeMin: datetime = now - timedelta(minutes=1)
-    timeMax: datetime = now + timedelta(minutes=10)
+    calendarIds: list[str] = cfg.calendarIds()
+    for calendarId in list(scheduleCaches):
+        if calendarId not in calendarIds:
+            del scheduleCaches[calendarId]
+    for calendarId in calendarIds:
+        if calendarId not in scheduleCaches:
+            scheduleCaches[calendarId] = ScheduleCache(calendarId, cfg.verbose)
+    caches: list[ScheduleCache] = [scheduleCaches[calendarId] for calendarId in calendarIds]
+    refreshed: list[ScheduleCache] = [
+        cache for cache in caches if refreshIds is None or cache.calendarId in refreshIds or cache.syncToken is None
+    ]
 
+    batchRequests: int = 0
     try:
-        events: list[Event] = calendarService.events().list(
-            calendarId=cfg.calendarId,
-            timeMin=timeMin.isoformat(),
-            timeMax=timeMax.isoformat(),
-            singleEvents=True,
-            orderBy="startTime"
-        ).execute().get("items", [])
+        if len(refreshed) == 1:
+            refreshed[0].refresh(calendarService)
+        elif refreshed:
+            batchRequests = batchRefresh(calendarService, refreshed)
     except HttpError as he:
         print(f"HTTP error during Calendar API call: {he}")
-        return None, None
+        calendarApiErrors.inc(kind="http")
+        return None, he.resp.status
     except Exception as e:
         print(f"Error fetching events: {e}")
+        calendarApiErrors.inc(kind="other")
+        return None, 0
+
+    if (cfg.verbose):
+        print(f"Events in cache: {sum(len(cache.orderedEvents) for cache in caches)} in {len(caches)} calendars, "
+              f"{len(refreshed)} refreshed "
+              f"(API calls: {sum(cache.apiCalls for cache in caches)}, batch requests: {batchRequests})")
+
+    return {cache.calendarId: cache for cache in caches}, 0
+
+
+def batchRefresh(calendarService: Any, caches: list[ScheduleCache]) -> int:
+    """
+    Refresh several schedule caches together: each round sends the next page of every
+    unfinished refresh in one batch request (BATCH_LIMIT requests at most per batch).
+    An error on a calendar does not stop the others, it is raised at the end.
+    Returns the number of batch requests sent.
+    """
+    batchRequests: int = 0
+    for cache in caches:
+        cache.beginRefresh()
+
+    failure: Optional[Exception] = None
+    pending: list[ScheduleCache] = caches
+    while pending:
+        results: dict[str, Tuple[Any, Optional[Exception]]] = {}
+
+        def storeResult(requestId: str, response: Any, exception: Optional[Exception]) -> None:
+            results[requestId] = (response, exception)
+
+        for first in range(0, len(pending), BATCH_LIMIT):
+            batch = calendarService.new_batch_http_request(callback=storeResult)
+            for cache in pending[first:first + BATCH_LIMIT]:
+                batch.add(cache.nextRequest(calendarService), request_id=cache.calendarId)
+            batchRequests += 1
+            started: float = time.monotonic()
+            try:
+                batch.execute()
+            finally:
+                calendarApiSeconds.observe(time.monotonic() - started, request="batch")
+
+        unfinished: list[ScheduleCache] = []
+        for cache in pending:
+            response, exception = results[cache.calendarId]
+            try:
+                if exception is not None:
+                    # an expired sync token restarts the refresh of this calendar, other errors are raised
+                    cache.handleError(exception)
+                    unfinished.append(cache)
+                elif not cache.handleResponse(response):
+                    unfinished.append(cache)
+            except Exception as e:
+                print(f"Error fetching events of calendar {cache.calendarId}: {e}")
+                failure = e
+        pending = unfinished
+
+    if failure is not None:
+        raise failure
+    return batchRequests
+
+
+def getEvents(cfg: Config, calendarService: Any) -> Tuple[Optional[Booking], Optional[Booking]]:
+    """
+    Returns a tuple: (currentEvent, nextEvent) of the first calendar from the local schedule cache.
+    """
+    caches, _ = refreshSchedules(cfg, calendarService)
+    if caches is None:
         return None, None
 
-    currentEvent: Optional[Event] = None
-    nextEvent: Optional[Event] = None
+    now: float = time.time()
+    currentEvent, nextEvent = caches[cfg.calendarIds()[0]].getEvents(now, LOOK_AHEAD.total_seconds())
 
     if (cfg.verbose):
-        print(f"Events found in the next 10 minutes: {len(events)}")
+        for event in (currentEvent, nextEvent):
+            if event is not None:
+                print(f"Event: {event.summary} ({event.eventId}) - Start: {datetime.fromtimestamp(event.start)} "
+                      f"- End: {datetime.fromtimestamp(event.end)}")
+
+    return currentEvent, nextEvent
+
+
+def getBookings(cfg: Config, calendarService: Any,
+                refreshIds: Optional[list[str]] = None) -> Tuple[Optional[dict[str, list[Booking]]], int]:
+    """
+    Returns the bookings of every calendar (by calendar ID) known by the local schedule caches,
+    after refreshing the refreshIds calendars (all by default), or None if the Calendar API call failed,
+    and the HTTP status of the failure (see refreshSchedules).
+    """
+    caches, status = refreshSchedules(cfg, calendarService, refreshIds)
+    if caches is None:
+        return None, status
+
+    # the events were converted to bookings when they were received
+    return {calendarId: cache.orderedEvents for calendarId, cache in caches.items()}, 0
+
+
+def resetSchedule() -> None:
+    """
+    Forget the schedule caches, the next refresh does a full fetch.
+    """
+    scheduleCaches.clear()
+
+
+def lastChangedEvents() -> int:
+    """
+    Returns the number of events changed by the last incremental sync, in every calendar.
+    """
+    return sum(cache.lastChanges for cache in scheduleCaches.values())
 
-    for event in events:
-        startStr: str = event["start"].get("dateTime", event["start"].get("date"))
-        endStr: str = event["end"].get("dateTime", event["end"].get("date"))
-        startTime: datetime = datetime.fromisoformat(startStr)
-        endTime: datetime = datetime.fromisoformat(endStr)
 
-        if (cfg.verbose):
-            print(f"Event: {event['summary']} - Start: {startTime} - End: {endTime}")
+def benchmark() -> None:
+    """
+    Compare the former client (full discovery build, full event resources) with the lean one
+    (bundled trimmed discovery, fields= partial responses) against the local stand-in server.
+    """
+    from googleapiclient.discovery import build
+    from google.auth.credentials import AnonymousCredentials
+    from fakeCalendarServer import FakeCalendarServer
 
-        if endTime <= now:
-            continue
+    server = FakeCalendarServer()
+    now = datetime.now(timezone.utc)
+    for index in range(30):
+        start = now + timedelta(minutes=15 * index)
+        server.addEvent("bay", f"Booking {index}", start, start + timedelta(minutes=15))
+
+    calls = 50
+    for name in ("former", "lean"):
+        started = time.perf_counter()
+        if name == "former":
+            http = AuthorizedHttp(AnonymousCredentials(), http=httplib2.Http(timeout=REQUEST_TIMEOUT))
+            service = build("calendar", "v3", http=http,
+                            client_options={"api_endpoint": server.rootUrl() + "calendar/v3/"})
+            query: dict[str, Any] = {}
         else:
-            if startTime <= now:
-                currentEvent = event
-            elif nextEvent is None:
-                nextEvent = event
+            service = buildCalendarService(AnonymousCredentials(), server.rootUrl())
+            query = {"fields": EVENT_FIELDS}
+        buildTime = time.perf_counter() - started
 
-    return currentEvent, nextEvent
+        server.requests, server.bytesSent = 0, 0
+        started = time.perf_counter()
+        for _ in range(calls):
+            service.events().list(calendarId="bay", singleEvents=True, **query).execute()
+        callTime = (time.perf_counter() - started) / calls
+        print(f"{name:7s} build: {buildTime * 1000:6.1f} ms | per call: {callTime * 1000:5.2f} ms"
+              f" | {server.bytesSent / server.requests:7.0f} bytes per response (gzip)")
+
+    # multi-bay: one request per calendar and per refresh, or one batch request for all the calendars
+    from config import BayConfig, Config
+    for bays in (1, 6, 24):
+        cfg = Config(bays=[BayConfig(str(bay), f"bay{bay}") for bay in range(bays)])
+        for bay in cfg.bays:
+            for index in range(30):
+                start = now + timedelta(minutes=15 * index)
+                server.addEvent(bay.calendarId, f"Booking {index}", start, start + timedelta(minutes=15))
+        for name in ("separate", "batch"):
+            resetSchedule()
+            server.requests = 0
+            started = time.perf_counter()
+            for _ in range(10):
+                if name == "separate":
+                    for calendarId in cfg.calendarIds():
+                        ScheduleCache(calendarId).refresh(service)
+                else:
+                    assert refreshSchedules(cfg, service)[0] is not None
+            refreshTime = (time.perf_counter() - started) / 10
+            print(f"{bays:2d} bays {name:8s}: {refreshTime * 1000:6.1f} ms and "
+                  f"{server.requests / 10:4.1f} HTTP requests per refresh")
+
+    server.shutdown()
 
 
 # test module
 if __name__ == "__main__":
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
     from config import loadConfig
     cfg = loadConfig()
     calendarService = getCalendarService(cfg)
@@ -1,13 +1,24 @@
 import os
 import sys
+import json
+import time
+import queue
+import atexit
+import threading
 import traceback
 from pathlib import Path
 from io import TextIOWrapper
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from typing import Any, Optional, TextIO, Tuple, Type, Union
 
 LOG_FOLDER = Path('logs')
 KEEP_LOGS_FOR_DAYS = 30
+# a log file reaching this size is moved to YYYY-MM-DD.1.log (then .2, .3...) and started again
+MAX_LOG_FILE_BYTES = 20 * 1024 * 1024
+# the writer thread writes at most this many messages between two flushes
+WRITE_BATCH_SIZE = 512
+# seconds the exit and exception handlers wait for the queued messages to be written
+DRAIN_TIMEOUT = 5
 
 if not LOG_FOLDER.exists():
     os.makedirs(LOG_FOLDER)
@@ -25,12 +36,14 @@ def touchFile(path: Union[str, Path]) -> None:
 def purge_old_logs() -> None:
     '''
     Delete log files older than KEEP_LOGS_FOR_DAYS based on the date extracted from the file name.
-    Expected file name format: YYYY-MM-DD.log
+    Expected file name format: YYYY-MM-DD.log, YYYY-MM-DD.N.log or YYYY-MM-DD.jsonl
     '''
     cutoff_date = datetime.now() - timedelta(days=KEEP_LOGS_FOR_DAYS)
-    for logfile in LOG_FOLDER.glob("*.log"):
+    for logfile in LOG_FOLDER.iterdir():
+        if logfile.suffix not in (".log", ".jsonl"):
+            continue
         try:
-            file_date = datetime.strptime(logfile.stem, "%Y-%m-%d")
+            file_date = datetime.strptime(logfile.name.split(".", 1)[0], "%Y-%m-%d")
             if file_date < cutoff_date:
                 logfile.unlink()
         except Exception as e:
@@ -38,29 +51,50 @@ def purge_old_logs() -> None:
 
 
 class Logger(object):
+    '''
+    Replaces sys.stdout: every print is timestamped and written to the terminal and to the log file of the day.
+    In asynchronous mode (default) print only queues the message: a background thread formats and
+    writes the messages in batches, rotates the file by day and size and purges the old files.
+    With jsonLines, the file is YYYY-MM-DD.jsonl with one JSON object per line instead of YYYY-MM-DD.log.
+    '''
     # singleton, this class cannot exist twice
     __shared_state: dict = {}
 
-    def __init__(self, moduleName: str, doFileLogging: bool = True):
+    def __init__(self, moduleName: str, doFileLogging: bool = True, asynchronous: bool = True):
         # singleton
         self.__dict__ = self.__shared_state
+        if self.__dict__.get("started"):
+            # already logging: a single writer for the whole process
+            return
+        self.started: bool = True
 
         self.doFileLogging: bool = doFileLogging
-        self.formatFile: str = "%Y-%m-%d.log"
-        self.now: datetime = datetime.now()
-        self.fileName: str = self.now.strftime(self.formatFile)
-        self.file: Path = LOG_FOLDER / self.fileName
+        self.asynchronous: bool = asynchronous
+        self.jsonLines: bool = False
+        self.maxBytes: int = MAX_LOG_FILE_BYTES
         self.moduleName: str = moduleName
         # save then override terminal
         self.terminal: TextIO = sys.__stdout__
         sys.stdout = self
 
+        # state of the writer: only used by the writer thread (or under the lock in synchronous mode)
+        self.file: Optional[Path] = None
         self.log: Optional[TextIOWrapper] = None
-        if self.doFileLogging:
-            # Purge logs older than 30 days before creating/opening today's log file.
-            purge_old_logs()
-            touchFile(self.file)
-            self.log = open(self.file, "a")
+        self.fileDay: Optional[date] = None
+        self.fileJson: bool = False
+        self.nextDayStart: float = 0
+        self.fileBytes: int = 0
+        self.partialLine: str = ""
+        self.cachedSecond: int = -1
+        self.cachedTime: str = ""
+        self.writeLock: threading.Lock = threading.Lock()
+
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+        if self.asynchronous:
+            self.thread = threading.Thread(target=self.run, name="logger", daemon=True)
+            self.thread.start()
+            atexit.register(self.drain)
 
         # Set the global exception handler
         sys.excepthook = self.globalExceptionHandler
@@ -78,58 +112,169 @@ class Logger(object):
     def write(self, *args: Any) -> None:
         if not args:
             return
+        message: str = args[0] if len(args) == 1 and type(args[0]) is str else "".join(str(arg) for arg in args)
+        if self.asynchronous:
+            # the only work done on the caller thread
+            self.queue.put((time.time(), message, None))
+        else:
+            with self.writeLock:
+                self.writeRecords([(time.time(), message, None)])
+
+    def run(self) -> None:
+        '''
+        Writer thread: wait for messages and write them by batch, one flush per batch.
+        '''
+        while True:
+            records: list[Tuple[float, Optional[str], Optional[threading.Event]]] = [self.queue.get()]
+            while len(records) < WRITE_BATCH_SIZE:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.writeRecords(records)
+            except Exception as e:
+                sys.stderr.write(f"Logger failed to write: {e}\n")
+
+    def writeRecords(self, records: list[Tuple[float, Optional[str], Optional[threading.Event]]]) -> None:
+        drained: list[threading.Event] = []
+        for timestamp, message, done in records:
+            if message is None:
+                if done is not None:
+                    drained.append(done)
+                continue
+
+            if self.doFileLogging and (
+                timestamp >= self.nextDayStart or self.fileBytes >= self.maxBytes or self.fileJson != self.jsonLines
+            ):
+                self.openLogFile(timestamp)
+
+            text, textTime = self.formatMessage(timestamp, message)
+            if self.terminal is not None:
+                self.terminal.write(textTime)
+            if self.log is None:
+                continue
+            if self.fileJson:
+                self.writeJson(timestamp, text)
+            # avoid printing progress bar over several lines
+            elif text and text[-1] != '\r' and text[0] != '\r':
+                self.log.write(textTime)
+                self.fileBytes += len(textTime)
 
-        self.compareFileName()
+        if self.asynchronous:
+            self.flushFiles()
+        for done in drained:
+            done.set()
+
+    def formatMessage(self, timestamp: float, message: str) -> Tuple[str, str]:
+        '''
+        Returns the message and the message prefixed with the time of the day.
+        '''
         # If the only argument is a newline, don't print the time.
-        if len(args) == 1 and args[0] == '\n':
-            time: str = ''
+        if message == '\n':
+            timeStr: str = ''
         else:
-            time: str = self.now.strftime("%H:%M:%S.%f")[:-3] + " "
-        messageStr: str = ""
-        for arg in args:
-            messageStr += str(arg)
+            second: int = int(timestamp)
+            if second != self.cachedSecond:
+                self.cachedSecond = second
+                self.cachedTime = datetime.fromtimestamp(second).strftime("%H:%M:%S")
+            timeStr = f"{self.cachedTime}.{int((timestamp - second) * 1000):03d} "
 
         # Hack for progress bars.
-        index: int = messageStr[:20].find('[')
-        if index >= 0 and len(messageStr) > index+2 and messageStr[index+1] in {".", ">", "="}:
-            messageStr = '\r' + messageStr[1:]
-
-        if messageStr:
-            if messageStr[0] == '\r':
-                messageStrTime: str = messageStr[:1] + time + messageStr[1:]
-            else:
-                messageStrTime: str = time + messageStr
-        else:
-            messageStrTime: str = messageStr
+        index: int = message[:20].find('[')
+        if index >= 0 and len(message) > index+2 and message[index+1] in {".", ">", "="}:
+            message = '\r' + message[1:]
 
-        # avoid printing progress bar over several lines
-        if self.log is not None and messageStr and messageStr[-1] != '\r' and messageStr[0] != '\r' and self.doFileLogging:
-            self.log.write(messageStrTime)
+        if message:
+            if message[0] == '\r':
+                return message, message[:1] + timeStr + message[1:]
+            return message, timeStr + message
+        return message, message
 
-        self.terminal.write(messageStrTime)
+    def writeJson(self, timestamp: float, text: str) -> None:
+        '''
+        print() writes the message and its newline separately: complete lines are written as JSON objects.
+        '''
+        self.partialLine += text.replace('\r', '')
+        while '\n' in self.partialLine:
+            line, self.partialLine = self.partialLine.split('\n', 1)
+            if not line.strip():
+                continue
+            record: str = json.dumps({
+                "time": datetime.fromtimestamp(timestamp).isoformat(timespec="milliseconds"),
+                "module": self.moduleName,
+                "message": line,
+            }) + '\n'
+            self.log.write(record)
+            self.fileBytes += len(record)
 
-    def fillFileName(self) -> None:
-        self.now = datetime.now()
-        self.fileName = self.now.strftime(self.formatFile)
+    def openLogFile(self, timestamp: float) -> None:
+        '''
+        Open the log file of the day, on a new day, when the file is full or when the format changed.
+        '''
+        if self.log is not None:
+            self.log.close()
+            self.log = None
 
-    def compareFileName(self) -> None:
-        oldName: str = self.fileName
-        self.fillFileName()
-        if oldName != self.fileName:
-            self.flush()
-            if self.log is not None:
-                self.log.close()
-            self.file = LOG_FOLDER / self.fileName
-            if self.doFileLogging:
-                # Purge logs older than 30 days before creating/opening today's log file.
-                purge_old_logs()
-                touchFile(self.file)
-                self.log = open(self.file, "a")
+        day: date = datetime.fromtimestamp(timestamp).date()
+        extension: str = ".jsonl" if self.jsonLines else ".log"
+        self.file = LOG_FOLDER / (day.strftime("%Y-%m-%d") + extension)
+        if day != self.fileDay:
+            self.fileDay = day
+            self.nextDayStart = datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+            # Purge logs older than 30 days before creating/opening today's log file.
+            purge_old_logs()
+        elif self.fileBytes >= self.maxBytes and self.fileJson == self.jsonLines and self.file.exists():
+            # full: keep it as the next YYYY-MM-DD.N file and start again
+            number: int = 1
+            while self.file.with_suffix(f".{number}{extension}").exists():
+                number += 1
+            self.file.rename(self.file.with_suffix(f".{number}{extension}"))
 
-    def flush(self) -> None:
+        self.fileJson = self.jsonLines
+        self.partialLine = ""
+        touchFile(self.file)
+        self.fileBytes = self.file.stat().st_size
+        self.log = open(self.file, "a")
+
+    def flushFiles(self) -> None:
         if self.log is not None:
             self.log.flush()
-        self.terminal.flush()
+        if self.terminal is not None:
+            self.terminal.flush()
+
+    def flush(self) -> None:
+        # in asynchronous mode the writer flushes after every batch
+        if not self.asynchronous:
+            with self.writeLock:
+                self.flushFiles()
+
+    def drain(self, timeout: float = DRAIN_TIMEOUT) -> bool:
+        '''
+        Wait until every message queued so far is written. Returns False on timeout.
+        '''
+        if not self.asynchronous:
+            self.flush()
+            return True
+        done: threading.Event = threading.Event()
+        self.queue.put((time.time(), None, done))
+        return done.wait(timeout)
+
+    def close(self) -> None:
+        '''
+        Write the queued messages, close the file and give sys.stdout back.
+        '''
+        self.drain()
+        sys.stdout = self.terminal
+        sys.excepthook = sys.__excepthook__
+        if self.asynchronous:
+            atexit.unregister(self.drain)
+        with self.writeLock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+        # a new Logger can be started, the writer thread of this one stays idle
+        self.started = False
 
     def globalExceptionHandler(self, exc_type: Type[BaseException], exc_value: BaseException, exc_traceback: Any) -> None:
         # Print the exception type, value, and traceback.
@@ -139,4 +284,83 @@ class Logger(object):
             traceTuple += (trace + '\r\n',)
         exception: str = '{}: {}'.format(type(exc_type).__name__, exc_type)
         self.write("EXCEPTION: ", exception, '\r\n', exc_value, '\r\n', *traceTuple, '\r\n')
-        self.flush()
+        # the process may end right after: the exception must reach the file
+        self.drain()
+
+
+def benchmark() -> None:
+    '''
+    Per print overhead of the synchronous logger (formatting and writing on the caller thread,
+    as before) and of the asynchronous one (queue only), both writing to a log file.
+    '''
+    import tempfile
+    global LOG_FOLDER
+
+    calls = 20000
+    results: list[str] = []
+    with tempfile.TemporaryDirectory() as folder:
+        LOG_FOLDER = Path(folder)
+        for asynchronous in (False, True):
+            logger = Logger("BENCHMARK", True, asynchronous)
+            # the console is left out: both modes write the same bytes to it
+            logger.drain()
+            logger.terminal = open(os.devnull, "w")
+
+            started: float = time.perf_counter()
+            for index in range(calls):
+                print(f"Main loop iteration {index}.")
+            callTime: float = (time.perf_counter() - started) / calls
+            logger.drain(60)
+            totalTime: float = (time.perf_counter() - started) / calls
+            logger.terminal.close()
+            logger.terminal = sys.__stdout__
+            logger.close()
+            results.append(f"{'asynchronous' if asynchronous else 'synchronous':12s}: {callTime * 1e6:5.2f} us per print "
+                           f"on the caller thread, {totalTime * 1e6:5.2f} us until written")
+
+        lines: int = sum(1 for file in LOG_FOLDER.iterdir() for _ in open(file))
+        assert lines >= 2 * calls, lines
+    for result in results:
+        print(result)
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as folder:
+        LOG_FOLDER = Path(folder)
+        logger = Logger("TEST", True)
+        logger.maxBytes = 200
+        for index in range(10):
+            print(f"line {index}")
+        assert logger.drain()
+        files: list[str] = sorted(file.name for file in LOG_FOLDER.iterdir())
+        today: str = datetime.now().strftime("%Y-%m-%d")
+        # the file of the day is full every ~200 bytes and continued
+        assert f"{today}.log" in files and f"{today}.1.log" in files, files
+
+        logger.jsonLines = True
+        print("json", "line")
+        assert logger.drain()
+        with open(LOG_FOLDER / f"{today}.jsonl") as file:
+            record = json.loads(file.readline())
+        assert record["message"] == "json line" and record["module"] == "TEST", record
+
+        # old files are purged on the next day
+        (LOG_FOLDER / "2000-01-01.log").touch()
+        (LOG_FOLDER / "2000-01-01.3.log").touch()
+        logger.fileDay = None
+        logger.nextDayStart = 0
+        print("new day")
+        assert logger.drain()
+        assert not (LOG_FOLDER / "2000-01-01.log").exists()
+        assert not (LOG_FOLDER / "2000-01-01.3.log").exists()
+        logger.close()
+
+    print("Logger test finished.")
+    print()
@@ -0,0 +1,260 @@
+"""
+This module collects the daemon metrics (transition accuracy, Calendar API latency,
+Chrome launches...) and serves them on a local /metrics endpoint in the Prometheus
+text format, so they can be scraped without any network access or extra package.
+"""
+
+import bisect
+import threading
+from typing import Any, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LabelValues = tuple[tuple[str, str], ...]
+
+
+def escapeLabel(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def formatLabels(labels: LabelValues, extra: Optional[tuple[str, str]] = None) -> str:
+    pairs: list[tuple[str, str]] = list(labels) + ([extra] if extra is not None else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escapeLabel(value)}"' for name, value in pairs) + "}"
+
+
+def formatValue(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """
+    A value only going up, e.g. a number of errors. One series per set of label values.
+    """
+
+    def __init__(self, name: str, help: str):
+        self.name: str = name
+        self.help: str = help
+        self.values: dict[LabelValues, float] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key: LabelValues = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{formatLabels(labels)} {formatValue(value)}")
+        return lines
+
+
+class Gauge:
+    """
+    A value going up and down, e.g. a memory use. One series per set of label values.
+    """
+
+    def __init__(self, name: str, help: str):
+        self.name: str = name
+        self.help: str = help
+        self.values: dict[LabelValues, float] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def set(self, value: float, **labels: str) -> None:
+        key: LabelValues = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = value
+
+    def remove(self, **labels: str) -> None:
+        with self.lock:
+            self.values.pop(tuple(sorted(labels.items())), None)
+
+    def value(self, **labels: str) -> float:
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{formatLabels(labels)} {formatValue(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Distribution of observed values (seconds) in cumulative buckets. One series per set of label values.
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple[float, ...]):
+        self.name: str = name
+        self.help: str = help
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets)) + (float("inf"),)
+        # per series: observations per bucket (not cumulative), sum and count
+        self.series: dict[LabelValues, tuple[list[int], list[float]]] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key: LabelValues = tuple(sorted(labels.items()))
+        index: int = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if key not in self.series:
+                self.series[key] = ([0] * len(self.buckets), [0.0])
+            counts, total = self.series[key]
+            counts[index] += 1
+            total[0] += value
+
+    def count(self, **labels: str) -> int:
+        series = self.series.get(tuple(sorted(labels.items())))
+        return sum(series[0]) if series is not None else 0
+
+    def render(self) -> list[str]:
+        lines: list[str] = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for labels, (counts, total) in sorted(self.series.items()):
+                cumulative: int = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{formatLabels(labels, ('le', formatValue(bound)))} {cumulative}")
+                lines.append(f"{self.name}_sum{formatLabels(labels)} {formatValue(total[0])}")
+                lines.append(f"{self.name}_count{formatLabels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics exposed on the endpoint.
+    """
+
+    def __init__(self):
+        self.metrics: list[Any] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        metric = Counter(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        metric = Gauge(name, help)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, buckets: tuple[float, ...]) -> Histogram:
+        metric = Histogram(name, help, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "".join(line + "\n" for metric in self.metrics for line in metric.render())
+
+
+registry = Registry()
+
+calendarApiSeconds: Histogram = registry.histogram(
+    "screenblocker_calendar_api_seconds", "Duration of the Calendar API HTTP requests.",
+    (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+calendarApiErrors: Counter = registry.counter(
+    "screenblocker_calendar_api_errors_total", "Failed calendar refreshes, by kind of error.")
+mainLoopSeconds: Histogram = registry.histogram(
+    "screenblocker_main_loop_seconds", "Duration of a main loop iteration, sleep excluded.",
+    (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+transitionSkewSeconds: Histogram = registry.histogram(
+    "screenblocker_transition_skew_seconds", "Delay between the scheduled time of a lock or unlock and its application.",
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30))
+chromeLaunchSeconds: Histogram = registry.histogram(
+    "screenblocker_chrome_launch_to_visible_seconds", "Time from a Chrome kiosk launch to its window brought on top.",
+    (0.5, 1, 2, 3, 5, 7.5, 10, 20))
+chromeRespawns: Counter = registry.counter(
+    "screenblocker_chrome_respawns_total", "Chrome kiosk windows relaunched after exiting by themselves.")
+chromeRecycles: Counter = registry.counter(
+    "screenblocker_chrome_recycles_total", "Chrome kiosk windows replaced over their resource budget, by reason.")
+processRssBytes: Gauge = registry.gauge(
+    "screenblocker_process_rss_bytes", "Resident memory of the daemon and of the Chrome process tree of each bay.")
+processCpuRatio: Gauge = registry.gauge(
+    "screenblocker_process_cpu_ratio", "CPU use of the daemon and of the Chrome process tree of each bay (1 = a core).")
+chromeProfileBytes: Gauge = registry.gauge(
+    "screenblocker_chrome_profile_bytes", "Size of the Chrome user-data directories of each bay.")
+
+
+class MetricsServer(ThreadingHTTPServer):
+    """
+    Local HTTP server of the /metrics endpoint, started on a background thread.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int, metricsRegistry: Registry = registry):
+        super().__init__(("127.0.0.1", port), MetricsHandler)
+        self.registry: Registry = metricsRegistry
+        self.thread: threading.Thread = threading.Thread(target=self.serve_forever, name="metricsServer", daemon=True)
+        self.thread.start()
+        print(f"Metrics served on http://127.0.0.1:{self.server_address[1]}/metrics")
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    server: MetricsServer
+
+    def do_GET(self) -> None:
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body: bytes = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+# test module
+if __name__ == "__main__":
+    import urllib.request
+
+    testRegistry = Registry()
+    skew = testRegistry.histogram("test_skew_seconds", "Test skew.", (0.1, 1))
+    errors = testRegistry.counter("test_errors_total", "Test errors.")
+    memory = testRegistry.gauge("test_memory_bytes", "Test memory.")
+    memory.set(2048, process="chrome")
+    memory.set(1024, process="chrome")
+    memory.set(1, process="gone")
+    memory.remove(process="gone")
+    skew.observe(0.05, transition="lock")
+    skew.observe(0.5, transition="lock")
+    skew.observe(3, transition="lock")
+    skew.observe(0.1, transition="unlock")
+    errors.inc(kind="http")
+    errors.inc(kind="http")
+    errors.inc(kind='timeout "hung"')
+
+    server = MetricsServer(0, testRegistry)
+    with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics", timeout=5) as response:
+        assert response.headers["Content-Type"] == CONTENT_TYPE
+        lines: list[str] = response.read().decode().splitlines()
+
+    assert "# TYPE test_skew_seconds histogram" in lines
+    assert 'test_skew_seconds_bucket{transition="lock",le="0.1"} 1' in lines
+    assert 'test_skew_seconds_bucket{transition="lock",le="1"} 2' in lines
+    assert 'test_skew_seconds_bucket{transition="lock",le="+Inf"} 3' in lines
+    assert 'test_skew_seconds_sum{transition="lock"} 3.55' in lines
+    assert 'test_skew_seconds_count{transition="lock"} 3' in lines
+    # the bounds are inclusive
+    assert 'test_skew_seconds_bucket{transition="unlock",le="0.1"} 1' in lines
+    assert 'test_errors_total{kind="http"} 2' in lines
+    assert 'test_errors_total{kind="timeout \\"hung\\""} 1' in lines
+    assert "# TYPE test_memory_bytes gauge" in lines and 'test_memory_bytes{process="chrome"} 1024' in lines
+    assert not any("gone" in line for line in lines)
+
+    server.shutdown()
+    print("Metrics test finished.")
+    print()
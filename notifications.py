@@ -0,0 +1,303 @@
+"""
+This module registers a Google Calendar events.watch channel and runs a small
+HTTP receiver for its push notifications, so a booking added or extended in
+the Le Birdie app reaches the bay without waiting for the next poll.
+Google only calls HTTPS addresses: the webhook URL given in the configuration
+must be routed (reverse proxy or tunnel running on this computer) to the local
+receiver port, which only listens on 127.0.0.1.
+"""
+
+import hmac
+import time
+import uuid
+import secrets
+import threading
+from typing import Any, Callable, Optional
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# requested lifetime of a watch channel, Google may shorten it
+CHANNEL_TTL = 24 * 3600
+# the channel is renewed this many seconds before it expires
+RENEW_BEFORE_EXPIRY = 15 * 60
+# Calendar changes found by polling while no notification came in this delay mean notifications stopped
+NOTIFICATION_GRACE = 60
+# delay before trying again to register a channel after a failure
+REGISTER_RETRY_DELAY = 5 * 60
+
+
+class NotificationReceiver(ThreadingHTTPServer):
+    """
+    HTTP server receiving the push notifications POSTed by Google.
+    """
+    daemon_threads = True
+
+    def __init__(self, port: int, notifier: "PushNotifier"):
+        # only the local reverse proxy or tunnel reaches the receiver
+        super().__init__(("127.0.0.1", port), NotificationHandler)
+        self.notifier: PushNotifier = notifier
+
+
+class NotificationHandler(BaseHTTPRequestHandler):
+
+    server: NotificationReceiver
+
+    def do_POST(self) -> None:
+        # drain the (empty) notification body
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        accepted: bool = self.server.notifier.notify(
+            self.headers.get("X-Goog-Channel-ID", ""),
+            self.headers.get("X-Goog-Channel-Token", ""),
+            self.headers.get("X-Goog-Resource-State", ""),
+        )
+        self.send_response(200 if accepted else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # requests are logged by the notifier
+        pass
+
+
+class WatchChannel:
+    """
+    The watch channel registered on one calendar.
+    """
+
+    def __init__(self, calendarId: str):
+        self.calendarId: str = calendarId
+        self.channelId: Optional[str] = None
+        self.resourceId: Optional[str] = None
+        self.expiration: float = 0
+
+
+class PushNotifier:
+    """
+    Keeps a watch channel on each calendar alive and calls onChange when Google
+    reports a change. The daemon keeps polling, slower, as a safety net and
+    falls back to normal polling when the notifications are not healthy.
+    A single receiver serves the channels of every calendar.
+    """
+
+    def __init__(self, calendarIds: list[str], webhookUrl: str, port: int,
+                 onChange: Callable[[], None], verbose: bool = False):
+        self.channels: dict[str, WatchChannel] = {calendarId: WatchChannel(calendarId) for calendarId in calendarIds}
+        self.webhookUrl: str = webhookUrl
+        self.onChange: Callable[[], None] = onChange
+        self.verbose: bool = verbose
+        self.token: str = secrets.token_urlsafe(16)
+        self.lastNotification: float = 0
+        self.notificationsMissed: bool = False
+        self.nextRegistration: float = 0
+        self.lock: threading.Lock = threading.Lock()
+
+        self.receiver: NotificationReceiver = NotificationReceiver(port, self)
+        self.thread: threading.Thread = threading.Thread(
+            target=self.receiver.serve_forever, name="pushReceiver", daemon=True)
+        self.thread.start()
+        print(f"Push notification receiver listening on port {self.receiver.server_address[1]}")
+
+    def notify(self, channelId: str, token: str, resourceState: str) -> bool:
+        """
+        Handle a notification received by the HTTP receiver. Returns False if it is not for one of our channels.
+        """
+        with self.lock:
+            channel: Optional[WatchChannel] = next(
+                (channel for channel in self.channels.values() if channel.channelId == channelId), None)
+            if channel is None or not hmac.compare_digest(token.encode(), self.token.encode()):
+                return False
+            self.lastNotification = time.time()
+            self.notificationsMissed = False
+
+        if (self.verbose):
+            print(f"Push notification received for {channel.calendarId}: {resourceState}")
+        # "sync" only confirms the channel creation
+        if resourceState != "sync":
+            self.onChange()
+        return True
+
+    def channelHealthy(self, channel: WatchChannel) -> bool:
+        return channel.channelId is not None and time.time() < channel.expiration
+
+    def healthy(self) -> bool:
+        """
+        True if the notifications can be trusted to report the changes of every calendar.
+        """
+        return (
+            all(self.channelHealthy(channel) for channel in self.channels.values())
+            and self.thread.is_alive()
+            and not self.notificationsMissed
+        )
+
+    def reportPolledChanges(self, changedEvents: int) -> None:
+        """
+        Called after a poll. Changes found by polling without a recent notification mean the
+        notifications stopped: fall back to polling until the next channel registration.
+        """
+        if changedEvents > 0 and self.healthy() and time.time() - self.lastNotification > NOTIFICATION_GRACE:
+            print("Calendar changes found without push notification. Falling back to polling.")
+            self.notificationsMissed = True
+
+    def renew(self, calendarService: Any) -> None:
+        """
+        Register a new channel on the calendars without one, whose channel expires soon, or on every
+        calendar if notifications stopped, then stop the previous channels.
+        Failed registrations are retried after REGISTER_RETRY_DELAY.
+        """
+        expiring: list[WatchChannel] = [
+            channel for channel in self.channels.values()
+            if self.notificationsMissed or not self.channelHealthy(channel)
+            or channel.expiration - time.time() <= RENEW_BEFORE_EXPIRY
+        ]
+        if not expiring:
+            return
+        if time.time() < self.nextRegistration:
+            return
+        self.nextRegistration = time.time() + REGISTER_RETRY_DELAY
+
+        registered: bool = True
+        for channel in expiring:
+            registered = self.register(calendarService, channel) and registered
+        if registered:
+            with self.lock:
+                self.notificationsMissed = False
+
+    def register(self, calendarService: Any, channel: WatchChannel) -> bool:
+        """
+        Replace the watch channel of a calendar. Returns False if the registration failed.
+        """
+        oldChannelId, oldResourceId = channel.channelId, channel.resourceId
+        channelId: str = str(uuid.uuid4())
+        try:
+            response: dict[str, Any] = calendarService.events().watch(
+                calendarId=channel.calendarId,
+                body={
+                    "id": channelId,
+                    "type": "web_hook",
+                    "address": self.webhookUrl,
+                    "token": self.token,
+                    "params": {"ttl": str(CHANNEL_TTL)},
+                }
+            ).execute()
+        except Exception as e:
+            print(f"Error registering push notification channel for {channel.calendarId}: {e}")
+            return False
+
+        with self.lock:
+            channel.channelId = channelId
+            channel.resourceId = response.get("resourceId")
+            channel.expiration = int(response.get("expiration", 0)) / 1000
+        print(f"Push notification channel registered for {channel.calendarId}, "
+              f"expires in {(channel.expiration - time.time()) / 3600:.1f} h")
+
+        if oldChannelId is not None:
+            self.stopChannel(calendarService, oldChannelId, oldResourceId)
+        return True
+
+    def stopChannel(self, calendarService: Any, channelId: str, resourceId: Optional[str]) -> None:
+        try:
+            calendarService.channels().stop(body={"id": channelId, "resourceId": resourceId}).execute()
+        except Exception as e:
+            # an unstopped channel only expires by itself
+            print(f"Error stopping push notification channel: {e}")
+
+    def stop(self, calendarService: Any) -> None:
+        """
+        Stop the channels (left to expire by themselves without a calendar service) and the receiver.
+        """
+        for channel in self.channels.values():
+            if channel.channelId is not None and calendarService is not None:
+                self.stopChannel(calendarService, channel.channelId, channel.resourceId)
+                channel.channelId = None
+        self.receiver.shutdown()
+        self.receiver.server_close()
+
+
+# test module
+if __name__ == "__main__":
+    import urllib.error
+    import urllib.request
+
+    class FakeRequest:
+        def __init__(self, response: dict[str, Any]):
+            self.response = response
+
+        def execute(self) -> dict[str, Any]:
+            return self.response
+
+    class FakeCalendarService:
+        """
+        Stand-in for the Google Calendar service watch/stop methods.
+        """
+
+        def __init__(self):
+            self.watched: list[dict[str, Any]] = []
+            self.stopped: list[dict[str, Any]] = []
+            self.ttl: float = CHANNEL_TTL
+
+        def events(self) -> "FakeCalendarService":
+            return self
+
+        def channels(self) -> "FakeCalendarService":
+            return self
+
+        def watch(self, calendarId: str, body: dict[str, Any]) -> FakeRequest:
+            self.watched.append(body)
+            return FakeRequest({"resourceId": "calendar", "expiration": str(int((time.time() + self.ttl) * 1000))})
+
+        def stop(self, body: dict[str, Any]) -> FakeRequest:
+            self.stopped.append(body)
+            return FakeRequest({})
+
+    def postNotification(port: int, channelId: str, token: str, state: str) -> int:
+        """
+        Local stand-in for Google POSTing a notification to the receiver.
+        """
+        request = urllib.request.Request(f"http://127.0.0.1:{port}/", data=b"", method="POST", headers={
+            "X-Goog-Channel-ID": channelId,
+            "X-Goog-Channel-Token": token,
+            "X-Goog-Resource-State": state,
+            "X-Goog-Resource-ID": "calendar",
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as he:
+            return he.code
+
+    changed = threading.Event()
+    service = FakeCalendarService()
+    notifier = PushNotifier(["bay1", "bay2"], "https://example.com/notifications", 0, changed.set)
+    port: int = notifier.receiver.server_address[1]
+    assert not notifier.healthy()
+
+    notifier.renew(service)
+    assert notifier.healthy() and len(service.watched) == 2
+    channel = notifier.channels["bay1"]
+    channelId = channel.channelId or ""
+
+    # sync message confirms the channel without a refresh, a change triggers one
+    assert postNotification(port, channelId, notifier.token, "sync") == 200
+    assert not changed.is_set()
+    assert postNotification(port, channelId, notifier.token, "exists") == 200
+    assert changed.wait(1)
+    # notifications for another channel or with a bad token are refused
+    assert postNotification(port, "other", notifier.token, "exists") == 404
+    assert postNotification(port, channelId, "bad", "exists") == 404
+
+    # only the channel close to its expiry is replaced and the old one stopped
+    channel.expiration = time.time() + RENEW_BEFORE_EXPIRY / 2
+    notifier.nextRegistration = 0
+    notifier.renew(service)
+    assert len(service.watched) == 3 and service.stopped[0]["id"] == channelId
+
+    # changes found by polling without notification make the daemon fall back to polling
+    notifier.lastNotification = 0
+    notifier.reportPolledChanges(1)
+    assert not notifier.healthy()
+    notifier.nextRegistration = 0
+    notifier.renew(service)
+    assert notifier.healthy() and len(service.watched) == 5
+
+    notifier.stop(service)
+    print("Push notifications test finished.")
+    print()
@@ -0,0 +1,194 @@
+"""
+This module decides when the calendar is fetched again. The refresh interval is
+derived from the known schedule: slow when the next transition is hours away,
+halving as a transition approaches and tight just after a booking ends, when
+extensions and walk-ins are likely. A token bucket keeps the refreshes within a
+daily budget (push notification storms included), and throttling or server
+errors back off exponentially with jitter.
+usage: python refreshPolicy.py benchmark
+"""
+
+import sys
+import time
+import random
+from typing import Callable, Iterable, Optional
+from scheduler import UNLOCK_BEFORE_START, Booking
+
+# refresh interval near the transitions (the former flat interval), in seconds
+MIN_REFRESH_INTERVAL = 20
+# refresh interval when no transition is coming soon, in seconds
+MAX_REFRESH_INTERVAL = 15 * 60
+# after a booking end, the interval grows back from MIN_REFRESH_INTERVAL over this many seconds
+EXTENSION_WINDOW = 10 * 60
+# refreshes allowed per day and in a burst (e.g. several push notifications in a row)
+DAILY_BUDGET = 1500
+BURST = 10
+# exponential backoff after a throttling or a server error, in seconds
+BACKOFF_BASE = 20
+BACKOFF_CAP = 30 * 60
+# HTTP statuses of the Calendar API answered by backing off: quota exceeded and throttling, server errors
+THROTTLE_STATUSES = (403, 429)
+
+
+def refreshInterval(calendars: Iterable[Iterable[Booking]], now: float, minInterval: float = MIN_REFRESH_INTERVAL,
+                    maxInterval: float = MAX_REFRESH_INTERVAL) -> float:
+    """
+    Seconds until the next refresh, from the bookings known in every calendar: half the time left
+    until the next unlock or booking end (a change is seen before the transition it affects),
+    and half the time elapsed since a booking ended within EXTENSION_WINDOW.
+    """
+    interval: float = maxInterval
+    for bookings in calendars:
+        for booking in bookings:
+            for deadline in (booking.start - UNLOCK_BEFORE_START, booking.end):
+                if deadline > now:
+                    interval = min(interval, (deadline - now) / 2)
+            if booking.end <= now < booking.end + EXTENSION_WINDOW:
+                interval = min(interval, (now - booking.end) / 2)
+    return max(interval, minInterval)
+
+
+def retryable(status: int) -> bool:
+    """
+    True if the Calendar API answer asks to slow down: quota exceeded, throttled or server error.
+    """
+    return status in THROTTLE_STATUSES or status >= 500
+
+
+class TokenBucket:
+    """
+    Refresh budget: `rate` tokens per second, up to `capacity` saved for bursts.
+    """
+
+    def __init__(self, capacity: float, rate: float, clock: Callable[[], float] = time.monotonic):
+        self.capacity: float = capacity
+        self.rate: float = rate
+        self.clock: Callable[[], float] = clock
+        self.tokens: float = capacity
+        self.updated: float = clock()
+
+    def take(self, cost: float = 1) -> float:
+        """
+        Spend the tokens and return 0, or return the seconds to wait until they are available (nothing spent).
+        """
+        now: float = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+class Backoff:
+    """
+    Exponential backoff with jitter: the n-th failure in a row waits between half and all of
+    base * 2^(n-1) seconds, capped, so several daemons throttled together do not retry together.
+    """
+
+    def __init__(self, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP, rng: Optional[random.Random] = None):
+        self.base: float = base
+        self.cap: float = cap
+        self.rng: random.Random = rng if rng is not None else random.Random()
+        self.failures: int = 0
+
+    def failure(self) -> float:
+        """
+        Record a failure and return the seconds to wait before the next try.
+        """
+        self.failures += 1
+        ceiling: float = min(self.cap, self.base * 2 ** min(self.failures - 1, 30))
+        return ceiling / 2 + self.rng.uniform(0, ceiling / 2)
+
+    def reset(self) -> None:
+        self.failures = 0
+
+
+def benchmark() -> None:
+    """
+    Replay a synthetic week (bookings during the day, nights empty) polling every 20 s and with
+    the adaptive interval: fetches per day and lateness compared to a daemon knowing every change instantly.
+    The lateness of the scheduled transitions (unlocks, ends) is reported apart from the transitions
+    caused by a change to the current booking (walk-ins, cancellations of the booking in progress).
+    """
+    from datetime import datetime
+    from replay import Day, ReplayResult, lateness, percentile, replay, syntheticDay
+
+    weekStart: float = datetime(2026, 1, 5).timestamp()
+    for bays in (1, 6):
+        bookings: dict[str, list[Booking]] = {}
+        changes = []
+        for dayIndex in range(7):
+            day: Day = syntheticDay(bays, 8, seed=dayIndex * 100 + bays, start=weekStart + dayIndex * 86400 + 8 * 3600)
+            for bay, dayBookings in day.bookings.items():
+                bookings.setdefault(bay, []).extend(dayBookings)
+            changes += day.changes
+        week = Day(weekStart, weekStart + 7 * 86400, bookings, sorted(changes, key=lambda change: change.time))
+
+        ideal: ReplayResult = replay(week, None)
+        print(f"{bays} bays, {sum(len(dayBookings) for dayBookings in bookings.values())} bookings, "
+              f"{len(changes)} changes over a week:")
+        results: dict[str, ReplayResult] = {}
+        for name, interval in (("flat 20 s", MIN_REFRESH_INTERVAL), ("adaptive", refreshInterval)):
+            result: ReplayResult = replay(week, interval)
+            results[name] = result
+            scheduled, _ = lateness(ideal.timeline, result.timeline, lambda action: action.deadline is not None)
+            changed, missed = lateness(ideal.timeline, result.timeline, lambda action: action.deadline is None)
+            print(f"    {name:9s}: {result.fetches / 7:6.0f} calendar fetches per day | scheduled transitions late "
+                  f"p95 {percentile(scheduled, 0.95):4.1f} s, max {max(scheduled, default=0):5.1f} s | "
+                  f"changes seen late p50 {percentile(changed, 0.5):5.1f} s, p95 {percentile(changed, 0.95):5.1f} s, "
+                  f"{missed} missed")
+        reduction: float = results["flat 20 s"].fetches / results["adaptive"].fetches
+        print(f"    {reduction:.1f} times fewer fetches")
+        assert reduction >= 10, reduction
+
+    # a throttled daemon backs off instead of retrying every 20 s
+    backoff = Backoff(rng=random.Random(0))
+    delays: list[float] = [backoff.failure() for _ in range(8)]
+    print(f"Backoff after 8 throttled refreshes: {', '.join(f'{delay:.0f}' for delay in delays)} s")
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    # nothing known: slowest cadence
+    assert refreshInterval([], 0) == MAX_REFRESH_INTERVAL
+    # hours before a booking: slowest, then halving until the unlock, 5 minutes before the start
+    booking = Booking(10000, 13600, "booking")
+    assert refreshInterval([[booking]], 0) == MAX_REFRESH_INTERVAL
+    assert refreshInterval([[booking]], 9000) == (9700 - 9000) / 2
+    assert refreshInterval([[booking]], 9690) == MIN_REFRESH_INTERVAL
+    # during the booking: halving until its end, then tight just after it and growing back
+    assert refreshInterval([[booking]], 11000) == MAX_REFRESH_INTERVAL
+    assert refreshInterval([[booking]], 13000) == 300
+    assert refreshInterval([[booking]], 13610) == MIN_REFRESH_INTERVAL
+    assert refreshInterval([[booking]], 13600 + 200) == 100
+    assert refreshInterval([[booking]], 13600 + EXTENSION_WINDOW) == MAX_REFRESH_INTERVAL
+    # the closest transition of every calendar counts
+    assert refreshInterval([[booking], [Booking(1300, 2000, "other")]], 0) == 500
+
+    # token bucket: the burst, then one token every 1 / rate seconds
+    now = [0.0]
+    bucket = TokenBucket(3, 0.5, lambda: now[0])
+    assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+    assert bucket.take() == 2
+    now[0] = 1
+    assert bucket.take() == 1
+    now[0] = 2
+    assert bucket.take() == 0
+
+    # backoff: doubling with jitter, capped, reset on success
+    backoff = Backoff(10, 100, random.Random(1))
+    delays = [backoff.failure() for _ in range(6)]
+    for failures, delay in enumerate(delays):
+        ceiling = min(100, 10 * 2 ** failures)
+        assert ceiling / 2 <= delay <= ceiling, (failures, delay)
+    backoff.reset()
+    assert backoff.failure() <= 10
+    assert retryable(429) and retryable(403) and retryable(503) and not retryable(404) and not retryable(410)
+
+    print("Refresh policy test finished.")
+    print()
@@ -0,0 +1,339 @@
+"""
+This module replays a recorded or synthetic schedule through the planner on a
+simulated clock: a whole day of bookings, cancellations and last minute
+additions runs in milliseconds, without Chrome nor Google.
+It reports the action timeline and how late each transition is compared to a
+daemon that would know every calendar change instantly, and runs as a
+benchmark suite checking the correctness and the throughput of the decision logic.
+usage: python replay.py benchmark | python replay.py <day or snapshot JSON file>
+"""
+
+import sys
+import json
+import time
+import random
+from datetime import datetime
+from typing import Any, Callable, Iterable, NamedTuple, Optional, Union
+from scheduler import Action, Booking, DisplayState, Planner, SimulatedClock, linearState
+
+# seconds between two calendar fetches of the daemon near the transitions (refreshPolicy.MIN_REFRESH_INTERVAL)
+REFRESH_INTERVAL = 20
+# throughput regression threshold of the benchmark suite: simulated seconds per second of replay
+MIN_SPEEDUP = 100000
+
+
+class Change(NamedTuple):
+    time: float  # epoch seconds the calendar changed at
+    bay: str
+    booking: Booking
+    cancelled: bool  # True if the booking is removed from the calendar, False if it is added
+
+
+class Day(NamedTuple):
+    start: float
+    end: float
+    bookings: dict[str, list[Booking]]  # bookings by bay at the start
+    changes: list[Change]  # later calendar changes, by time
+
+
+class ReplayResult(NamedTuple):
+    timeline: list[Action]  # the transitions, enforcements excluded
+    enforcements: int
+    fetches: int  # calendar fetches, one per bay and refresh
+    elapsed: float  # wall clock seconds of the replay
+
+
+def syntheticDay(bays: int, bookingsPerBay: int, seed: int = 0, start: Optional[float] = None) -> Day:
+    """
+    Random bookings of 15 minutes multiples with back-to-back and overlapping bookings, gaps,
+    cancellations and bookings added at the last minute (or after their start).
+    """
+    rng = random.Random(seed)
+    dayStart: float = start if start is not None else datetime(2026, 1, 5, 8, 0).timestamp()
+    bookings: dict[str, list[Booking]] = {}
+    changes: list[Change] = []
+    end: float = dayStart
+    for bayIndex in range(bays):
+        bay: str = str(bayIndex + 1)
+        bookings[bay] = []
+        cursor: float = dayStart + rng.randrange(0, 60, 5) * 60
+        for index in range(bookingsPerBay):
+            booking = Booking(cursor, cursor + rng.randint(1, 8) * 15 * 60, f"Booking {bay}-{index}")
+            kind: float = rng.random()
+            if kind < 0.08:
+                changes.append(Change(max(booking.start - rng.uniform(0, 3 * 3600), dayStart + 1), bay, booking, True))
+                bookings[bay].append(booking)
+            elif kind < 0.14:
+                # added up to 2 hours before its start, or up to 10 minutes after it (walk-in)
+                changes.append(Change(max(booking.start + rng.uniform(-2 * 3600, 600), dayStart + 1), bay, booking, False))
+            else:
+                bookings[bay].append(booking)
+
+            gap: float = rng.random()
+            if gap < 0.35:
+                cursor = booking.end
+            elif gap < 0.45:
+                cursor = booking.end - 15 * 60
+            else:
+                cursor = booking.end + rng.randrange(5, 95, 5) * 60
+            end = max(end, booking.end)
+    changes.sort(key=lambda change: change.time)
+    return Day(dayStart, end + 3600, bookings, changes)
+
+
+def loadDay(path: str) -> Day:
+    """
+    Load a day to replay: a schedule snapshot (screenBlockerSchedule.json, one bay per calendar, no change)
+    or {"start", "end", "bookings": {bay: [[start, end, summary]]},
+        "changes": [[time, bay, start, end, summary, cancelled]]}.
+    """
+    with open(path, "r", encoding="utf-8") as file:
+        data: dict[str, Any] = json.load(file)
+    rows: dict[str, list[list[Any]]] = data["calendars"] if "calendars" in data else data["bookings"]
+    bookings: dict[str, list[Booking]] = {
+        bay: [Booking(float(start), float(end), str(summary)) for start, end, summary in bayRows]
+        for bay, bayRows in rows.items()
+    }
+    changes: list[Change] = sorted(
+        (Change(float(at), bay, Booking(float(start), float(end), str(summary)), bool(cancelled))
+         for at, bay, start, end, summary, cancelled in data.get("changes", [])),
+        key=lambda change: change.time)
+    allBookings: list[Booking] = [booking for bayBookings in bookings.values() for booking in bayBookings]
+    allBookings += [change.booking for change in changes]
+    firstStart: float = min((booking.start for booking in allBookings), default=0)
+    start: float = float(data.get("start", data.get("fetchedAt", firstStart)))
+    end: float = float(data.get("end", max((booking.end for booking in allBookings), default=start) + 3600))
+    return Day(start, end, bookings, changes)
+
+
+# seconds until the next fetch given the bookings known in every calendar and the time (refreshPolicy.refreshInterval)
+RefreshPolicy = Callable[[Iterable[Iterable[Booking]], float], float]
+
+
+def replay(day: Day, refreshInterval: Union[float, RefreshPolicy, None] = REFRESH_INTERVAL) -> ReplayResult:
+    """
+    Run the planner over the day. The calendar of each bay is fetched every refreshInterval seconds,
+    or after the interval returned by the refreshInterval policy for its known bookings like the daemon
+    does, or at the exact time of each change if refreshInterval is None (ideal daemon).
+    """
+    clock = SimulatedClock(day.start)
+    planner = Planner(clock)
+    calendar: dict[str, set[Booking]] = {bay: set(bookings) for bay, bookings in day.bookings.items()}
+    for change in day.changes:
+        calendar.setdefault(change.bay, set())
+    # the bookings of each bay at its last fetch, and the bays changed since
+    known: dict[str, list[Booking]] = {bay: list(bookings) for bay, bookings in calendar.items()}
+    dirty: set[str] = set()
+
+    timeline: list[Action] = []
+    enforcements: int = 0
+    fetches: int = 0
+    nextChange: int = 0
+    nextFetch: dict[str, float] = {bay: day.start for bay in calendar}
+    started: float = time.perf_counter()
+    while True:
+        now: float = clock.now()
+        bays: Optional[dict[str, list[Booking]]] = known if fetches == 0 else None
+        due: list[str] = [bay for bay, fetchAt in nextFetch.items() if fetchAt <= now]
+        if due:
+            while nextChange < len(day.changes) and day.changes[nextChange].time <= now:
+                change: Change = day.changes[nextChange]
+                if change.cancelled:
+                    calendar[change.bay].discard(change.booking)
+                else:
+                    calendar[change.bay].add(change.booking)
+                dirty.add(change.bay)
+                nextChange += 1
+            for bay in due:
+                if bay in dirty:
+                    known[bay] = list(calendar[bay])
+                    dirty.discard(bay)
+                    bays = known
+                if callable(refreshInterval):
+                    nextFetch[bay] = now + refreshInterval([known[bay]], now)
+                elif refreshInterval is not None:
+                    nextFetch[bay] = now + refreshInterval
+                else:
+                    nextFetch[bay] = day.changes[nextChange].time if nextChange < len(day.changes) else float("inf")
+            fetches += len(due)
+
+        for action in planner.step(bays):
+            if action.enforce:
+                enforcements += 1
+            else:
+                timeline.append(action)
+        if now >= day.end:
+            break
+        planner.wait(min(min(nextFetch.values(), default=day.end), day.end))
+
+    return ReplayResult(timeline, enforcements, fetches, time.perf_counter() - started)
+
+
+def verifyTimeline(day: Day, timeline: list[Action]) -> None:
+    """
+    Check an ideal replay against linearState evaluated on the calendar content at every time
+    the state can change: each transition deadline of each booking and each calendar change.
+    """
+    for bay in {change.bay for change in day.changes} | set(day.bookings):
+        changes: list[Change] = [change for change in day.changes if change.bay == bay]
+        bookings: list[Booking] = day.bookings.get(bay, []) + [change.booking for change in changes if not change.cancelled]
+        samples: set[float] = {change.time for change in changes}
+        for booking in bookings:
+            for deadline in (booking.start - 300, booking.end, booking.end + 20):
+                samples.update((deadline, deadline + 1))
+        transitions: list[Action] = [action for action in timeline if action.bay == bay]
+
+        calendar: set[Booking] = set(day.bookings.get(bay, []))
+        nextChange: int = 0
+        nextTransition: int = 0
+        state: Optional[DisplayState] = None
+        for sample in sorted(sample for sample in samples if day.start <= sample <= day.end):
+            while nextChange < len(changes) and changes[nextChange].time <= sample:
+                change: Change = changes[nextChange]
+                if change.cancelled:
+                    calendar.discard(change.booking)
+                else:
+                    calendar.add(change.booking)
+                nextChange += 1
+            while nextTransition < len(transitions) and transitions[nextTransition].time <= sample:
+                state = transitions[nextTransition].state
+                nextTransition += 1
+            expected: DisplayState = linearState(sorted(calendar), sample)
+            assert state == expected, f"bay {bay} at {sample}: {state} instead of {expected}"
+
+
+def lateness(ideal: list[Action], replayed: list[Action],
+             select: Optional[Callable[[Action], bool]] = None) -> tuple[list[float], int]:
+    """
+    For each transition of the ideal timeline (those accepted by select if given), how many seconds later
+    the replayed timeline did the same transition on the same bay. Returns the lateness values and the
+    number of transitions never done (a state replaced before the replayed daemon knew about it).
+    """
+    values: list[float] = []
+    missed: int = 0
+    for bay in {action.bay for action in ideal}:
+        idealBay: list[Action] = [action for action in ideal if action.bay == bay]
+        replayedBay: list[Action] = [action for action in replayed if action.bay == bay]
+        first: int = 0
+        for index, action in enumerate(idealBay):
+            if select is not None and not select(action):
+                continue
+            until: float = idealBay[index + 1].time if index + 1 < len(idealBay) else float("inf")
+            while first < len(replayedBay) and replayedBay[first].time < action.time:
+                first += 1
+            match: Optional[Action] = next(
+                (other for other in replayedBay[first:] if other.time >= until or other.state == action.state), None)
+            if match is not None and match.time < until:
+                values.append(match.time - action.time)
+            else:
+                missed += 1
+    return values, missed
+
+
+def mismatchSeconds(ideal: list[Action], replayed: list[Action], start: float, end: float) -> float:
+    """
+    Total time (over every bay) the replayed daemon displayed another state than the ideal one.
+    """
+    total: float = 0
+    for bay in {action.bay for action in ideal} | {action.bay for action in replayed}:
+        points: list[tuple[float, int, DisplayState]] = sorted(
+            [(action.time, 0, action.state) for action in ideal if action.bay == bay]
+            + [(action.time, 1, action.state) for action in replayed if action.bay == bay],
+            key=lambda point: (point[0], point[1]))
+        states: list[Optional[DisplayState]] = [None, None]
+        previous: float = start
+        for at, source, state in points + [(end, 0, None)]:
+            if states[0] != states[1]:
+                total += at - previous
+            previous = at
+            if state is not None:
+                states[source] = state
+    return total
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered: list[float] = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] if ordered else 0
+
+
+def printTimeline(timeline: list[Action]) -> None:
+    for action in timeline:
+        moment: str = datetime.fromtimestamp(action.time).strftime('%Y-%m-%d %H:%M:%S')
+        print(f"{moment}  bay {action.bay:4s} {action.state.value}")
+
+
+def benchmark() -> None:
+    """
+    Replay synthetic days of growing size: the ideal replay is checked against linearState,
+    the replay polling like the daemon is compared to it, and the throughput is checked.
+    """
+    for bays, bookingsPerBay in ((1, 40), (6, 80), (24, 150)):
+        day: Day = syntheticDay(bays, bookingsPerBay, seed=bays)
+        bookings: int = sum(len(bayBookings) for bayBookings in day.bookings.values()) + len(day.changes)
+        ideal: ReplayResult = replay(day, None)
+        verifyTimeline(day, ideal.timeline)
+        result: ReplayResult = replay(day)
+        late, missed = lateness(ideal.timeline, result.timeline)
+        mismatch: float = mismatchSeconds(ideal.timeline, result.timeline, day.start, day.end)
+        speedup: float = (day.end - day.start) / result.elapsed
+
+        print(f"{bays:2d} bays, {bookings:5d} bookings ({len(day.changes):3d} changes), "
+              f"{(day.end - day.start) / 86400:4.1f} days: {len(result.timeline):5d} transitions, "
+              f"{result.enforcements:5d} enforcements, {result.fetches:5d} fetches")
+        print(f"    replay {result.elapsed * 1000:7.1f} ms ({bookings / result.elapsed:8.0f} bookings/s, "
+              f"{speedup:9.0f} x real time), ideal replay {ideal.elapsed * 1000:7.1f} ms")
+        print(f"    lateness vs ideal: p50 {percentile(late, 0.5):4.1f} s, p95 {percentile(late, 0.95):4.1f} s, "
+              f"max {max(late, default=0):4.1f} s, {missed} missed, wrong state {mismatch / 60:6.1f} bay-minutes "
+              f"({mismatch / ((day.end - day.start) * bays) * 100:.3f} %)")
+
+        # regression checks: a change is seen at the next fetch at most, and the replay stays fast
+        assert max(late, default=0) <= REFRESH_INTERVAL, max(late)
+        assert speedup >= MIN_SPEEDUP, speedup
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    if len(sys.argv) > 1:
+        day = loadDay(sys.argv[1])
+        result = replay(day)
+        printTimeline(result.timeline)
+        print(f"{len(result.timeline)} transitions replayed in {result.elapsed * 1000:.1f} ms")
+        sys.exit(0)
+
+    # back-to-back at 10:00, a cancellation at 9:00 of the 11:00 booking, a walk-in added 5 minutes after its start
+    start = datetime(2026, 1, 5, 8, 0).timestamp()
+    first = Booking(start + 3600, start + 7200, "first")
+    second = Booking(start + 7200, start + 9000, "second")
+    cancelled = Booking(start + 10800, start + 12600, "cancelled")
+    walkIn = Booking(start + 18000, start + 19800, "walk-in")
+    day = Day(start, start + 8 * 3600, {"1": [first, second, cancelled]}, [
+        Change(start + 3600, "1", cancelled, True),
+        Change(start + 18300, "1", walkIn, False),
+    ])
+    ideal = replay(day, None)
+    verifyTimeline(day, ideal.timeline)
+    assert [(action.time - start, action.state) for action in ideal.timeline] == [
+        (0, DisplayState.padlock),
+        (3300, DisplayState.hidden),
+        (7200, DisplayState.backToBack),
+        (7220, DisplayState.hidden),
+        (9000, DisplayState.timesUp),
+        (9020, DisplayState.padlock),
+        (18300, DisplayState.hidden),
+        (19800, DisplayState.timesUp),
+        (19820, DisplayState.padlock),
+    ], ideal.timeline
+
+    # polling: the walk-in is only seen at the next fetch
+    polled = replay(day)
+    late, missed = lateness(ideal.timeline, polled.timeline)
+    assert missed == 0 and max(late) == 0
+    delayed = replay(day._replace(changes=[Change(start + 18290, "1", walkIn, False)]))
+    assert [action.time - start for action in delayed.timeline if action.state == DisplayState.hidden][-1] == 18300
+
+    print("Replay test finished.")
+    print()
@@ -0,0 +1,282 @@
+"""
+This module samples the resources used by the daemon and by the kiosk Chrome windows
+of each bay: resident memory and CPU of the processes, size of the user-data directories.
+The samples are exposed on the /metrics endpoint and the last hour is kept in memory
+for inspection. The bays over their budget are reported to the daemon, which recycles
+their windows while they are locked on the padlock (see chrome.recycleChrome).
+usage: python resourceMonitor.py [benchmark]
+"""
+
+import os
+import sys
+import time
+import threading
+import psutil
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+from config import BayConfig, Config
+from chrome import bayController, directorySize, profileSets
+from metrics import chromeProfileBytes, processCpuRatio, processRssBytes
+
+# seconds between two samples
+SAMPLE_INTERVAL = 60
+# samples kept in memory
+SAMPLE_HISTORY = 60
+# the windows of a bay are recycled only if its next transition is at least this many seconds away
+RECYCLE_MARGIN = 5 * 60
+# the windows of a bay are not recycled again within this many seconds, even over budget
+MIN_RECYCLE_INTERVAL = 30 * 60
+# recycling reasons
+MEMORY_REASON = "memory"
+PROFILE_REASON = "profile"
+# key of the daemon process in the samples
+DAEMON_KEY = "daemon"
+
+
+class ProcessUsage(NamedTuple):
+    rss: int  # bytes
+    cpuSeconds: float  # user and system time since the processes started
+    processes: int
+
+
+class ResourceSample(NamedTuple):
+    time: float  # epoch seconds
+    daemon: ProcessUsage
+    chrome: dict[str, ProcessUsage]  # Chrome process tree of each bay
+    cpu: dict[str, float]  # CPU use since the previous sample (1 = a core) of the daemon and of each bay
+    profiles: dict[str, int]  # bytes of the user-data directories of each bay
+
+
+def treeUsage(pids: list[int], children: bool = True) -> ProcessUsage:
+    """
+    Resources used by the processes and, with children, by all their descendants.
+    """
+    processes: list[psutil.Process] = []
+    for pid in pids:
+        try:
+            parent = psutil.Process(pid)
+            processes += [parent] + (parent.children(recursive=True) if children else [])
+        except psutil.NoSuchProcess:
+            pass
+    rss: int = 0
+    cpuSeconds: float = 0
+    count: int = 0
+    for process in processes:
+        try:
+            with process.oneshot():
+                rss += process.memory_info().rss
+                times = process.cpu_times()
+                cpuSeconds += times.user + times.system
+            count += 1
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    return ProcessUsage(rss, cpuSeconds, count)
+
+
+def bayProfiles(bay: BayConfig) -> list[str]:
+    """
+    Both sets of user-data directories of the bay: in use and spare.
+    """
+    return [profile for profiles in profileSets.get(bay.name, ()) for profile in profiles]
+
+
+class ResourceMonitor:
+    """
+    Background thread sampling the resources every SAMPLE_INTERVAL seconds.
+    """
+
+    def __init__(self, cfg: Config, chromePids: Optional[Callable[[BayConfig], list[int]]] = None,
+                 profiles: Callable[[BayConfig], list[str]] = bayProfiles, interval: float = SAMPLE_INTERVAL):
+        self.cfg: Config = cfg
+        self.chromePids: Callable[[BayConfig], list[int]] = (
+            chromePids if chromePids is not None else lambda bay: bayController(bay).pids())
+        self.profiles: Callable[[BayConfig], list[str]] = profiles
+        self.interval: float = interval
+        self.samples: deque[ResourceSample] = deque(maxlen=SAMPLE_HISTORY)
+        # monotonic time and CPU seconds of the previous sample, by "daemon" and bay
+        self.lastCpu: dict[str, tuple[float, float]] = {}
+        # epoch seconds of the last recycle of each bay
+        self.lastRecycles: dict[str, float] = {}
+        self.running: bool = True
+        self.wakeUp: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.run, name="resourceMonitor", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+        self.wakeUp.set()
+
+    def run(self) -> None:
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"Error sampling the resources: {e}")
+            self.wakeUp.wait(self.interval)
+
+    def cpuRatio(self, key: str, cpuSeconds: float, now: float) -> float:
+        previous: Optional[tuple[float, float]] = self.lastCpu.get(key)
+        self.lastCpu[key] = (now, cpuSeconds)
+        if previous is None or now <= previous[0]:
+            return 0
+        # a recycled process tree starts again from 0
+        return max(cpuSeconds - previous[1], 0) / (now - previous[0])
+
+    def sample(self) -> ResourceSample:
+        """
+        Take a sample, keep it and publish it on the metrics.
+        """
+        cfg: Config = self.cfg
+        now: float = time.monotonic()
+        daemon: ProcessUsage = treeUsage([os.getpid()], children=False)
+        chrome: dict[str, ProcessUsage] = {bay.name: treeUsage(self.chromePids(bay)) for bay in cfg.bays}
+        cpu: dict[str, float] = {DAEMON_KEY: self.cpuRatio(DAEMON_KEY, daemon.cpuSeconds, now)}
+        for bay, usage in chrome.items():
+            cpu[bay] = self.cpuRatio(bay, usage.cpuSeconds, now)
+        profiles: dict[str, int] = {
+            bay.name: sum(directorySize(profile) for profile in self.profiles(bay)) for bay in cfg.bays
+        }
+        sample = ResourceSample(time.time(), daemon, chrome, cpu, profiles)
+
+        # the series of the bays removed from the configuration are dropped
+        if self.samples:
+            for bay in set(self.samples[-1].chrome) - set(chrome):
+                processRssBytes.remove(process="chrome", bay=bay)
+                processCpuRatio.remove(process="chrome", bay=bay)
+                chromeProfileBytes.remove(bay=bay)
+                self.lastCpu.pop(bay, None)
+        processRssBytes.set(daemon.rss, process=DAEMON_KEY)
+        processCpuRatio.set(cpu[DAEMON_KEY], process=DAEMON_KEY)
+        for bay, usage in chrome.items():
+            processRssBytes.set(usage.rss, process="chrome", bay=bay)
+            processCpuRatio.set(cpu[bay], process="chrome", bay=bay)
+            chromeProfileBytes.set(profiles[bay], bay=bay)
+        self.samples.append(sample)
+
+        if (cfg.verbose):
+            bays: str = ", ".join(
+                f"bay {bay} Chrome {usage.rss / 2**20:.0f} MB {cpu[bay]:.0%} ({usage.processes} processes) "
+                f"profiles {profiles[bay] / 2**20:.0f} MB" for bay, usage in chrome.items())
+            print(f"Resources: daemon {daemon.rss / 2**20:.0f} MB {cpu[DAEMON_KEY]:.0%}, {bays}")
+        return sample
+
+    def overBudget(self) -> dict[str, str]:
+        """
+        The bays over a budget in the latest sample and the reason, except the bays recycled recently.
+        """
+        if not self.samples:
+            return {}
+        sample: ResourceSample = self.samples[-1]
+        bays: dict[str, str] = {}
+        for bay, usage in sample.chrome.items():
+            if sample.time - self.lastRecycles.get(bay, float("-inf")) < MIN_RECYCLE_INTERVAL:
+                continue
+            if self.cfg.chromeMemoryBudgetMb and usage.rss > self.cfg.chromeMemoryBudgetMb * 2**20:
+                bays[bay] = MEMORY_REASON
+            elif self.cfg.profileBudgetMb and sample.profiles.get(bay, 0) > self.cfg.profileBudgetMb * 2**20:
+                bays[bay] = PROFILE_REASON
+        return bays
+
+    def recycled(self, bay: str) -> None:
+        self.lastRecycles[bay] = time.time()
+
+
+def benchmark() -> None:
+    """
+    Cost of a sample with 4 bays of 10 processes each and user-data directories of 2000 files.
+    """
+    import shutil
+    import tempfile
+    import subprocess
+
+    directory: str = tempfile.mkdtemp()
+    children: list[subprocess.Popen] = []
+    try:
+        for index in range(2000):
+            folder: str = os.path.join(directory, f"profile{index % 4}", f"cache{index % 50}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"{index}"), "wb") as file:
+                file.write(b"x" * 1024)
+        children = [subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"]) for _ in range(40)]
+        cfg = Config(bays=[BayConfig(name=str(index), windowPositions=["0,0"]) for index in range(4)])
+        monitor = ResourceMonitor(cfg, lambda bay: [child.pid for child in children[int(bay.name)::4]],
+                                  lambda bay: [os.path.join(directory, f"profile{bay.name}")])
+        samples: int = 20
+        started: float = time.perf_counter()
+        for _ in range(samples):
+            monitor.sample()
+        elapsed: float = (time.perf_counter() - started) / samples
+        print(f"Sample of 4 bays, 40 processes, 2000 profile files: {elapsed * 1000:.1f} ms, "
+              f"{elapsed / SAMPLE_INTERVAL:.4%} of a core at one sample per {SAMPLE_INTERVAL} s")
+    finally:
+        for child in children:
+            child.kill()
+            child.wait()
+        shutil.rmtree(directory)
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    import shutil
+    import tempfile
+    import subprocess
+    from chrome import PROFILE_CACHE_DIRS, pruneProfileCaches
+
+    # a "Chrome" of two processes: a launcher holding 16 MB and its child holding 32 MB and burning CPU
+    child: str = ("import subprocess, sys, time; memory = bytearray(16 * 2**20); "
+                  "subprocess.Popen([sys.executable, '-c', 'memory = bytearray(32 * 2**20)\\nwhile True: pass']); "
+                  "time.sleep(60)")
+    launcher = subprocess.Popen([sys.executable, "-c", child])
+    directory: str = tempfile.mkdtemp()
+    try:
+        cache: str = os.path.join(directory, PROFILE_CACHE_DIRS[0])
+        os.makedirs(cache)
+        with open(os.path.join(cache, "shader"), "wb") as file:
+            file.write(b"x" * 2**20)
+        with open(os.path.join(directory, "Local State"), "wb") as file:
+            file.write(b"x" * 1000)
+
+        cfg = Config(chromeMemoryBudgetMb=1024, profileBudgetMb=0.5, bays=[BayConfig(name="1", windowPositions=["0,0"])])
+        monitor = ResourceMonitor(cfg, lambda bay: [launcher.pid], lambda bay: [directory])
+        time.sleep(1)
+        monitor.sample()
+        time.sleep(0.5)
+        sample = monitor.sample()
+        assert sample.chrome["1"].processes == 2, sample
+        assert sample.chrome["1"].rss > 48 * 2**20, sample
+        assert 0.5 < sample.cpu["1"] < 1.5, sample.cpu
+        assert sample.daemon.processes == 1 and sample.profiles["1"] == 2**20 + 1000
+        assert processRssBytes.value(process="chrome", bay="1") == sample.chrome["1"].rss
+        assert len(monitor.samples) == 2
+
+        # over the profile budget, then over the memory budget, not again right after a recycle
+        assert monitor.overBudget() == {"1": PROFILE_REASON}
+        cfg.chromeMemoryBudgetMb = 40
+        assert monitor.overBudget() == {"1": MEMORY_REASON}
+        monitor.recycled("1")
+        monitor.sample()
+        assert monitor.overBudget() == {}
+
+        # the caches are pruned, the rest of the profile is kept
+        assert pruneProfileCaches([directory]) == 2**20
+        assert directorySize(directory) == 1000
+
+        # a bay removed from the configuration has no more series
+        cfg.bays = []
+        monitor.sample()
+        assert 'bay="1"' not in "".join(processRssBytes.render())
+    finally:
+        for process in psutil.Process(launcher.pid).children(recursive=True):
+            process.kill()
+        launcher.kill()
+        launcher.wait()
+        shutil.rmtree(directory)
+
+    print("Resource monitor test finished.")
+    print()
@@ -0,0 +1,347 @@
+"""
+This module keeps a local copy of the bay's Google Calendar events.
+The first refresh does one full fetch of the day, following refreshes use the
+Calendar API syncToken to only apply the events that changed or were deleted.
+Each event is converted once, when it is received, to a Booking record (epoch
+seconds, summary and event ID): the schedule is published and searched without
+parsing the event dates again.
+Current and next events are then answered from memory.
+usage: python scheduleCache.py [benchmark]
+"""
+
+from time import monotonic
+from typing import Any, Optional, Tuple
+from datetime import date, datetime, time, timedelta, timezone
+from googleapiclient.errors import HttpError
+from typings_google_calendar_api.events import Event
+from metrics import calendarApiSeconds
+from scheduler import Booking
+
+# a full fetch covers today and tomorrow so a booking right after midnight is known
+FULL_SYNC_DAYS = 2
+# ended events are dropped from memory after this delay
+KEEP_ENDED_EVENTS = timedelta(hours=1)
+# HTTP status returned by the Calendar API when a sync token is no longer valid
+SYNC_TOKEN_EXPIRED = 410
+# partial response: only the event fields read by the daemon are transferred
+EVENT_FIELDS = "items(id,status,summary,start,end),nextPageToken,nextSyncToken"
+
+
+def eventTime(eventDateTime: Any) -> datetime:
+    """
+    Parse the start or end of a Google Calendar event as an aware datetime.
+    The date of an all-day event is the local midnight of that day, a time without offset is a local time.
+    """
+    if "dateTime" in eventDateTime:
+        parsed: datetime = datetime.fromisoformat(eventDateTime["dateTime"])
+    else:
+        parsed = datetime.combine(date.fromisoformat(eventDateTime["date"]), time.min)
+    # astimezone on a naive datetime takes the local offset of that date (daylight saving time included)
+    return parsed if parsed.tzinfo is not None else parsed.astimezone()
+
+
+def eventBooking(event: Event) -> Booking:
+    """
+    The booking record of a Google Calendar event.
+    """
+    return Booking(eventTime(event["start"]).timestamp(), eventTime(event["end"]).timestamp(),
+                   event.get("summary", ""), event["id"])
+
+
+class ScheduleCache:
+    """
+    In-memory schedule of a single calendar, kept up to date with incremental sync.
+    """
+
+    def __init__(self, calendarId: str, verbose: bool = False):
+        self.calendarId: str = calendarId
+        self.verbose: bool = verbose
+        self.events: dict[str, Booking] = {}
+        # bookings ordered by start, replaced (never modified) at each change: safe to publish as is
+        self.orderedEvents: list[Booking] = []
+        self.syncToken: Optional[str] = None
+        self.syncDay: Optional[date] = None
+        self.apiCalls: int = 0
+        self.lastChanges: int = 0
+        # state of the refresh in progress
+        self.fullSync: bool = True
+        self.query: dict[str, Any] = {}
+        self.pageToken: Optional[str] = None
+        # changed events of the refresh, None for a cancelled one
+        self.pageEvents: dict[str, Optional[Booking]] = {}
+
+    def refresh(self, calendarService: Any) -> None:
+        """
+        Bring the cache up to date. A full fetch is done on the first call, when the
+        local day changes or when Google reports the sync token as expired (HTTP 410).
+        Any other API error is raised to the caller.
+        """
+        self.beginRefresh()
+        while True:
+            request: Any = self.nextRequest(calendarService)
+            started: float = monotonic()
+            try:
+                response: dict[str, Any] = request.execute()
+            except HttpError as he:
+                self.handleError(he)
+                continue
+            finally:
+                calendarApiSeconds.observe(monotonic() - started, request="list")
+            if self.handleResponse(response):
+                return
+
+    def beginRefresh(self) -> None:
+        """
+        Start a refresh: a full fetch of the day (and the next one) if there is no valid
+        sync token, otherwise an incremental one. The requests are then built by nextRequest,
+        so the refresh of several calendars can be sent in a single batch.
+        """
+        today: date = datetime.now().date()
+        self.fullSync = self.syncToken is None or self.syncDay != today
+        self.pageToken = None
+        self.pageEvents = {}
+        if self.fullSync:
+            dayStart: datetime = datetime.combine(today, time.min).astimezone(timezone.utc)
+            self.query = {
+                "timeMin": dayStart.isoformat(),
+                "timeMax": (dayStart + timedelta(days=FULL_SYNC_DAYS)).isoformat(),
+            }
+        else:
+            self.query = {"syncToken": self.syncToken}
+
+    def nextRequest(self, calendarService: Any) -> Any:
+        """
+        Returns the events().list request of the next page of the refresh.
+        """
+        self.apiCalls += 1
+        return calendarService.events().list(
+            calendarId=self.calendarId,
+            singleEvents=True,
+            pageToken=self.pageToken,
+            fields=EVENT_FIELDS,
+            **self.query
+        )
+
+    def handleError(self, error: Exception) -> None:
+        """
+        An expired sync token restarts the refresh as a full fetch, any other error is raised.
+        """
+        if self.fullSync or not isinstance(error, HttpError) or error.resp.status != SYNC_TOKEN_EXPIRED:
+            raise error
+        print("Calendar sync token expired. Doing a full resync.")
+        self.syncToken = None
+        self.beginRefresh()
+
+    def handleResponse(self, response: dict[str, Any]) -> bool:
+        """
+        Merge a page of the refresh. Returns True when the last page was applied to the cache.
+        """
+        for event in response.get("items", []):
+            # a cancelled event may come without its start and end
+            self.pageEvents[event["id"]] = eventBooking(event) if event.get("status") != "cancelled" else None
+
+        self.pageToken = response.get("nextPageToken")
+        if self.pageToken is not None:
+            return False
+
+        if self.fullSync:
+            self.events = {eventId: booking for eventId, booking in self.pageEvents.items() if booking is not None}
+            self.syncDay = datetime.now().date()
+            self.lastChanges = 0
+            self.sortEvents()
+            if (self.verbose):
+                print(f"Calendar full sync done: {len(self.events)} events")
+        else:
+            for eventId, booking in self.pageEvents.items():
+                if booking is None:
+                    self.events.pop(eventId, None)
+                else:
+                    self.events[eventId] = booking
+            self.lastChanges = len(self.pageEvents)
+            if self.pageEvents:
+                self.sortEvents()
+            if (self.verbose):
+                print(f"Calendar incremental sync done: {len(self.pageEvents)} changed events")
+
+        self.syncToken = response.get("nextSyncToken")
+        self.pageEvents = {}
+        return True
+
+    def sortEvents(self) -> None:
+        """
+        Rebuild the list of bookings ordered by start time, without the long ended ones.
+        """
+        keepAfter: float = datetime.now(timezone.utc).timestamp() - KEEP_ENDED_EVENTS.total_seconds()
+        for eventId in [eventId for eventId, booking in self.events.items() if booking.end < keepAfter]:
+            del self.events[eventId]
+        self.orderedEvents = sorted(self.events.values())
+
+    def getEvents(self, now: float, lookAhead: float) -> Tuple[Optional[Booking], Optional[Booking]]:
+        """
+        Returns a tuple: (currentEvent, nextEvent) where nextEvent starts within lookAhead seconds.
+        """
+        currentEvent: Optional[Booking] = None
+        nextEvent: Optional[Booking] = None
+
+        for event in self.orderedEvents:
+            if event.start > now + lookAhead:
+                break
+            if event.end <= now:
+                continue
+            if event.start <= now:
+                currentEvent = event
+            elif nextEvent is None:
+                nextEvent = event
+
+        return currentEvent, nextEvent
+
+
+def benchmark() -> None:
+    """
+    Memory held by the events of 20 busy calendars and cost of publishing their schedule after
+    a change: raw event dicts parsed at each publication against booking records built once.
+    """
+    import json
+    import tracemalloc
+    from timeit import timeit
+
+    eventCount: int = 20 * 60
+
+    def eventDicts() -> list[Event]:
+        # the API response is decoded from JSON like the Google client does
+        start: datetime = datetime.now(timezone.utc).replace(microsecond=0)
+        items: list[dict[str, Any]] = [{
+            "id": f"event{index:06d}", "status": "confirmed", "summary": f"Booking {index}",
+            "start": {"dateTime": (start + timedelta(minutes=index)).astimezone().isoformat()},
+            "end": {"dateTime": (start + timedelta(minutes=index + 15)).astimezone().isoformat()},
+        } for index in range(eventCount)]
+        return json.loads(json.dumps(items))
+
+    def dictSchedule(events: dict[str, Event]) -> list[Booking]:
+        # the previous path: the events sorted and converted at each publication
+        ordered: list[Event] = sorted(events.values(), key=lambda event: eventTime(event["start"]))
+        return [Booking(eventTime(event["start"]).timestamp(), eventTime(event["end"]).timestamp(),
+                        event.get("summary", "")) for event in ordered]
+
+    def retained(build: Any) -> int:
+        tracemalloc.start()
+        held: Any = build()
+        size: int = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del held
+        return size
+
+    dictBytes: int = retained(lambda: {event["id"]: event for event in eventDicts()})
+    recordBytes: int = retained(lambda: {event["id"]: eventBooking(event) for event in eventDicts()})
+    print(f"{eventCount} events held: dicts {dictBytes / eventCount:.0f} bytes, "
+          f"records {recordBytes / eventCount:.0f} bytes per event ({dictBytes / recordBytes:.1f}x)")
+
+    byId: dict[str, Event] = {event["id"]: event for event in eventDicts()}
+    cache = ScheduleCache("benchmark")
+    cache.events = {eventId: eventBooking(event) for eventId, event in byId.items()}
+    runs: int = 20
+    dictSeconds: float = timeit(lambda: dictSchedule(byId), number=runs) / runs
+    recordSeconds: float = timeit(cache.sortEvents, number=runs) / runs
+    print(f"Schedule published after a change: dicts {dictSeconds * 1000:.2f} ms, records {recordSeconds * 1000:.2f} ms "
+          f"({dictSeconds / recordSeconds:.0f}x)")
+
+
+# test module
+if __name__ == "__main__":
+    import sys
+    import httplib2
+
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    class FakeRequest:
+        def __init__(self, execute: Any):
+            self.execute = execute
+
+    class FakeCalendarService:
+        """
+        Stand-in for the Google Calendar service supporting sync tokens.
+        """
+
+        def __init__(self):
+            self.items: dict[str, Event] = {}
+            self.changes: list[str] = []
+            self.tokenExpired = False
+            self.calls: list[dict[str, Any]] = []
+
+        def put(self, eventId: str, summary: str, start: datetime, end: datetime, status: str = "confirmed") -> None:
+            self.items[eventId] = {  # type: ignore
+                "id": eventId, "status": status, "summary": summary,
+                "start": {"dateTime": start.isoformat()}, "end": {"dateTime": end.isoformat()},
+            }
+            self.changes.append(eventId)
+
+        def events(self) -> "FakeCalendarService":
+            return self
+
+        def list(self, **query: Any) -> FakeRequest:
+            self.calls.append(query)
+            return FakeRequest(lambda: self.execute(query))
+
+        def execute(self, query: dict[str, Any]) -> dict[str, Any]:
+            if query.get("syncToken") is not None:
+                if self.tokenExpired:
+                    raise HttpError(httplib2.Response({"status": SYNC_TOKEN_EXPIRED}), b"Sync token is no longer valid")
+                changed = [self.items[eventId] for eventId in self.changes[int(query["syncToken"]):]]
+            else:
+                changed = [event for event in self.items.values() if event["status"] != "cancelled"]
+            self.tokenExpired = False
+            return {"items": changed, "nextSyncToken": str(len(self.changes))}
+
+    now = datetime.now(timezone.utc)
+    service = FakeCalendarService()
+    service.put("a", "current", now - timedelta(minutes=10), now + timedelta(minutes=5))
+    service.put("b", "next", now + timedelta(minutes=5), now + timedelta(minutes=20))
+    service.put("c", "later", now + timedelta(hours=3), now + timedelta(hours=4))
+
+    cache = ScheduleCache("test")
+    cache.refresh(service)
+    assert "syncToken" not in service.calls[-1]
+    currentEvent, nextEvent = cache.getEvents(now.timestamp(), 600)
+    assert currentEvent is not None and currentEvent.eventId == "a"
+    assert nextEvent is not None and nextEvent.eventId == "b"
+
+    # incremental sync: the next booking is cancelled
+    service.put("b", "next", now + timedelta(minutes=5), now + timedelta(minutes=20), status="cancelled")
+    cache.refresh(service)
+    assert service.calls[-1]["syncToken"] == "3"
+    currentEvent, nextEvent = cache.getEvents(now.timestamp(), 600)
+    assert nextEvent is None
+
+    # expired sync token falls back to a full fetch
+    service.tokenExpired = True
+    service.put("d", "extension", now + timedelta(minutes=5), now + timedelta(minutes=30))
+    cache.refresh(service)
+    assert "syncToken" not in service.calls[-1]
+    currentEvent, nextEvent = cache.getEvents(now.timestamp(), 600)
+    assert nextEvent is not None and nextEvent.eventId == "d"
+    assert cache.apiCalls == 4 == len(service.calls)
+    assert [booking.eventId for booking in cache.orderedEvents] == ["a", "d", "c"]
+
+    # dates: an offset, UTC, a local time, an all-day event from local midnight to local midnight
+    assert eventTime({"dateTime": "2026-10-17T10:00:00-04:00"}) == datetime(2026, 10, 17, 14, tzinfo=timezone.utc)
+    assert eventTime({"dateTime": "2026-10-17T14:00:00Z"}) == datetime(2026, 10, 17, 14, tzinfo=timezone.utc)
+    assert eventTime({"dateTime": "2026-10-17T10:00:00"}) == datetime(2026, 10, 17, 10).astimezone()
+    allDay: Booking = eventBooking({  # type: ignore
+        "id": "e", "summary": "tournament", "start": {"date": "2026-03-08"}, "end": {"date": "2026-03-09"}
+    })
+    assert allDay.start == datetime(2026, 3, 8).timestamp() and allDay.end == datetime(2026, 3, 9).timestamp()
+    assert datetime.fromtimestamp(allDay.start).time() == time.min == datetime.fromtimestamp(allDay.end).time()
+    # an all-day event of today is kept and sorted with the timed ones
+    today: str = now.astimezone().date().isoformat()
+    service.items["e"] = {  # type: ignore
+        "id": "e", "status": "confirmed", "summary": "tournament",
+        "start": {"date": today}, "end": {"date": (now.astimezone().date() + timedelta(days=1)).isoformat()},
+    }
+    service.changes.append("e")
+    cache.refresh(service)
+    assert [booking.summary for booking in cache.orderedEvents if booking.eventId == "e"] == ["tournament"]
+
+    print("Schedule cache test finished.")
+    print()
@@ -0,0 +1,701 @@
+"""
+This module plans the screen blocker transitions from the known schedule.
+Transition deadlines of every bay are kept in a single priority queue so the
+daemon can sleep exactly until the next one instead of polling:
+- 5 minutes before a booking starts, the blocker is removed.
+- At the end of a booking, the times up (or back-to-back) message is displayed.
+- 20 seconds later, the padlock is displayed (or the blocker is removed for a back-to-back booking).
+The bookings of each bay are indexed (sorted arrays searched by bisection) and merged into
+sessions: chained bookings keep the screens unlocked from the first to the last one.
+The operator overrides (a forced lock or unlock, a session extended by a few minutes) are
+layered over the bookings of the calendar: a calendar refresh does not undo them.
+usage: python scheduler.py [benchmark]
+"""
+
+import sys
+import queue
+import heapq
+import bisect
+import threading
+import time
+from enum import Enum
+from typing import Iterable, NamedTuple, Optional
+
+# the blocker is removed this many seconds before a booking starts
+UNLOCK_BEFORE_START = 5 * 60
+# the end of booking message is displayed for this many seconds
+MESSAGE_DURATION = 20
+# seconds between two checks that the current state is still enforced
+ENFORCE_INTERVAL = 20
+# operator commands
+STATUS_COMMAND = "status"
+LOCK_COMMAND = "lock"
+UNLOCK_COMMAND = "unlock"
+EXTEND_COMMAND = "extend"
+RELEASE_COMMAND = "release"
+# summary of the bookings added by an extension
+EXTENSION_SUMMARY = "Extended by the operator"
+# upcoming transitions reported in a bay status
+STATUS_TRANSITIONS = 5
+
+
+class DisplayState(Enum):
+    hidden = "hidden"
+    timesUp = "timesUp"
+    backToBack = "backtoback"
+    padlock = "padlock"
+
+
+class Booking(NamedTuple):
+    """
+    A calendar event, built once when it is received (see scheduleCache.eventBooking).
+    """
+    start: float  # epoch seconds
+    end: float  # epoch seconds
+    summary: str
+    eventId: str = ""  # empty for the bookings of a replay or of an old snapshot
+
+
+class Session(NamedTuple):
+    start: float  # epoch seconds, start of the first booking
+    end: float  # epoch seconds, end of the last booking
+    bookings: int
+
+
+class Override(NamedTuple):
+    state: DisplayState  # padlock for a forced lock, hidden for a forced unlock
+    until: Optional[float]  # epoch seconds, None until released
+
+
+class BayStatus(NamedTuple):
+    bay: str
+    state: DisplayState  # what the screens display, override included
+    override: Optional[Override]
+    session: Optional[Session]  # the session in progress, extensions included
+    transitions: list[tuple[float, DisplayState]]  # upcoming state changes, epoch seconds
+
+
+class Command:
+    """
+    An operator command, queued by the control API and applied by the planner in the thread of the main loop.
+    """
+
+    def __init__(self, action: str, bay: Optional[str] = None, minutes: Optional[float] = None):
+        self.action: str = action
+        # None: every bay (status only)
+        self.bay: Optional[str] = bay
+        # duration of a forced lock or unlock (None until released), minutes added by an extension
+        self.minutes: Optional[float] = minutes
+        self.error: Optional[str] = None
+        self.result: list[BayStatus] = []
+        self.done: threading.Event = threading.Event()
+
+
+class ScheduleIndex:
+    """
+    The bookings of a bay, indexed to answer in O(log n) what is current, what is next, whether the bay
+    is free and what to display at a given time. Bookings overlapping, adjacent or separated by less than
+    UNLOCK_BEFORE_START are merged into one session: the screens stay unlocked from the first to the last.
+    """
+
+    def __init__(self, bookings: Iterable[Booking]):
+        ordered: list[Booking] = sorted(bookings)
+        self.bookings: list[Booking] = ordered
+        self.starts: list[float] = [booking.start for booking in ordered]
+        self.ends: list[float] = sorted(booking.end for booking in ordered)
+        # latest end of the bookings starting before each one (included), ordered by start
+        self.maxEnds: list[float] = []
+        latestEnd: float = float("-inf")
+        sessions: list[Session] = []
+        for booking in ordered:
+            latestEnd = max(latestEnd, booking.end)
+            self.maxEnds.append(latestEnd)
+            if sessions and booking.start - UNLOCK_BEFORE_START <= sessions[-1].end:
+                last: Session = sessions[-1]
+                sessions[-1] = Session(last.start, max(last.end, booking.end), last.bookings + 1)
+            else:
+                sessions.append(Session(booking.start, booking.end, 1))
+        self.sessions: list[Session] = sessions
+        self.sessionStarts: list[float] = [session.start for session in sessions]
+
+    def current(self, now: float) -> Optional[Session]:
+        """
+        The session in progress (pauses between its bookings included), None if the bay is free.
+        """
+        index: int = bisect.bisect_right(self.sessionStarts, now) - 1
+        if index >= 0 and now < self.sessions[index].end:
+            return self.sessions[index]
+        return None
+
+    def next(self, now: float) -> Optional[Session]:
+        """
+        The first session starting after now.
+        """
+        index: int = bisect.bisect_right(self.sessionStarts, now)
+        return self.sessions[index] if index < len(self.sessions) else None
+
+    def booking(self, now: float) -> Optional[Booking]:
+        """
+        The booking the screens are unlocked for: the latest one started if it is not over, otherwise the next one.
+        """
+        index: int = bisect.bisect_right(self.starts, now) - 1
+        if index >= 0 and now < self.bookings[index].end:
+            return self.bookings[index]
+        return self.bookings[index + 1] if index + 1 < len(self.bookings) else None
+
+    def isFree(self, now: float) -> bool:
+        return self.current(now) is None
+
+    def unlockedSession(self, now: float) -> Optional[Session]:
+        """
+        The session the screens are unlocked for: from UNLOCK_BEFORE_START before it until its end.
+        """
+        index: int = bisect.bisect_right(self.sessionStarts, now + UNLOCK_BEFORE_START) - 1
+        return self.sessions[index] if index >= 0 and now < self.sessions[index].end else None
+
+    def unlocked(self, now: float) -> bool:
+        """
+        True from UNLOCK_BEFORE_START before a session until its end.
+        """
+        return self.unlockedSession(now) is not None
+
+    def state(self, now: float) -> DisplayState:
+        """
+        What the screen should display at the given time, see desiredState.
+        """
+        # the latest booking end within the last MESSAGE_DURATION seconds
+        endIndex: int = bisect.bisect_right(self.ends, now) - 1
+        ended: Optional[float] = None
+        if endIndex >= 0 and now < self.ends[endIndex] + MESSAGE_DURATION:
+            ended = self.ends[endIndex]
+        if ended is not None:
+            # a booking started before the end and still going on continues the session
+            startIndex: int = bisect.bisect_left(self.starts, ended) - 1
+            continued: bool = startIndex >= 0 and self.maxEnds[startIndex] > ended
+            # a booking starting within UNLOCK_BEFORE_START after the end is back-to-back
+            nextIndex: int = bisect.bisect_left(self.starts, ended)
+            backToBack: bool = nextIndex < len(self.starts) and self.starts[nextIndex] <= ended + UNLOCK_BEFORE_START
+            if backToBack and not continued:
+                return DisplayState.backToBack
+
+        if self.unlocked(now):
+            return DisplayState.hidden
+        if ended is not None:
+            return DisplayState.timesUp
+        return DisplayState.padlock
+
+
+class Clock:
+    """
+    Wall clock used by the scheduler, replaced by a fake one in tests.
+    """
+
+    def now(self) -> float:
+        return time.time()
+
+    def wait(self, wakeUp: threading.Event, timeout: float) -> bool:
+        """
+        Sleep for timeout seconds or until wakeUp is set. Returns True if woken up.
+        """
+        return wakeUp.wait(timeout)
+
+
+class SimulatedClock(Clock):
+    """
+    Clock of the tests and replays: waiting only moves the time forward, instantly.
+    """
+
+    def __init__(self, now: float):
+        self.time: float = now
+
+    def now(self) -> float:
+        return self.time
+
+    def wait(self, wakeUp: threading.Event, timeout: float) -> bool:
+        self.time += timeout
+        return False
+
+
+def desiredState(bookings: Iterable[Booking], now: float) -> DisplayState:
+    """
+    Returns what the screen should display at the given time.
+    A booking starting at most 5 minutes after the end of another one is back-to-back,
+    a booking already started at the end of another one continues the session.
+    Callers evaluating the same bookings repeatedly keep a ScheduleIndex instead.
+    """
+    return ScheduleIndex(bookings).state(now)
+
+
+def linearState(bookings: list[Booking], now: float) -> DisplayState:
+    """
+    desiredState by scanning every booking, the reference of the tests and the benchmark.
+    """
+    endedBooking: Optional[Booking] = None
+    for booking in bookings:
+        if booking.end <= now < booking.end + MESSAGE_DURATION and (endedBooking is None or booking.end >= endedBooking.end):
+            endedBooking = booking
+    if endedBooking is not None:
+        continued: bool = False
+        backToBack: bool = False
+        for booking in bookings:
+            if booking.start < endedBooking.end < booking.end:
+                continued = True
+            elif endedBooking.end <= booking.start <= endedBooking.end + UNLOCK_BEFORE_START:
+                backToBack = True
+        if backToBack and not continued:
+            return DisplayState.backToBack
+
+    for booking in bookings:
+        if booking.start - UNLOCK_BEFORE_START <= now < booking.end:
+            return DisplayState.hidden
+
+    if endedBooking is not None:
+        return DisplayState.timesUp
+    return DisplayState.padlock
+
+
+class TransitionScheduler:
+    """
+    Keeps the transition deadlines of every bay in a single priority queue.
+    Only the bays with a deadline reached or a new schedule are evaluated on update.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None):
+        self.clock: Clock = clock if clock is not None else Clock()
+        self.bookings: dict[str, list[Booking]] = {}
+        self.indexes: dict[str, ScheduleIndex] = {}
+        self.deadlines: list[tuple[float, str]] = []
+        self.states: dict[str, DisplayState] = {}
+        self.lastDeadlines: dict[str, float] = {}
+        self.replanned: set[str] = set()
+        self.wakeUp: threading.Event = threading.Event()
+        # operator overrides: a forced state and the bookings added to extend a session, by bay
+        self.overrides: dict[str, Override] = {}
+        self.extensions: dict[str, list[Booking]] = {}
+
+    def replan(self, bays: dict[str, Iterable[Booking]]) -> bool:
+        """
+        Rebuild the deadlines of the bays whose schedule changed. Returns True if any did.
+        """
+        changed: dict[str, list[Booking]] = {}
+        for bay, bookings in bays.items():
+            ordered: list[Booking] = sorted(bookings)
+            if bay not in self.bookings or ordered != self.bookings[bay]:
+                changed[bay] = ordered
+        removed: set[str] = set(self.bookings) - set(bays)
+        if not changed and not removed:
+            return False
+
+        for bay in removed:
+            del self.bookings[bay]
+            del self.indexes[bay]
+            self.states.pop(bay, None)
+            self.overrides.pop(bay, None)
+            self.extensions.pop(bay, None)
+        self.bookings.update(changed)
+        self.rebuild(set(changed), removed)
+        return True
+
+    def rebuild(self, bays: set[str], removed: set[str] = set()) -> None:
+        """
+        Rebuild the index and the deadlines of the bays from their bookings, extensions and override.
+        """
+        now: float = self.clock.now()
+        for bay in bays:
+            extensions: list[Booking] = [
+                booking for booking in self.extensions.pop(bay, []) if booking.end + MESSAGE_DURATION > now
+            ]
+            if extensions:
+                self.extensions[bay] = extensions
+            self.indexes[bay] = ScheduleIndex(self.bookings[bay] + extensions)
+        self.deadlines = [deadline for deadline in self.deadlines if deadline[1] not in bays and deadline[1] not in removed]
+        self.deadlines += [
+            (deadline, bay)
+            for bay in bays
+            for booking in self.indexes[bay].bookings
+            for deadline in (booking.start - UNLOCK_BEFORE_START, booking.end, booking.end + MESSAGE_DURATION)
+            if deadline > now
+        ]
+        for bay in bays:
+            override: Optional[Override] = self.overrides.get(bay)
+            if override is not None and override.until is not None and override.until > now:
+                self.deadlines.append((override.until, bay))
+        heapq.heapify(self.deadlines)
+        self.replanned.update(bays)
+        self.replanned -= removed
+        self.wakeUp.set()
+
+    def nextDeadline(self) -> Optional[float]:
+        return self.deadlines[0][0] if self.deadlines else None
+
+    def nextBayDeadline(self, bay: str) -> Optional[float]:
+        return min((deadline for deadline, deadlineBay in self.deadlines if deadlineBay == bay), default=None)
+
+    def update(self) -> dict[str, DisplayState]:
+        """
+        Pop the deadlines reached and return the new display state of the bays whose state changed.
+        """
+        self.wakeUp.clear()
+        now: float = self.clock.now()
+        self.lastDeadlines = {}
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, bay = heapq.heappop(self.deadlines)
+            self.lastDeadlines[bay] = deadline
+
+        changes: dict[str, DisplayState] = {}
+        for bay in sorted(self.replanned | set(self.lastDeadlines)):
+            override: Optional[Override] = self.overrides.get(bay)
+            if override is not None and override.until is not None and override.until <= now:
+                del self.overrides[bay]
+            state: DisplayState = self.bayState(bay, now)
+            if state != self.states.get(bay):
+                self.states[bay] = state
+                changes[bay] = state
+        self.replanned = set()
+        return changes
+
+    def bayState(self, bay: str, now: float) -> DisplayState:
+        """
+        What the screens of the bay should display at the given time: the override in force, otherwise the schedule.
+        """
+        override: Optional[Override] = self.overrides.get(bay)
+        if override is not None and (override.until is None or now < override.until):
+            return override.state
+        return self.indexes[bay].state(now)
+
+    def override(self, bay: str, state: DisplayState, seconds: Optional[float] = None) -> None:
+        """
+        Force the state of the bay for the given seconds, or until released.
+        """
+        self.overrides[bay] = Override(state, self.clock.now() + seconds if seconds is not None else None)
+        self.rebuild({bay})
+
+    def extend(self, bay: str, seconds: float) -> None:
+        """
+        Extend the session in progress by the given seconds, or unlock a free bay for that long.
+        A forced state is released: the bay follows the extended session.
+        """
+        now: float = self.clock.now()
+        session: Optional[Session] = self.indexes[bay].current(now)
+        end: float = session.end if session is not None else now
+        # started before a booking which just ended: the session goes on, without the end of booking message
+        self.extensions.setdefault(bay, []).append(Booking(now - MESSAGE_DURATION, end + seconds, EXTENSION_SUMMARY))
+        self.overrides.pop(bay, None)
+        self.rebuild({bay})
+
+    def release(self, bay: str) -> None:
+        """
+        Drop the override and the extensions of the bay: back to the calendar.
+        """
+        self.overrides.pop(bay, None)
+        self.extensions.pop(bay, None)
+        self.rebuild({bay})
+
+    def status(self, bay: str, transitions: int = STATUS_TRANSITIONS) -> BayStatus:
+        """
+        The state of the bay and its next state changes.
+        """
+        now: float = self.clock.now()
+        state: DisplayState = self.bayState(bay, now)
+        upcoming: list[tuple[float, DisplayState]] = []
+        previous: DisplayState = state
+        for deadline in sorted(deadline for deadline, deadlineBay in self.deadlines if deadlineBay == bay):
+            if len(upcoming) == transitions:
+                break
+            next: DisplayState = self.bayState(bay, deadline)
+            if next != previous:
+                upcoming.append((deadline, next))
+                previous = next
+        return BayStatus(bay, state, self.overrides.get(bay), self.indexes[bay].current(now), upcoming)
+
+    def wait(self, until: float) -> None:
+        """
+        Sleep until the next deadline, the given time or a replan, whichever comes first.
+        """
+        deadline: Optional[float] = self.nextDeadline()
+        if deadline is not None:
+            until = min(until, deadline)
+        timeout: float = until - self.clock.now()
+        if timeout > 0:
+            self.clock.wait(self.wakeUp, timeout)
+
+
+class Action(NamedTuple):
+    time: float  # epoch seconds
+    bay: str
+    state: DisplayState
+    deadline: Optional[float]  # the transition deadline reached, None after a replan or for an enforcement
+    enforce: bool  # True if the current state is only applied again
+
+
+class Planner:
+    """
+    Decision logic of the daemon main loop, without any side effect: given the latest schedule,
+    returns the display states to apply, then sleeps on the clock until something can change.
+    The daemon applies the actions to Chrome, the replays only record them.
+    """
+
+    def __init__(self, clock: Optional[Clock] = None, enforceInterval: float = ENFORCE_INTERVAL):
+        self.scheduler: TransitionScheduler = TransitionScheduler(clock)
+        self.clock: Clock = self.scheduler.clock
+        self.enforceInterval: float = enforceInterval
+        self.nextEnforce: float = 0
+        self.commands: queue.SimpleQueue[Command] = queue.SimpleQueue()
+
+    def submit(self, command: Command, timeout: float) -> bool:
+        """
+        Queue an operator command and wake the main loop up. Returns True once applied by the next step,
+        False if it was not applied within timeout seconds.
+        """
+        self.commands.put(command)
+        self.scheduler.wakeUp.set()
+        return command.done.wait(timeout)
+
+    def apply(self, command: Command) -> None:
+        """
+        Apply an operator command and store the status of its bay (of every bay for a status) in its result.
+        """
+        scheduler: TransitionScheduler = self.scheduler
+        if command.bay is not None and command.bay not in scheduler.indexes:
+            command.error = f"Unknown bay {command.bay}"
+            return
+        seconds: Optional[float] = command.minutes * 60 if command.minutes is not None else None
+        if command.action == STATUS_COMMAND:
+            pass
+        elif command.bay is None:
+            command.error = f"No bay given to {command.action}"
+            return
+        elif command.action in (LOCK_COMMAND, UNLOCK_COMMAND):
+            scheduler.override(command.bay, DisplayState.padlock if command.action == LOCK_COMMAND else DisplayState.hidden,
+                               seconds)
+        elif command.action == EXTEND_COMMAND and seconds is not None and seconds > 0:
+            scheduler.extend(command.bay, seconds)
+        elif command.action == RELEASE_COMMAND:
+            scheduler.release(command.bay)
+        else:
+            command.error = f"Invalid command {command.action}"
+            return
+        bays: list[str] = [command.bay] if command.bay is not None else sorted(scheduler.indexes)
+        command.result = [scheduler.status(bay) for bay in bays]
+
+    def step(self, bays: Optional[dict[str, Iterable[Booking]]] = None) -> list[Action]:
+        """
+        Apply the operator commands, replan if a new schedule (bookings by bay) is given, then return
+        the state changes and, every enforceInterval, the current state of the other bays.
+        """
+        while not self.commands.empty():
+            command: Command = self.commands.get()
+            try:
+                self.apply(command)
+            finally:
+                command.done.set()
+        if bays is not None:
+            self.scheduler.replan(bays)
+        changes: dict[str, DisplayState] = self.scheduler.update()
+        now: float = self.clock.now()
+        actions: list[Action] = [
+            Action(now, bay, state, self.scheduler.lastDeadlines.get(bay), False) for bay, state in changes.items()
+        ]
+        if now >= self.nextEnforce:
+            actions += [
+                Action(now, bay, state, None, True) for bay, state in self.scheduler.states.items() if bay not in changes
+            ]
+            self.nextEnforce = now + self.enforceInterval
+        return actions
+
+    def wait(self, until: Optional[float] = None) -> None:
+        """
+        Sleep until the next transition, the next enforcement, the given time, a replan or an operator command.
+        """
+        if not self.commands.empty():
+            return
+        self.scheduler.wait(self.nextEnforce if until is None else min(until, self.nextEnforce))
+
+
+def syntheticCalendars(calendars: int, bookingsPerCalendar: int, seed: int = 0) -> list[list[Booking]]:
+    """
+    Calendars of consecutive bookings of 15 minutes to 2 hours, chained (overlapping, adjacent or a few
+    minutes apart) or separated by a free period of up to 3 hours.
+    """
+    import random
+
+    rng = random.Random(seed)
+    result: list[list[Booking]] = []
+    for calendar in range(calendars):
+        bookings: list[Booking] = []
+        start: float = 1767600000 + rng.uniform(0, 3600)
+        for index in range(bookingsPerCalendar):
+            end: float = start + rng.choice((15, 30, 45, 60, 90, 120)) * 60
+            bookings.append(Booking(start, end, f"booking {calendar}.{index}"))
+            start = end + rng.choice((-15 * 60, 0, 0, 2 * 60, 5 * 60, 6 * 60, rng.uniform(10 * 60, 3 * 3600)))
+        result.append(bookings)
+    return result
+
+
+def benchmark() -> None:
+    """
+    Display state and session queries over a week of 50 calendars (tens of thousands of bookings),
+    scanning the bookings as before and with the index.
+    """
+    import random
+    import timeit
+
+    calendars: list[list[Booking]] = syntheticCalendars(50, 600)
+    total: int = sum(len(bookings) for bookings in calendars)
+    rng = random.Random(1)
+    first: float = min(bookings[0].start for bookings in calendars)
+    last: float = max(bookings[-1].end for bookings in calendars)
+    queries: list[tuple[int, float]] = [(rng.randrange(len(calendars)), rng.uniform(first, last)) for _ in range(2000)]
+
+    started: float = time.perf_counter()
+    indexes: list[ScheduleIndex] = [ScheduleIndex(bookings) for bookings in calendars]
+    build: float = time.perf_counter() - started
+    sessions: int = sum(len(index.sessions) for index in indexes)
+    print(f"{len(calendars)} calendars, {total} bookings merged into {sessions} sessions, "
+          f"indexed in {build * 1000:.0f} ms")
+
+    linear: float = timeit.timeit(lambda: [linearState(calendars[calendar], now) for calendar, now in queries],
+                                  number=1) / len(queries)
+    indexed: float = timeit.timeit(lambda: [indexes[calendar].state(now) for calendar, now in queries],
+                                   number=20) / 20 / len(queries)
+    lookups: float = timeit.timeit(
+        lambda: [(indexes[calendar].current(now), indexes[calendar].next(now), indexes[calendar].isFree(now))
+                 for calendar, now in queries], number=20) / 20 / len(queries)
+    print(f"Display state, scanning the bookings: {linear * 1e6:8.1f} us per query")
+    print(f"Display state, indexed              : {indexed * 1e6:8.1f} us per query ({linear / indexed:.0f} times faster)")
+    print(f"Current, next and free, indexed     : {lookups * 1e6:8.1f} us per query")
+    assert all(linearState(calendars[calendar], now) == indexes[calendar].state(now) for calendar, now in queries)
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    # chained bookings form one session, a free period of more than UNLOCK_BEFORE_START starts another one
+    index = ScheduleIndex([Booking(2500, 3400, "second"), Booking(1600, 2500, "first"), Booking(3500, 3600, "third"),
+                           Booking(5000, 6000, "fourth"), Booking(5500, 5800, "overlapping")])
+    assert index.sessions == [Session(1600, 3600, 3), Session(5000, 6000, 2)], index.sessions
+    assert index.current(3450) == Session(1600, 3600, 3) and not index.isFree(3450)
+    assert index.current(1599) is None and index.isFree(4000) and index.isFree(6000)
+    assert index.next(0) == Session(1600, 3600, 3) and index.next(1600) == Session(5000, 6000, 2)
+    assert index.next(5000) is None
+    assert index.booking(1300).summary == "first" and index.booking(2500).summary == "second"
+    assert index.booking(3450).summary == "third" and index.booking(6000) is None
+    assert index.unlocked(1300) and not index.unlocked(1299) and index.unlocked(4700) and not index.unlocked(6000)
+    assert ScheduleIndex([]).state(0) == DisplayState.padlock and ScheduleIndex([]).next(0) is None
+
+    # the index decides like a scan of every booking
+    for seed in range(20):
+        for bookings in syntheticCalendars(3, 30, seed):
+            index = ScheduleIndex(bookings)
+            samples: set[float] = set()
+            for booking in bookings:
+                for deadline in (booking.start - UNLOCK_BEFORE_START, booking.end, booking.end + MESSAGE_DURATION):
+                    samples.update((deadline - 1, deadline, deadline + 1))
+            for now in samples:
+                assert index.state(now) == linearState(bookings, now), (seed, now)
+
+    clock = SimulatedClock(1000.0)
+    scheduler = TransitionScheduler(clock)
+    # bay 1: booking at 1600-2500, back-to-back booking at 2500-3400, then a lone booking at 5000-6000
+    # bay 2: a lone booking at 2000-3000
+    scheduler.replan({
+        "1": [Booking(1600, 2500, "first"), Booking(2500, 3400, "second"), Booking(5000, 6000, "third")],
+        "2": [Booking(2000, 3000, "other bay")],
+    })
+
+    timeline: list[tuple[float, str, DisplayState]] = []
+    while clock.now() < 7000:
+        for bay, state in sorted(scheduler.update().items()):
+            timeline.append((clock.now(), bay, state))
+        scheduler.wait(7000)
+
+    assert timeline == [
+        (1000, "1", DisplayState.padlock),
+        (1000, "2", DisplayState.padlock),
+        (1300, "1", DisplayState.hidden),
+        (1700, "2", DisplayState.hidden),
+        (2500, "1", DisplayState.backToBack),
+        (2520, "1", DisplayState.hidden),
+        (3000, "2", DisplayState.timesUp),
+        (3020, "2", DisplayState.padlock),
+        (3400, "1", DisplayState.timesUp),
+        (3420, "1", DisplayState.padlock),
+        (4700, "1", DisplayState.hidden),
+        (6000, "1", DisplayState.timesUp),
+        (6020, "1", DisplayState.padlock),
+    ], timeline
+
+    # an overlapping booking continues the session without any message
+    assert desiredState([Booking(0, 100, "a"), Booking(50, 200, "b")], 105) == DisplayState.hidden
+    # a replan with the same schedule keeps the deadlines
+    assert not scheduler.replan({
+        "1": [Booking(5000, 6000, "third"), Booking(2500, 3400, "second"), Booking(1600, 2500, "first")],
+        "2": [Booking(2000, 3000, "other bay")],
+    })
+    # a new booking on one bay only evaluates this bay
+    assert scheduler.replan({"1": [Booking(7000, 8000, "late")], "2": [Booking(2000, 3000, "other bay")]})
+    assert scheduler.update() == {"1": DisplayState.hidden}
+
+    # the planner enforces the current state of the unchanged bays every ENFORCE_INTERVAL
+    planner = Planner(SimulatedClock(0))
+    actions = planner.step({"1": [Booking(1000, 2000, "a")], "2": []})
+    assert [(action.bay, action.state, action.enforce) for action in actions] == [
+        ("1", DisplayState.padlock, False), ("2", DisplayState.padlock, False)]
+    planner.wait()
+    assert planner.clock.now() == ENFORCE_INTERVAL
+    assert all(action.enforce for action in planner.step())
+    planner.wait(650)
+    assert planner.clock.now() == 2 * ENFORCE_INTERVAL
+
+    # operator commands, layered over the calendar
+    clock = SimulatedClock(1500)
+    planner = Planner(clock)
+    planner.step({"1": [Booking(1600, 2500, "booking")], "2": []})
+
+    def command(action: str, bay: Optional[str] = None, minutes: Optional[float] = None) -> tuple[Command, list[Action]]:
+        sent = Command(action, bay, minutes)
+        planner.commands.put(sent)
+        changes: list[Action] = [action for action in planner.step() if not action.enforce]
+        assert sent.done.is_set()
+        return sent, changes
+
+    # a forced lock holds through a calendar refresh until released
+    locked, actions = command(LOCK_COMMAND, "1")
+    assert [(action.bay, action.state) for action in actions] == [("1", DisplayState.padlock)]
+    assert locked.result[0].override == Override(DisplayState.padlock, None)
+    assert not [action for action in planner.step({"1": [Booking(1600, 2600, "longer")], "2": []}) if not action.enforce]
+    assert [action.state for action in command(RELEASE_COMMAND, "1")[1]] == [DisplayState.hidden]
+
+    # an extension continues the session: no end of booking message until its new end, even after a refresh
+    clock.time = 2590
+    extended, actions = command(EXTEND_COMMAND, "1", 5)
+    assert not actions and extended.result[0].session == Session(1600, 2900, 2), extended.result
+    assert extended.result[0].transitions == [(2900, DisplayState.timesUp), (2920, DisplayState.padlock)]
+    planner.step({"1": [Booking(1600, 2600, "longer"), Booking(5000, 5100, "later")], "2": []})
+    clock.time = 2600
+    assert not [action for action in planner.step() if not action.enforce]
+    clock.time = 2900
+    assert [action.state for action in planner.step() if not action.enforce] == [DisplayState.timesUp]
+
+    # right after the end of a booking, an extension unlocks the bay again without the back-to-back message
+    clock.time = 2905
+    assert [action.state for action in command(EXTEND_COMMAND, "1", 2)[1]] == [DisplayState.hidden]
+
+    # a timed unlock ends by itself
+    unlocked, actions = command(UNLOCK_COMMAND, "2", 1)
+    assert [(action.bay, action.state) for action in actions] == [("2", DisplayState.hidden)]
+    assert unlocked.result[0].transitions == [(2965, DisplayState.padlock)]
+    clock.time = 2965
+    assert [(action.bay, action.state) for action in planner.step() if not action.enforce] == [("2", DisplayState.padlock)]
+    assert "2" not in planner.scheduler.overrides
+
+    # the status of every bay, invalid commands
+    assert [status.bay for status in command(STATUS_COMMAND)[0].result] == ["1", "2"]
+    assert command(LOCK_COMMAND, "3")[0].error == "Unknown bay 3"
+    assert command(EXTEND_COMMAND, "1")[0].error is not None and command(LOCK_COMMAND)[0].error is not None
+
+    print("Transition scheduler test finished.")
+    print()
@@ -1,19 +1,36 @@
 """
 This script is a daemon that checks a Google Calendar for active events and
 launches a Chrome browser in kiosk mode if no event is active.
+In multi-bay mode, one daemon drives every bay from its own calendar.
+The configuration file is watched: a valid change is applied without restarting the daemon.
+Run by supervisor.py, the daemon beats at every main loop iteration and is restarted if it hangs.
+The kiosk windows over their resource budget are recycled while their bay is locked on the padlock.
+The operator control API (controlServer.py) forces a lock or an unlock and extends sessions.
+The state changes of the bays are written to the usage journal (usageJournal.py) for the usage reports.
 """
 
+import os
 import sys
 import time
-from typing import Any
-from datetime import datetime, timezone
-from win32 import ensureWindowOnTop
-from config import Config, loadConfig, printConfig
-from googleCalendar import getCalendarService, getEvents
-from chrome import MessageType, createChromeUserProfiles, killChrome, startChrome
+from typing import Optional
+from config import (CONTROL_SUBSYSTEM, DISPLAY_SUBSYSTEM, KIOSK_SUBSYSTEM, LOGS_SUBSYSTEM, METRICS_SUBSYSTEM,
+                    WINDOW_MANAGER_SUBSYSTEM, BayConfig, Config, ConfigWatcher, changedBays, changedSubsystems, loadConfig,
+                    printConfig)
+from calendarFetcher import CalendarFetcher, Schedule
+from snapshot import loadSnapshot
+from scheduler import Action, Booking, DisplayState, Planner, ScheduleIndex, Session
+from chrome import (STATE_MESSAGES, MessageType, animationQuery, bayWindowName, createChromeUserProfiles, killChrome,
+                    killStrayChrome, profileSets, pruneProfileCaches, recycleChrome, setChromeVisible, startChrome)
+from controlServer import ControlServer
+from displayServer import HIDDEN_STATE, DisplayServer
+from metrics import MetricsServer, mainLoopSeconds, transitionSkewSeconds
+from resourceMonitor import RECYCLE_MARGIN, ResourceMonitor
+from supervisor import RESTART_REASON_ENV, heartbeat
+from usageJournal import UsageJournal
+from windowManager import getWindowManager, resetWindowManager, resolveWindowPositions
 
 from logger import Logger
-Logger("SCREEN BLOCKER", True)
+logger = Logger("SCREEN BLOCKER", True)
 
 # Load configuration settings for Google Calendar and Chrome
 try:
@@ -22,124 +39,269 @@ except Exception as e:
     print(f"FATAL ERROR: Error loading configuration settings: {e}")
     sys.exit(1)
 
+logger.jsonLines = cfg.jsonLogs
+# the "auto" and "@n" window positions are read from the displays connected
+resolveWindowPositions(cfg)
 printConfig(cfg)
 
-# Google Calendar API setup using service account authentication
-calendarService: Any = getCalendarService(cfg)
+STATE_LOGS: dict[DisplayState, str] = {
+    DisplayState.hidden: "Event starting within 5 minutes or active. Disabling blocker.",
+    DisplayState.timesUp: "Event finished. Starting blocker.",
+    DisplayState.backToBack: "Back-to-back events detected. Displaying message.",
+    DisplayState.padlock: "No event active. Displaying padlock.",
+}
+
+
+# warm standby: Chrome stays resident on the page served by the display server
+displayServer: Optional[DisplayServer] = None
+metricsServer: Optional[MetricsServer] = None
+controlServer: Optional[ControlServer] = None
+# the state changes of the bays, never purged, for the usage reports
+journal = UsageJournal()
+
+
+def applyState(bay: BayConfig, state: DisplayState) -> None:
+    """
+    Put the screens of the bay in the given state: no blocker, a message or the padlock.
+    Applying the current state again only makes sure it is still enforced.
+    """
+    if displayServer is not None:
+        displayServer.setState(STATE_MESSAGES[state].value if state in STATE_MESSAGES else HIDDEN_STATE, bay.name)
+        startChrome(cfg, bay, msgType=MessageType.boot, url=displayServer.url(bay.name))
+        setChromeVisible(cfg, bay, state != DisplayState.hidden)
+    elif state == DisplayState.hidden:
+        killChrome(cfg, bay)
+    else:
+        startChrome(cfg, bay, msgType=STATE_MESSAGES[state])
+        getWindowManager(cfg).ensureOnTop(bayWindowName(cfg, bay), cfg.verbose)
+
+
+def bayBookings(schedule: Schedule) -> dict[str, tuple[Booking, ...]]:
+    """
+    The bookings of each bay, from the calendar of the bay.
+    """
+    return {bay.name: schedule.calendars.get(bay.calendarId, ()) for bay in cfg.bays}
+
+
+def bayLog(bay: BayConfig) -> str:
+    return f"[{bay.name}] " if len(cfg.bays) > 1 else ""
+
+
+def bookingLog(planner: Planner, bay: str, state: DisplayState) -> str:
+    """
+    The booking a bay is unlocked for, for the logs.
+    """
+    index: Optional[ScheduleIndex] = planner.scheduler.indexes.get(bay)
+    if state != DisplayState.hidden or index is None:
+        return ""
+    booking: Optional[Booking] = index.booking(planner.clock.now())
+    return f" Booking: {booking.summary} ({booking.eventId or 'no ID'})." if booking is not None else ""
+
+
+def journalTransition(planner: Planner, action: Action) -> None:
+    """
+    Write an applied state change to the usage journal: its lateness if it was planned,
+    the session and the booking an unlocked bay is unlocked for.
+    """
+    now: float = planner.clock.now()
+    index: Optional[ScheduleIndex] = planner.scheduler.indexes.get(action.bay)
+    session: Optional[Session] = None
+    if index is not None and action.state == DisplayState.hidden:
+        session = index.unlockedSession(now)
+    journal.transition(now, action.bay, action.state, now - action.deadline if action.deadline is not None else None,
+                       session, index.booking(now) if index is not None and session is not None else None)
+
+
+def recycleIdleBays(planner: Planner, monitor: ResourceMonitor) -> None:
+    """
+    Recycle the kiosk windows of the bays over their resource budget, if locked on the padlock
+    with no transition coming before the new windows are shown.
+    """
+    bays: dict[str, BayConfig] = {bay.name: bay for bay in cfg.bays}
+    for name, reason in monitor.overBudget().items():
+        deadline: Optional[float] = planner.scheduler.nextBayDeadline(name)
+        if name not in bays or planner.scheduler.states.get(name) != DisplayState.padlock:
+            continue
+        if deadline is not None and deadline - planner.clock.now() < RECYCLE_MARGIN:
+            continue
+        print(f"{bayLog(bays[name])}Kiosk windows over their {reason} budget, recycling them.")
+        recycleChrome(cfg, bays[name], reason)
+        monitor.recycled(name)
+
+
+def startControlServer(planner: Planner) -> None:
+    """
+    (Re)start the operator control API if it is enabled.
+    """
+    global controlServer
+
+    if controlServer is not None:
+        controlServer.stop()
+        controlServer = None
+    if not cfg.controlPort:
+        return
+    if not cfg.controlToken:
+        print("Control API disabled: no control_token in the configuration file.")
+        return
+    try:
+        controlServer = ControlServer(cfg.controlPort, cfg.controlToken, planner)
+    except OSError as e:
+        print(f"Error starting the control API on port {cfg.controlPort}: {e}")
+
+
+def reloadConfig(newCfg: Config, fetcher: CalendarFetcher, monitor: ResourceMonitor, planner: Planner) -> None:
+    """
+    Swap a reloaded configuration in and restart only what its changes affect: the kiosk windows
+    of the changed bays (all of them for a Chrome or display change), the display, metrics and control servers,
+    the window manager, and the calendar client or push notifications (by the fetcher thread).
+    The new bays are locked or unlocked by the next planner step.
+    """
+    global cfg, displayServer, metricsServer
+
+    oldCfg: Config = cfg
+    subsystems: set[str] = changedSubsystems(oldCfg, newCfg)
+    relaunched: set[str] = changedBays(oldCfg, newCfg)
+    if subsystems & {KIOSK_SUBSYSTEM, DISPLAY_SUBSYSTEM, WINDOW_MANAGER_SUBSYSTEM}:
+        relaunched |= {bay.name for bay in oldCfg.bays} & {bay.name for bay in newCfg.bays}
+    removed: list[BayConfig] = [bay for bay in oldCfg.bays if bay.name not in {bay.name for bay in newCfg.bays}]
+    print(f"Configuration changed, restarting: {', '.join(sorted(subsystems)) or 'nothing'}"
+          f"{''.join(f', bay {name}' for name in sorted(relaunched))}"
+          f"{''.join(f', bay {bay.name} removed' for bay in removed)}")
+
+    # the windows are closed with the settings they were launched with
+    for bay in removed + [bay for bay in oldCfg.bays if bay.name in relaunched]:
+        killChrome(oldCfg, bay)
+    cfg = newCfg
+    printConfig(cfg)
+
+    if LOGS_SUBSYSTEM in subsystems:
+        logger.jsonLines = cfg.jsonLogs
+    if WINDOW_MANAGER_SUBSYSTEM in subsystems:
+        resetWindowManager()
+    if DISPLAY_SUBSYSTEM in subsystems:
+        if displayServer is not None:
+            displayServer.stop()
+            displayServer = None
+        if cfg.warmStandby:
+            displayServer = DisplayServer(cfg.displayPort, cfg.verbose, animationQuery(cfg))
+    elif displayServer is not None:
+        displayServer.verbose = cfg.verbose
+        displayServer.animation = animationQuery(cfg)
+    if METRICS_SUBSYSTEM in subsystems:
+        if metricsServer is not None:
+            metricsServer.shutdown()
+            metricsServer.server_close()
+            metricsServer = None
+        if cfg.metricsPort:
+            metricsServer = MetricsServer(cfg.metricsPort)
+    if CONTROL_SUBSYSTEM in subsystems:
+        startControlServer(planner)
+    fetcher.reconfigure(cfg, subsystems)
+    monitor.cfg = cfg
+
+    createChromeUserProfiles(cfg)
+    for bay in cfg.bays:
+        if bay.name in relaunched and bay.name in planner.scheduler.states:
+            applyState(bay, planner.scheduler.states[bay.name])
 
 
 def main() -> None:
+    global displayServer, metricsServer
+
+    planner = Planner()
+    bays: dict[str, BayConfig] = {bay.name: bay for bay in cfg.bays}
+    if os.environ.get(RESTART_REASON_ENV):
+        print(f"Restarted by the supervisor: {os.environ[RESTART_REASON_ENV]}")
+    journal.start(planner.clock.now(), os.environ.get(RESTART_REASON_ENV, ""))
 
-    # fresh start
-    killChrome(cfg)
-    createChromeUserProfiles()
-    time.sleep(5)
+    # first decision from the schedule saved on disk, without waiting for Google
+    schedule = Schedule({}, 0, True)
+    snapshot = loadSnapshot()
+    if snapshot is not None:
+        schedule = Schedule({calendarId: tuple(bookings) for calendarId, bookings in snapshot[0].items()}, snapshot[1], True)
+        print(f"Schedule snapshot loaded: {sum(len(bookings) for bookings in schedule.calendars.values())} bookings, "
+              f"fetched {(planner.clock.now() - schedule.fetchedAt) / 60:.0f} minutes ago (stale until the first refresh).")
+    else:
+        print("No schedule snapshot found, locking until the first refresh.")
+
+    # fresh start: the kiosk windows left by a previous run release their profiles before the first launch
+    createChromeUserProfiles(cfg)
+    killStrayChrome(cfg)
+    if cfg.warmStandby:
+        displayServer = DisplayServer(cfg.displayPort, cfg.verbose, animationQuery(cfg))
+
+    # the first decision is applied before anything else is started
+    for action in planner.step(bayBookings(schedule)):
+        print(f"{bayLog(bays[action.bay])}First decision: {STATE_LOGS[action.state]}"
+              f"{bookingLog(planner, action.bay, action.state)}")
+        try:
+            applyState(bays[action.bay], action.state)
+        except Exception as e:
+            print(f"Error applying the first decision: {e}")
+        journalTransition(planner, action)
+    heartbeat()
+    # the spare user-data directories (see recycleChrome) are not in use: their caches are pruned
+    pruneProfileCaches([profile for bayProfiles in profileSets.values() for profile in bayProfiles[1]])
+
+    # the calendar client is imported and built by the fetcher thread, a new schedule wakes the loop up
+    fetcher = CalendarFetcher(cfg, schedule, lambda published: planner.scheduler.wakeUp.set())
+    fetcher.start()
+    monitor = ResourceMonitor(cfg)
+    monitor.start()
+    if cfg.metricsPort:
+        metricsServer = MetricsServer(cfg.metricsPort)
+    startControlServer(planner)
+    configWatcher = ConfigWatcher(cfg, resolve=resolveWindowPositions)
 
-    eventLogged = False
     while True:
 
         if (cfg.verbose):
             print("Main loop iteration.")
 
+        iterationStart: float = time.monotonic()
         try:
-            now = datetime.now(timezone.utc)  # events are in UTC
-            currentEvent, nextEvent = getEvents(cfg, calendarService)
-
-            if (cfg.verbose):
-                if (currentEvent is not None):
-                    print(f"Current event: {currentEvent['summary']}")
-                else:
-                    print("No current event")
-                if (nextEvent is not None):
-                    print(f"Next event: {nextEvent['summary']}")
-                else:
-                    print(f"Next event: {nextEvent}")
-
-            if currentEvent is not None:
-
-                if (cfg.verbose):
-                    print("Current event exists")
-
-                boot = False
-                if not eventLogged:
-                    print(f"Event active now: {currentEvent['summary']}")
-                    eventLogged = True
-
-                # make sure Chrome is not running during an event
-                killChrome(cfg)
-
-                currentEnd = datetime.fromisoformat(
-                    currentEvent["end"].get("dateTime", currentEvent["end"].get("date"))
-                )
-
-                # if current event ends within the next 20 seconds
-                secondToEnd = (currentEnd - now).total_seconds()
-
-                if (cfg.verbose):
-                    hours = int(secondToEnd // 3600)
-                    minutes = int(secondToEnd // 60)
-                    seconds = int(secondToEnd % 60)
-                    print(f"current event ends in {hours:02d}:{minutes:02d}:{seconds:02d}")
-
-                if secondToEnd <= 30:
-                    if (cfg.verbose):
-                        print("Event ending soon")
-
-                    eventLogged = False
-                    # check for back-to-back events
-                    if nextEvent is not None:
-                        time.sleep(secondToEnd)
-                        print("Back-to-back events detected. Displaying message.")
-                        startChrome(cfg, msgType=MessageType.backToback)
-                        time.sleep(20)  # display message for 20 seconds
-                        killChrome(cfg)
-                    # default message
-                    else:
-                        time.sleep(secondToEnd)
-                        print("Event finished. Starting blocker.")
-                        startChrome(cfg, msgType=MessageType.timesUp)
-            else:
-                if (cfg.verbose):
-                    print("No current event")
-
-                # If a future event is within 5 minutes, remove the blocker.
-                if nextEvent is not None:
-                    nextStart = datetime.fromisoformat(nextEvent["start"].get(
-                        "dateTime", nextEvent["start"].get("date"))
-                    )
-                    secondsToNext = (nextStart - now).total_seconds()
-
-                    if (cfg.verbose):
-                        hours = int(secondsToNext // 3600)
-                        minutes = int(secondsToNext // 60)
-                        seconds = int(secondsToNext % 60)
-                        print(f"Next event Starting in {hours:02d}:{minutes:02d}:{seconds:02d}")
-
-                    if secondsToNext <= 5 * 60:
-                        print(f"Next event within 5 minutes. Disabling blocker.  {nextEvent['summary']}")
-                        killChrome(cfg)
-                        # Wait to make sure the event will be active
-                        time.sleep(secondsToNext + 10)
-                        continue
-                    else:
-
-                        if (cfg.verbose):
-                            print("No event active, next event is not within 5 minutes")
-
-                        # If no event is active, make sure Chrome is running.
-                        startChrome(cfg, msgType=MessageType.boot)
-                else:
-                    if (cfg.verbose):
-                        print("No event active, no next event")
-
-                    # If no event is active, make sure Chrome is running.
-                    startChrome(cfg, msgType=MessageType.boot)
+            # a changed configuration file (one stat per iteration) replans every bay
+            reloadedCfg: Optional[Config] = configWatcher.poll()
+            if reloadedCfg is not None:
+                reloadConfig(reloadedCfg, fetcher, monitor, planner)
+                bays = {bay.name: bay for bay in cfg.bays}
+
+            # plan the transitions from the latest published schedule
+            newSchedule: Optional[dict[str, tuple[Booking, ...]]] = None
+            if fetcher.schedule is not schedule or reloadedCfg is not None:
+                schedule = fetcher.schedule
+                newSchedule = bayBookings(schedule)
+                journal.calendar(planner.clock.now(), schedule.stale)
+            actions: list[Action] = planner.step(newSchedule)
+            if newSchedule is not None and (cfg.verbose):
+                print(f"Schedule refreshed, {len(planner.scheduler.deadlines)} transitions planned.")
+
+            staleLog: str = " (stale schedule)" if schedule.stale else ""
+            for action in actions:
+                bay: BayConfig = bays[action.bay]
+                if action.deadline is not None:
+                    skew: float = planner.clock.now() - action.deadline
+                    print(f"{bayLog(bay)}{STATE_LOGS[action.state]} (skew: {skew * 1000:.0f} ms){staleLog}"
+                          f"{bookingLog(planner, action.bay, action.state)}")
+                elif not action.enforce:
+                    print(f"{bayLog(bay)}{STATE_LOGS[action.state]}{staleLog}"
+                          f"{bookingLog(planner, action.bay, action.state)}")
+                applyState(bay, action.state)
+                if action.deadline is not None:
+                    # measured once applied: includes the Chrome launch
+                    transitionSkewSeconds.observe(planner.clock.now() - action.deadline,
+                                                  transition="unlock" if action.state == DisplayState.hidden else "lock")
+                if not action.enforce:
+                    journalTransition(planner, action)
+            recycleIdleBays(planner, monitor)
 
         except Exception as e:
             print(f"Error in main loop: {e}")
         finally:
-            ensureWindowOnTop("Chrome", cfg.verbose)
-            time.sleep(20)
+            mainLoopSeconds.observe(time.monotonic() - iterationStart)
+            heartbeat()
+            # sleep until the next transition, a new schedule or the next enforcement check
+            planner.wait()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+"""
+This module keeps a compact copy of the upcoming bookings on disk, so the daemon
+can take its first decision at boot and keep enforcing the schedule during a
+network outage without waiting for the Google Calendar API.
+The file is written atomically: a crash while writing never leaves it truncated.
+location: "../screenBlockerSchedule.json"
+"""
+
+import os
+import json
+import time
+from typing import Optional, Tuple
+from scheduler import Booking
+
+SNAPSHOT_FILE_NAME = "screenBlockerSchedule.json"
+SNAPSHOT_VERSION = 2
+
+
+def snapshotPath() -> str:
+    return os.path.join(os.path.dirname(__file__), "..", SNAPSHOT_FILE_NAME)
+
+
+def saveSnapshot(calendars: dict[str, list[Booking]], fetchedAt: float, hours: float, path: Optional[str] = None) -> None:
+    """
+    Write the bookings of each calendar not ended yet and starting within the next hours to the snapshot file.
+    """
+    path = path if path is not None else snapshotPath()
+    now: float = time.time()
+    data = {
+        "version": SNAPSHOT_VERSION,
+        "fetchedAt": fetchedAt,
+        "calendars": {
+            calendarId: [
+                [booking.start, booking.end, booking.summary, booking.eventId]
+                for booking in bookings
+                if booking.end > now and booking.start < now + hours * 3600
+            ]
+            for calendarId, bookings in calendars.items()
+        },
+    }
+
+    temporaryPath: str = path + ".tmp"
+    with open(temporaryPath, "w", encoding="utf-8") as file:
+        json.dump(data, file, separators=(",", ":"))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporaryPath, path)
+
+
+def loadSnapshot(path: Optional[str] = None) -> Optional[Tuple[dict[str, list[Booking]], float]]:
+    """
+    Returns the bookings of each calendar of the snapshot file and the time they were fetched at,
+    or None if there is no usable snapshot.
+    """
+    path = path if path is not None else snapshotPath()
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        if data.get("version") != SNAPSHOT_VERSION:
+            return None
+        calendars: dict[str, list[Booking]] = {
+            # the rows written before the event IDs were kept have no fourth column
+            calendarId: [Booking(float(row[0]), float(row[1]), str(row[2]), str(row[3]) if len(row) > 3 else "")
+                         for row in bookings]
+            for calendarId, bookings in data["calendars"].items()
+        }
+        return calendars, float(data["fetchedAt"])
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Error loading schedule snapshot: {e}")
+        return None
+
+
+# test module
+if __name__ == "__main__":
+    import tempfile
+
+    now = time.time()
+    bookings = [
+        Booking(now - 7200, now - 3600, "ended"),
+        Booking(now - 600, now + 300, "current", "event1"),
+        Booking(now + 600, now + 1500, "next"),
+        Booking(now + 20 * 3600, now + 21 * 3600, "tomorrow"),
+    ]
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, SNAPSHOT_FILE_NAME)
+        assert loadSnapshot(path) is None
+
+        saveSnapshot({"bay1": bookings, "bay2": []}, now, 12, path)
+        snapshot = loadSnapshot(path)
+        assert snapshot is not None
+        assert [booking.summary for booking in snapshot[0]["bay1"]] == ["current", "next"]
+        assert snapshot[0]["bay1"][0] == bookings[1]
+        assert snapshot[0]["bay2"] == []
+        assert snapshot[1] == now
+        assert not os.path.exists(path + ".tmp")
+
+        start = time.perf_counter()
+        loadSnapshot(path)
+        print(f"Snapshot loaded in {(time.perf_counter() - start) * 1000:.2f} ms")
+
+        # a snapshot without the event IDs is still loaded
+        with open(path, "w") as file:
+            json.dump({"version": SNAPSHOT_VERSION, "fetchedAt": now,
+                       "calendars": {"bay1": [[now, now + 900, "old"]]}}, file)
+        snapshot = loadSnapshot(path)
+        assert snapshot is not None and snapshot[0]["bay1"] == [Booking(now, now + 900, "old")]
+
+        # a corrupted file is ignored
+        with open(path, "w") as file:
+            file.write("{")
+        assert loadSnapshot(path) is None
+
+    print("Schedule snapshot test finished.")
+    print()
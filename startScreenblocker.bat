@@ -6,5 +6,5 @@
 python -m venv venv
 venv\Scripts\activate
 
-@REM start the screen blocker
-python screenblocker.py
+@REM start the screen blocker, restarted by the supervisor if it exits or hangs
+python supervisor.py
@@ -0,0 +1,289 @@
+"""
+This module supervises the daemon: it runs screenBlocker.py as a child process and
+restarts it when it exits or stops beating. The daemon touches a heartbeat file at
+every main loop iteration (at least every ENFORCE_INTERVAL): a daemon hung in a call
+its main loop cannot time out (a Google request, a process scan, a win32 call) stops
+touching it and is killed HEARTBEAT_TIMEOUT seconds after its last beat.
+While the daemon restarts, the bays are locked from the saved schedule (a bay in a
+booking is left unlocked) and the kiosk windows are left to the new daemon, which
+takes them over at boot.
+usage: python supervisor.py (python supervisor.py test to run the tests)
+"""
+
+import os
+import sys
+import time
+import subprocess
+from typing import Callable, Optional
+from config import Config, loadConfig
+from chrome import STATE_MESSAGES, bayController, bayWindowName, createChromeUserProfiles, killStrayChrome, startChrome
+from scheduler import ENFORCE_INTERVAL, DisplayState, desiredState
+from snapshot import loadSnapshot
+from windowManager import WindowManager, getWindowManager, resolveWindowPositions
+
+# environment variables of the daemon: path of its heartbeat file, reason of its restart
+HEARTBEAT_ENV = "SCREEN_BLOCKER_HEARTBEAT"
+RESTART_REASON_ENV = "SCREEN_BLOCKER_RESTART_REASON"
+HEARTBEAT_FILE_NAME = "screenBlockerHeartbeat"
+# a daemon which did not beat for this many seconds is hung (it beats at least every ENFORCE_INTERVAL)
+HEARTBEAT_TIMEOUT = 2 * ENFORCE_INTERVAL + 5
+# seconds allowed from the daemon start to its first beat (imports, first decision)
+START_TIMEOUT = 60
+# seconds between two checks of the daemon
+CHECK_INTERVAL = 1
+# seconds a terminated daemon has to exit before it is killed
+STOP_TIMEOUT = 3
+# seconds the safe state waits for its windows to be shown before bringing them on top anyway
+SAFE_STATE_TIMEOUT = 5
+# delay before a restart, doubling while the daemon fails within MIN_RUN seconds of its start
+RESTART_DELAY = 1
+MAX_RESTART_DELAY = 60
+MIN_RUN = 60
+
+
+def heartbeatPath() -> str:
+    return os.path.join(os.path.dirname(__file__), "..", HEARTBEAT_FILE_NAME)
+
+
+def heartbeat() -> None:
+    """
+    Tell the supervisor the daemon is alive. Nothing is written when the daemon runs unsupervised.
+    """
+    path: Optional[str] = os.environ.get(HEARTBEAT_ENV)
+    if not path:
+        return
+    try:
+        with open(path, "a"):
+            os.utime(path)
+    except OSError as e:
+        print(f"Error writing the heartbeat: {e}")
+
+
+def applySafeState(cfg: Config) -> None:
+    """
+    Lock the bays while the daemon restarts, from the schedule saved on disk: the padlock or the end of
+    booking message, unlocked during a booking. The windows are launched without being watched:
+    the next daemon kills them at boot, right before its first decision.
+    """
+    snapshot = loadSnapshot()
+    calendars = snapshot[0] if snapshot is not None else {}
+    resolveWindowPositions(cfg)
+    createChromeUserProfiles(cfg)
+    # the windows of the stopped daemon are in an unknown state
+    killStrayChrome(cfg)
+
+    now: float = time.time()
+    locked = []
+    for bay in cfg.bays:
+        state: DisplayState = desiredState(calendars.get(bay.calendarId, []), now)
+        print(f"[{bay.name}] Safe state while the daemon restarts: {state.value}")
+        if state != DisplayState.hidden:
+            startChrome(cfg, bay, msgType=STATE_MESSAGES[state])
+            locked.append(bay)
+
+    windowManager: WindowManager = getWindowManager(cfg)
+    deadline: float = time.monotonic() + SAFE_STATE_TIMEOUT
+    for bay in locked:
+        windowManager.waitForWindows(bayWindowName(cfg, bay), len(bay.windowPositions), max(deadline - time.monotonic(), 0))
+        windowManager.ensureOnTop(bayWindowName(cfg, bay), cfg.verbose)
+        bayController(bay).release()
+
+
+class Supervisor:
+    """
+    Runs the daemon command and restarts it when it exits or its heartbeat file stops changing.
+    The heartbeat is timed on the monotonic clock of the supervisor: a clock change is not a stall.
+    """
+
+    def __init__(self, command: list[str], heartbeatFile: str, safeState: Callable[[], None],
+                 heartbeatTimeout: float = HEARTBEAT_TIMEOUT, startTimeout: float = START_TIMEOUT):
+        self.command: list[str] = command
+        self.heartbeatFile: str = heartbeatFile
+        self.safeState: Callable[[], None] = safeState
+        self.heartbeatTimeout: float = heartbeatTimeout
+        self.startTimeout: float = startTimeout
+        self.daemon: Optional[subprocess.Popen] = None
+        self.started: float = 0
+        # monotonic time the heartbeat file last changed, None before the first beat
+        self.lastBeat: Optional[float] = None
+        self.signature: Optional[int] = None
+        self.restarts: int = 0
+        self.restartDelay: float = RESTART_DELAY
+        self.running: bool = True
+
+    def start(self, reason: str = "") -> None:
+        try:
+            os.remove(self.heartbeatFile)
+        except FileNotFoundError:
+            pass
+        env: dict[str, str] = dict(os.environ)
+        env[HEARTBEAT_ENV] = os.path.realpath(self.heartbeatFile)
+        if reason:
+            env[RESTART_REASON_ENV] = reason
+        self.daemon = subprocess.Popen(self.command, env=env)
+        self.started = time.monotonic()
+        self.lastBeat = None
+        self.signature = None
+
+    def beatSignature(self) -> Optional[int]:
+        try:
+            return os.stat(self.heartbeatFile).st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self) -> Optional[str]:
+        """
+        The reason to restart the daemon, None if it is running and beating.
+        """
+        assert self.daemon is not None
+        now: float = time.monotonic()
+        code: Optional[int] = self.daemon.poll()
+        if code is not None:
+            return f"daemon exited (code {code})"
+        signature: Optional[int] = self.beatSignature()
+        if signature is not None and signature != self.signature:
+            self.signature = signature
+            self.lastBeat = now
+        if self.lastBeat is None:
+            if now - self.started > self.startTimeout:
+                return f"no heartbeat {self.startTimeout:g} s after the start"
+        elif now - self.lastBeat > self.heartbeatTimeout:
+            return f"heartbeat stalled for {now - self.lastBeat:.0f} s"
+        return None
+
+    def stopDaemon(self) -> None:
+        if self.daemon is None or self.daemon.poll() is not None:
+            return
+        self.daemon.terminate()
+        try:
+            self.daemon.wait(STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.daemon.kill()
+            self.daemon.wait()
+
+    def restart(self, reason: str) -> None:
+        print(f"Restarting the daemon: {reason}")
+        self.stopDaemon()
+        self.restarts += 1
+        try:
+            self.safeState()
+        except Exception as e:
+            print(f"Error applying the safe state: {e}")
+        # a daemon failing right after its start is restarted less and less often
+        if time.monotonic() - self.started < MIN_RUN:
+            time.sleep(self.restartDelay)
+            self.restartDelay = min(self.restartDelay * 2, MAX_RESTART_DELAY)
+        else:
+            self.restartDelay = RESTART_DELAY
+        self.start(reason)
+
+    def run(self, checkInterval: float = CHECK_INTERVAL) -> None:
+        self.start()
+        try:
+            while self.running:
+                time.sleep(checkInterval)
+                reason: Optional[str] = self.check()
+                if reason is not None:
+                    self.restart(reason)
+        finally:
+            self.stopDaemon()
+
+
+def supervise() -> None:
+    script: str = os.path.join(os.path.dirname(os.path.realpath(__file__)), "screenBlocker.py")
+    # the configuration is loaded at each restart: the safe state follows the configuration changes
+    supervisor = Supervisor([sys.executable, script], heartbeatPath(), lambda: applySafeState(loadConfig()))
+    print(f"Supervising the daemon: restarted {supervisor.heartbeatTimeout:g} s after its last heartbeat.")
+    supervisor.run()
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        import shutil
+        import tempfile
+        import threading
+
+        directory: str = tempfile.mkdtemp()
+        testHeartbeat: str = os.path.join(directory, "heartbeat")
+        repository: str = os.path.dirname(os.path.realpath(__file__))
+
+        def child(beats: Optional[int], then: str = "time.sleep(3600)") -> list[str]:
+            """
+            A daemon beating every 0.1 s (beats times, or forever if None), then hanging or exiting.
+            """
+            loop: str = f"range({beats})" if beats is not None else "iter(int, 1)"
+            script: str = (f"import sys, time; sys.path.insert(0, {repository!r}); from supervisor import heartbeat\n"
+                           f"for _ in {loop}:\n    heartbeat(); time.sleep(0.1)\n{then}")
+            return [sys.executable, "-c", script]
+
+        safeStates: list[float] = []
+
+        def waitReason(supervisor: Supervisor, timeout: float) -> str:
+            deadline: float = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                reason: Optional[str] = supervisor.check()
+                if reason is not None:
+                    return reason
+                time.sleep(0.05)
+            raise AssertionError("daemon not restarted")
+
+        # not supervised: no heartbeat file
+        os.environ.pop(HEARTBEAT_ENV, None)
+        heartbeat()
+
+        # a daemon hanging after a few beats is restarted HEARTBEAT_TIMEOUT after its last beat, the safe state applied
+        supervisor = Supervisor(child(5), testHeartbeat, lambda: safeStates.append(time.monotonic()), 0.5, 3)
+        supervisor.start()
+        hung = supervisor.daemon
+        assert hung is not None
+        reason = waitReason(supervisor, 5)
+        assert reason.startswith("heartbeat stalled") and supervisor.lastBeat is not None
+        assert 0.5 < time.monotonic() - supervisor.lastBeat < 1, reason
+        supervisor.restart(reason)
+        assert hung.poll() is not None and len(safeStates) == 1 and supervisor.daemon is not hung
+        # the restarted daemon beats again
+        while supervisor.lastBeat is None:
+            assert supervisor.check() is None
+            time.sleep(0.05)
+        supervisor.stopDaemon()
+
+        # a daemon hanging before its first beat, or exiting
+        supervisor = Supervisor(child(0), testHeartbeat, lambda: None, 0.5, 1)
+        supervisor.start()
+        assert waitReason(supervisor, 3) == "no heartbeat 1 s after the start"
+        supervisor.stopDaemon()
+        supervisor = Supervisor(child(2, "sys.exit(3)"), testHeartbeat, lambda: None, 0.5, 1)
+        supervisor.start()
+        assert waitReason(supervisor, 3) == "daemon exited (code 3)"
+
+        # a daemon beating is left alone
+        supervisor = Supervisor(child(None), testHeartbeat, lambda: None, 0.5, 3)
+        supervisor.start()
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            assert supervisor.check() is None
+            time.sleep(0.05)
+        supervisor.stopDaemon()
+
+        # the supervisor loop: a hanging daemon restarted over and over, each time within the bound
+        safeStates.clear()
+        supervisor = Supervisor(child(3), testHeartbeat, lambda: safeStates.append(time.monotonic()), 0.5, 3)
+        loop = threading.Thread(target=supervisor.run, args=(0.05,))
+        started = time.monotonic()
+        loop.start()
+        while supervisor.restarts < 2:
+            assert time.monotonic() - started < 10
+            time.sleep(0.05)
+        supervisor.running = False
+        loop.join()
+        assert supervisor.daemon is not None and supervisor.daemon.poll() is not None
+        # 0.3 s of beats, 0.5 s of stall, a check: safe state within a second of each start
+        assert safeStates[0] - started < 1.5, safeStates
+
+        shutil.rmtree(directory)
+        print("Supervisor test finished.")
+        print()
+        sys.exit(0)
+
+    supervise()
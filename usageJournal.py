@@ -0,0 +1,436 @@
+"""
+This module keeps the usage journal of the bays: one compact JSON line per state change of a bay
+(unlocked for a session, end of booking or back-to-back message, padlock) with its lateness, per
+daemon start and per calendar outage. Unlike the logs, the journal is never purged: one file per month.
+The report streams over the journal files one line at a time, in constant memory whatever the number
+of months, and gives for each bay the booked, unlocked and idle time, the utilization and the lateness
+of the transitions.
+location: "../screenBlockerJournal/YYYY-MM.jsonl"
+usage: python usageJournal.py [from] [to]  (dates YYYY-MM-DD, to excluded, default: the last 30 days)
+       (python usageJournal.py test to run the tests, python usageJournal.py benchmark)
+"""
+
+import os
+import sys
+import json
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Iterator, Optional
+from replay import Day, replay
+from scheduler import Booking, DisplayState, ScheduleIndex, Session
+
+JOURNAL_FOLDER_NAME = "screenBlockerJournal"
+# record events: the daemon started, a bay changed state, the calendar became unreachable, then reachable again
+START_EVENT = "start"
+STATE_EVENT = "state"
+OUTAGE_EVENT = "outage"
+ONLINE_EVENT = "online"
+# upper bounds (seconds) of the lateness buckets of the report, as the transition skew metric
+LATENESS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+# days reported when no date is given
+DEFAULT_REPORT_DAYS = 30
+
+
+def journalFolder() -> str:
+    return os.path.join(os.path.dirname(__file__), "..", JOURNAL_FOLDER_NAME)
+
+
+def monthPath(folder: str, month: date) -> str:
+    return os.path.join(folder, month.strftime("%Y-%m") + ".jsonl")
+
+
+def nextMonth(month: date) -> date:
+    return (month.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+class UsageJournal:
+    """
+    Appends the records to the journal file of their month. Each record is written and closed at once:
+    there are a few per hour and the daemon may be killed at any time.
+    """
+
+    def __init__(self, folder: Optional[str] = None):
+        self.folder: str = folder if folder is not None else journalFolder()
+        # True while the last published schedule is stale (calendar outage)
+        self.stale: bool = False
+
+    def write(self, record: dict[str, Any]) -> None:
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            path: str = monthPath(self.folder, datetime.fromtimestamp(record["time"]).date())
+            line: bytes = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+            with open(path, "a+b") as file:
+                # a line cut by a power failure is ended first: the next record stays readable
+                if file.tell() > 0:
+                    file.seek(-1, os.SEEK_END)
+                    if file.read(1) != b"\n":
+                        line = b"\n" + line
+                file.write(line)
+        except OSError as e:
+            print(f"Error writing the usage journal: {e}")
+
+    def start(self, now: float, reason: str = "") -> None:
+        """
+        The daemon started, restarted by the supervisor for the given reason if any.
+        """
+        record: dict[str, Any] = {"time": round(now, 3), "event": START_EVENT}
+        if reason:
+            record["reason"] = reason
+        self.write(record)
+
+    def transition(self, now: float, bay: str, state: DisplayState, late: Optional[float] = None,
+                   session: Optional[Session] = None, booking: Optional[Booking] = None) -> None:
+        """
+        A bay changed state. late: seconds since the deadline of the transition, None for a change which was
+        not planned (first decision, new schedule, operator command). session and booking: what the bay is
+        unlocked for, None for a forced unlock.
+        """
+        record: dict[str, Any] = {"time": round(now, 3), "event": STATE_EVENT, "bay": bay, "state": state.value}
+        if late is not None:
+            record["late"] = round(late, 3)
+        if session is not None:
+            record["session"] = [round(session.start, 3), round(session.end, 3)]
+        if booking is not None and booking.eventId:
+            record["booking"] = booking.eventId
+        self.write(record)
+
+    def calendar(self, now: float, stale: bool) -> None:
+        """
+        A schedule was published: an outage starts when it turns stale and ends when it is fresh again.
+        """
+        if stale != self.stale:
+            self.stale = stale
+            self.write({"time": round(now, 3), "event": OUTAGE_EVENT if stale else ONLINE_EVENT})
+
+
+class BayUsage:
+    """
+    Running totals of a bay over the report period, and its state at the last record read.
+    """
+
+    def __init__(self):
+        self.state: Optional[str] = None
+        self.since: float = 0
+        # start of the session the bay is unlocked for, None for a forced unlock
+        self.sessionStart: Optional[float] = None
+        self.lastSessionStart: Optional[float] = None
+        self.seconds: dict[str, float] = {state.value: 0.0 for state in DisplayState}
+        self.booked: float = 0
+        self.sessions: int = 0
+        self.backToBack: int = 0
+        self.longestIdle: float = 0
+        # lateness of the planned transitions: observations per bucket (not cumulative), sum and maximum
+        self.lateCounts: list[int] = [0] * (len(LATENESS_BUCKETS) + 1)
+        self.lateTotal: float = 0
+        self.lateMax: float = 0
+
+    def observed(self) -> float:
+        return sum(self.seconds.values())
+
+    def latePercentile(self, fraction: float) -> float:
+        """
+        Upper bound of the bucket holding the given fraction of the transitions.
+        """
+        target: float = fraction * sum(self.lateCounts)
+        cumulative: int = 0
+        for bound, count in zip(LATENESS_BUCKETS + (float("inf"),), self.lateCounts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return 0
+
+
+class UsageReport:
+    """
+    Usage of the bays between start and end (epoch seconds), fed with the records in the order they were written.
+    A bay keeps its state until its next record. A daemon start ends the states: the first decision follows.
+    """
+
+    def __init__(self, start: float, end: float):
+        self.start: float = start
+        self.end: float = end
+        self.bays: dict[str, BayUsage] = {}
+        self.records: int = 0
+        self.skipped: int = 0
+        self.starts: int = 0
+        self.restarts: int = 0
+        self.outages: int = 0
+        self.outageSeconds: float = 0
+        self.longestOutage: float = 0
+        self.outageSince: Optional[float] = None
+
+    def clip(self, since: float, until: float) -> float:
+        return max(min(until, self.end) - max(since, self.start), 0)
+
+    def closeState(self, bay: BayUsage, until: float) -> None:
+        if bay.state is None:
+            return
+        seconds: float = self.clip(bay.since, until)
+        bay.seconds[bay.state] += seconds
+        if bay.state == DisplayState.hidden.value and bay.sessionStart is not None:
+            bay.booked += self.clip(max(bay.since, bay.sessionStart), until)
+        elif bay.state == DisplayState.padlock.value:
+            bay.longestIdle = max(bay.longestIdle, seconds)
+
+    def closeOutage(self, until: float) -> None:
+        if self.outageSince is None:
+            return
+        if self.outageSince < self.end and until > self.start:
+            seconds: float = self.clip(self.outageSince, until)
+            self.outages += 1
+            self.outageSeconds += seconds
+            self.longestOutage = max(self.longestOutage, seconds)
+        self.outageSince = None
+
+    def add(self, record: dict[str, Any]) -> None:
+        now: float = record["time"]
+        event: Any = record.get("event")
+        inPeriod: bool = self.start <= now < self.end
+        if event == START_EVENT:
+            for bay in self.bays.values():
+                self.closeState(bay, now)
+                bay.state = None
+            self.closeOutage(now)
+            if inPeriod:
+                self.starts += 1
+                self.restarts += 1 if record.get("reason") else 0
+        elif event == STATE_EVENT:
+            bay: BayUsage = self.bays.setdefault(record["bay"], BayUsage())
+            state: str = record["state"]
+            if state not in bay.seconds:
+                raise ValueError(f"unknown state {state}")
+            self.closeState(bay, now)
+            session: Optional[list[float]] = record.get("session")
+            bay.state, bay.since = state, now
+            bay.sessionStart = session[0] if session else None
+            if state == DisplayState.hidden.value and session and session[0] != bay.lastSessionStart:
+                bay.lastSessionStart = session[0]
+                bay.sessions += 1 if inPeriod else 0
+            if not inPeriod:
+                return
+            if state == DisplayState.backToBack.value:
+                bay.backToBack += 1
+            late: Optional[float] = record.get("late")
+            if late is not None:
+                bay.lateCounts[sum(1 for bound in LATENESS_BUCKETS if late > bound)] += 1
+                bay.lateTotal += late
+                bay.lateMax = max(bay.lateMax, late)
+        elif event == OUTAGE_EVENT:
+            if self.outageSince is None:
+                self.outageSince = now
+        elif event == ONLINE_EVENT:
+            self.closeOutage(now)
+
+    def finish(self, until: float) -> None:
+        """
+        End the states and the outage in progress at the given time (now or the end of the period).
+        """
+        for bay in self.bays.values():
+            self.closeState(bay, until)
+        self.closeOutage(until)
+
+
+def journalLines(start: float, end: float, folder: str) -> Iterator[str]:
+    """
+    The lines of the journal files from the month before start (for the states at start) to the month of end.
+    """
+    month: date = (datetime.fromtimestamp(start).date().replace(day=1) - timedelta(days=1)).replace(day=1)
+    last: date = datetime.fromtimestamp(end).date().replace(day=1)
+    while month <= last:
+        path: str = monthPath(folder, month)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as file:
+                yield from file
+        month = nextMonth(month)
+
+
+def usageReport(start: float, end: float, folder: Optional[str] = None, now: Optional[float] = None) -> UsageReport:
+    """
+    Stream the journal into the report of the period. Lines which do not parse (e.g. cut by a power failure) are skipped.
+    """
+    folder = folder if folder is not None else journalFolder()
+    report = UsageReport(start, end)
+    for line in journalLines(start, end, folder):
+        try:
+            record: dict[str, Any] = json.loads(line)
+            if record["time"] >= end:
+                break
+            report.add(record)
+            report.records += 1
+        except (ValueError, KeyError, TypeError, IndexError):
+            report.skipped += 1
+    report.finish(min(end, now if now is not None else time.time()))
+    return report
+
+
+def hours(seconds: float) -> str:
+    minutes: int = round(seconds / 60)
+    return f"{minutes // 60}h{minutes % 60:02d}"
+
+
+def printReport(report: UsageReport) -> None:
+    def day(epoch: float) -> str:
+        return datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M")
+
+    print(f"Usage from {day(report.start)} to {day(report.end)}: {report.records} records"
+          f"{f' ({report.skipped} unreadable lines skipped)' if report.skipped else ''}")
+    for name in sorted(report.bays):
+        bay: BayUsage = report.bays[name]
+        observed: float = bay.observed()
+        if observed == 0:
+            continue
+        messages: float = bay.seconds[DisplayState.timesUp.value] + bay.seconds[DisplayState.backToBack.value]
+        print(f"Bay {name}: booked {hours(bay.booked)} ({bay.booked / observed:.1%} of {hours(observed)} observed), "
+              f"unlocked {hours(bay.seconds[DisplayState.hidden.value])}, "
+              f"idle on the padlock {hours(bay.seconds[DisplayState.padlock.value])} "
+              f"(longest {hours(bay.longestIdle)}), messages {hours(messages)} | "
+              f"{bay.sessions} sessions, {bay.backToBack} back-to-back")
+        transitions: int = sum(bay.lateCounts)
+        if transitions:
+            print(f"    lateness of {transitions} transitions: mean {bay.lateTotal / transitions * 1000:.0f} ms, "
+                  f"95% within {bay.latePercentile(0.95):g} s, max {bay.lateMax * 1000:.0f} ms")
+    print(f"Daemon: {report.starts} starts ({report.restarts} restarts by the supervisor), "
+          f"{report.outages} calendar outages for {hours(report.outageSeconds)} (longest {hours(report.longestOutage)})")
+
+
+def replayJournal(journal: UsageJournal, day: Day, late: float = 0) -> int:
+    """
+    Write the transitions of a replayed day (see replay.py) to the journal, the planned ones late by the given
+    seconds, with the sessions of the bookings of the day. Returns the number of transitions.
+    """
+    indexes: dict[str, ScheduleIndex] = {bay: ScheduleIndex(bookings) for bay, bookings in day.bookings.items()}
+    timeline = replay(day, None).timeline
+    for action in timeline:
+        session: Optional[Session] = None
+        if action.state == DisplayState.hidden:
+            session = indexes[action.bay].unlockedSession(action.time)
+        planned: bool = action.deadline is not None
+        journal.transition(action.time + (late if planned else 0), action.bay, action.state, late if planned else None,
+                           session)
+    return len(timeline)
+
+
+def benchmark() -> None:
+    """
+    Cost of a journal record in the daemon, then report over 1, 3 and 12 months of 6 busy bays:
+    the time grows with the months, the memory does not.
+    """
+    import shutil
+    import tempfile
+    import tracemalloc
+    from replay import syntheticDay
+
+    folder: str = tempfile.mkdtemp()
+    try:
+        journal = UsageJournal(folder)
+        first: datetime = datetime(2025, 1, 1, 8, 0)
+        records: int = 0
+        written: float = 0
+        for index in range(365):
+            day = syntheticDay(6, 12, seed=index % 7, start=(first + timedelta(days=index)).timestamp())
+            day = day._replace(changes=[])
+            started: float = time.perf_counter()
+            if index % 30 == 0:
+                journal.start(day.start - 60)
+            records += replayJournal(journal, day, late=0.05 * (index % 5))
+            written += time.perf_counter() - started
+        size: int = sum(os.path.getsize(os.path.join(folder, name)) for name in os.listdir(folder))
+        print(f"Journal: {records} transitions in 12 months, {size / records:.0f} bytes and "
+              f"{written / records * 1e6:.0f} us (replay included) per transition, {size / 2**20:.1f} MB")
+
+        for months in (1, 3, 12):
+            start: float = first.timestamp()
+            end: float = datetime(2025 + months // 12, months % 12 + 1, 1).timestamp()
+            started = time.perf_counter()
+            report: UsageReport = usageReport(start, end, folder)
+            elapsed: float = time.perf_counter() - started
+            tracemalloc.start()
+            usageReport(start, end, folder)
+            streamed: int = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            # the records loaded all at once, as a report over a list would
+            tracemalloc.start()
+            loaded: list[dict[str, Any]] = [json.loads(line) for line in journalLines(start, end, folder)]
+            listed: int = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            del loaded
+            print(f"Report over {months:2d} months: {report.records:6d} records in {elapsed * 1000:5.0f} ms "
+                  f"({report.records / elapsed:6.0f} records/s), peak memory {streamed / 1024:4.0f} kB streamed, "
+                  f"{listed / 2**20:5.1f} MB loaded in a list")
+    finally:
+        shutil.rmtree(folder)
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "test":
+        import shutil
+        import tempfile
+        folder: str = tempfile.mkdtemp()
+        try:
+            journal = UsageJournal(folder)
+            start: float = datetime(2026, 1, 31, 8, 0).timestamp()
+            hour: float = 3600
+            # back-to-back at 10:00, a session over midnight (and over the end of the month) on bay 1, one booking on bay 2
+            day = Day(start, start + 30 * hour, {
+                "1": [Booking(start + hour, start + 2 * hour, "first", "a"),
+                      Booking(start + 2 * hour, start + 2.5 * hour, "second", "b"),
+                      Booking(start + 15.5 * hour, start + 16.5 * hour, "midnight", "c")],
+                "2": [Booking(start + 26 * hour, start + 27 * hour, "sunday", "d")],
+            }, [])
+            journal.start(start - 1)
+            replayJournal(journal, day, late=0.2)
+            journal.calendar(start + 4 * hour, True)
+            journal.calendar(start + 4.5 * hour, True)
+            journal.calendar(start + 4.75 * hour, False)
+            assert sorted(os.listdir(folder)) == ["2026-01.jsonl", "2026-02.jsonl"], os.listdir(folder)
+            # a line cut by a power failure, then a restart by the supervisor and its first decision
+            with open(os.path.join(folder, "2026-02.jsonl"), "a") as file:
+                file.write('{"time":17')
+            journal.start(start + 31 * hour, "heartbeat stalled for 45 s")
+            journal.transition(start + 31 * hour + 1, "1", DisplayState.padlock)
+            journal.transition(start + 31 * hour + 1, "2", DisplayState.padlock)
+
+            # the whole period: the end of booking messages and the back-to-back message are not booked time
+            end: float = datetime(2026, 2, 2).timestamp()
+            report: UsageReport = usageReport(start - 8 * hour, end, folder)
+            printReport(report)
+            bay1: BayUsage = report.bays["1"]
+            # the planned transitions are 0.2 s late
+            assert round(bay1.booked) == 1.5 * hour - 20 + hour, bay1.booked
+            assert round(bay1.seconds["hidden"]) == (1.5 * hour + 300 - 20) + (hour + 300), bay1.seconds
+            assert bay1.observed() == end - start - 1, bay1.observed()
+            assert bay1.sessions == 2 and bay1.backToBack == 1
+            assert round(report.bays["2"].booked) == hour and report.bays["2"].sessions == 1
+            assert sum(bay1.lateCounts) == 8 and round(bay1.lateTotal / 8, 3) == 0.2 and bay1.latePercentile(0.95) == 0.25
+            assert report.starts == 2 and report.restarts == 1 and report.skipped == 1
+            assert report.outages == 1 and report.outageSeconds == 0.75 * hour
+
+            # February only: the session over midnight is booked from midnight, its unlock was in January
+            report = usageReport(datetime(2026, 2, 1).timestamp(), end, folder)
+            assert round(report.bays["1"].booked) == 0.5 * hour and report.bays["1"].sessions == 0
+            assert round(report.bays["2"].booked) == hour and report.outages == 0 and report.starts == 1
+            assert report.bays["1"].observed() == 24 * hour - 1
+
+            # a period not over yet ends now
+            report = usageReport(datetime(2026, 2, 1).timestamp(), end, folder, now=start + 33 * hour)
+            assert report.bays["2"].observed() == 17 * hour - 1
+        finally:
+            shutil.rmtree(folder)
+
+        print("Usage journal test finished.")
+        print()
+        sys.exit(0)
+
+    try:
+        to: datetime = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else datetime.now()
+        since: datetime = (datetime.fromisoformat(sys.argv[1]) if len(sys.argv) > 1
+                           else to - timedelta(days=DEFAULT_REPORT_DAYS))
+    except ValueError as e:
+        print(f"Invalid date: {e}")
+        sys.exit(1)
+    printReport(usageReport(since.timestamp(), to.timestamp()))
@@ -3,7 +3,8 @@ import win32gui
 import win32con
 import win32api
 import win32process
-from typing import List
+from typing import List, Optional
+from windowManager import Display, WindowManager
 
 
 def listWindows() -> None:
@@ -73,32 +74,57 @@ def forceForegroundWindow(hwnd: int, verbose: bool = False) -> None:
         print(f"Error in forceForegroundWindow: {e}")
 
 
-def ensureWindowOnTop(substring: str, verbose: bool = False) -> None:
+class Win32WindowManager(WindowManager):
     """
-    Uses pywin32 to set the target window(s) always on top and brings them to the foreground.
-
-    Args:
-        substring (str): The substring to search for in the window title (e.g. "Chrome").
-        verbose (bool): If True, prints debug information.
+    Windows backend: the kiosk windows are set topmost and forced to the foreground with pywin32.
     """
-    try:
-        hwndList: List[int] = findWindowBySubstring(substring)
-        for hwnd in hwndList:
-            if hwnd:
-                if verbose:
-                    print(f"{substring} window found: {hwnd}")
-                # Set the window as topmost without moving/resizing it.
-                win32gui.SetWindowPos(hwnd, win32con.HWND_TOPMOST,
-                                      0, 0, 0, 0,
-                                      win32con.SWP_NOMOVE | win32con.SWP_NOSIZE)
-                # Restore the window if minimized.
-                win32gui.ShowWindow(hwnd, win32con.SW_RESTORE)
-                # Force the window to the foreground.
-                forceForegroundWindow(hwnd, verbose)
-            else:
-                print("Chrome window not found.")
-    except Exception as e:
-        print(f"Unable to set Chrome on top: {e}")
+
+    def findWindows(self, substring: str) -> List[int]:
+        return findWindowBySubstring(substring)
+
+    def windowTitle(self, handle: int) -> Optional[str]:
+        if not win32gui.IsWindow(handle):
+            return None
+        return win32gui.GetWindowText(handle)
+
+    def activeWindow(self) -> Optional[int]:
+        return win32gui.GetForegroundWindow() or None
+
+    def isOnTop(self, handle: int) -> bool:
+        topmost: bool = bool(win32gui.GetWindowLong(handle, win32con.GWL_EXSTYLE) & win32con.WS_EX_TOPMOST)
+        return topmost and bool(win32gui.IsWindowVisible(handle)) and not win32gui.IsIconic(handle)
+
+    def raiseWindow(self, handle: int, verbose: bool = False) -> None:
+        """
+        Sets the window always on top and brings it to the foreground.
+        """
+        # Set the window as topmost without moving/resizing it.
+        win32gui.SetWindowPos(handle, win32con.HWND_TOPMOST,
+                              0, 0, 0, 0,
+                              win32con.SWP_NOMOVE | win32con.SWP_NOSIZE)
+        # Restore the window if minimized.
+        win32gui.ShowWindow(handle, win32con.SW_RESTORE)
+        # Force the window to the foreground.
+        forceForegroundWindow(handle, verbose)
+
+    def minimizeWindow(self, handle: int, verbose: bool = False) -> None:
+        """
+        Removes the topmost flag of the window and minimizes it.
+        """
+        win32gui.SetWindowPos(handle, win32con.HWND_NOTOPMOST,
+                              0, 0, 0, 0,
+                              win32con.SWP_NOMOVE | win32con.SWP_NOSIZE)
+        win32gui.ShowWindow(handle, win32con.SW_MINIMIZE)
+
+    def displays(self) -> List[Display]:
+        """
+        The monitors of the virtual screen, negative left of or above the primary monitor.
+        """
+        displays: List[Display] = []
+        for monitor, _, (left, top, right, bottom) in win32api.EnumDisplayMonitors(None, None):
+            primary: bool = bool(win32api.GetMonitorInfo(monitor)["Flags"] & win32con.MONITORINFOF_PRIMARY)
+            displays.append(Display(left, top, right - left, bottom - top, primary))
+        return displays
 
 
 # test module
@@ -107,4 +133,5 @@ if __name__ == '__main__':
     listWindows()
     # Find and bring Chrome windows to the foreground.
     print(f"Chrome windows found: {findWindowBySubstring('Chrome')}")
-    ensureWindowOnTop("Chrome", verbose=True)
+    print(f"Displays: {Win32WindowManager().displays()}")
+    Win32WindowManager().ensureOnTop("Chrome", verbose=True)
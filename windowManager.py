@@ -0,0 +1,429 @@
+"""
+This module keeps the kiosk windows on top of everything, or minimized, whatever
+the platform: the Windows (pywin32) and X11 (EWMH) backends only provide the
+window primitives, the shared logic finds the kiosk windows once by title,
+caches their handles, re-checks them cheaply and re-raises them only when they
+lost the focus or the top.
+The backends also list the displays: the window positions given as "auto" or "@n"
+in the configuration are resolved to the origin of the displays found.
+A fake backend keeps windows in memory for the tests and the machines without a display.
+"""
+
+import os
+import abc
+import sys
+import time
+import threading
+from typing import NamedTuple, Optional
+from config import AUTO_POSITIONS, DISPLAY_POSITION_PREFIX, Config
+
+# window_manager values of the configuration
+AUTO_BACKEND = "auto"
+WIN32_BACKEND = "win32"
+X11_BACKEND = "x11"
+FAKE_BACKEND = "none"
+# seconds between two enumerations while waiting for launched windows
+READY_POLL_INTERVAL = 0.1
+
+
+class Display(NamedTuple):
+    x: int  # virtual desktop coordinates: negative left of or above the primary display
+    y: int
+    width: int
+    height: int
+    primary: bool
+
+
+class WindowManager(abc.ABC):
+    """
+    Cached kiosk window handles by title substring, and the backend primitives to implement.
+    """
+
+    def __init__(self):
+        self.handles: dict[str, list[int]] = {}
+        self.enumerations: int = 0
+        self.raises: int = 0
+        self.lock: threading.RLock = threading.RLock()
+
+    # backend primitives
+
+    @abc.abstractmethod
+    def findWindows(self, substring: str) -> list[int]:
+        """
+        Enumerate the top-level windows whose title contains the substring (case insensitive).
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def windowTitle(self, handle: int) -> Optional[str]:
+        """
+        The title of the window, None if it no longer exists.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def activeWindow(self) -> Optional[int]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def isOnTop(self, handle: int) -> bool:
+        """
+        True if the window is shown and still above the other windows.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def raiseWindow(self, handle: int, verbose: bool = False) -> None:
+        """
+        Show the window above every other window and give it the focus.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def minimizeWindow(self, handle: int, verbose: bool = False) -> None:
+        """
+        Remove the window from the top and minimize it.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def displays(self) -> list[Display]:
+        """
+        The displays of the desktop, in any order.
+        """
+        raise NotImplementedError
+
+    # cached operations
+
+    def windows(self, substring: str) -> list[int]:
+        """
+        The windows matching the substring: the cached handles if they still exist with a matching title,
+        otherwise enumerated again.
+        """
+        with self.lock:
+            cached: Optional[list[int]] = self.handles.get(substring)
+            if cached and all(substring.lower() in (self.windowTitle(handle) or "").lower() for handle in cached):
+                return cached
+            self.enumerations += 1
+            self.handles[substring] = self.findWindows(substring)
+            return self.handles[substring]
+
+    def forget(self, substring: str) -> None:
+        """
+        Enumerate the windows again on the next call, e.g. after (re)launching some of them.
+        """
+        with self.lock:
+            self.handles.pop(substring, None)
+
+    def waitForWindows(self, substring: str, count: int, timeout: float) -> bool:
+        """
+        Wait until at least count windows match the substring, e.g. after launching them.
+        Returns False if they are not all shown within timeout seconds.
+        """
+        deadline: float = time.monotonic() + timeout
+        while True:
+            self.forget(substring)
+            if len(self.windows(substring)) >= count:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(READY_POLL_INTERVAL)
+
+    def ensureOnTop(self, substring: str, verbose: bool = False) -> None:
+        """
+        Make sure the windows matching the substring are on top. They are raised again only if one of
+        them was minimized or covered, or if the focus went to a window which is not a kiosk window.
+        """
+        try:
+            with self.lock:
+                handles: list[int] = self.windows(substring)
+                if not handles:
+                    if verbose:
+                        print(f"{substring} window not found.")
+                    return
+                kioskWindows: set[int] = {handle for cached in self.handles.values() for handle in cached}
+                focusLost: bool = self.activeWindow() not in kioskWindows
+                for handle in handles:
+                    if focusLost or not self.isOnTop(handle):
+                        if verbose:
+                            print(f"{substring} window {handle} not on top. Raising it.")
+                        self.raiseWindow(handle, verbose)
+                        self.raises += 1
+        except Exception as e:
+            print(f"Unable to set {substring} on top: {e}")
+
+    def minimize(self, substring: str, verbose: bool = False) -> None:
+        """
+        Minimize the windows matching the substring.
+        """
+        try:
+            with self.lock:
+                for handle in self.windows(substring):
+                    if verbose:
+                        print(f"Minimizing {substring} window: {handle}")
+                    self.minimizeWindow(handle, verbose)
+        except Exception as e:
+            print(f"Unable to minimize {substring}: {e}")
+
+
+class FakeWindow:
+    def __init__(self, title: str):
+        self.title: str = title
+        self.onTop: bool = False
+        self.minimized: bool = False
+
+
+class FakeWindowManager(WindowManager):
+    """
+    Windows kept in memory: nothing is displayed. Tests open, close and focus windows by hand.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.fakeWindows: dict[int, FakeWindow] = {}
+        self.active: Optional[int] = None
+        self.nextHandle: int = 1
+        self.fakeDisplays: list[Display] = [Display(0, 0, 1920, 1080, True)]
+
+    def openWindow(self, title: str) -> int:
+        with self.lock:
+            handle: int = self.nextHandle
+            self.nextHandle += 1
+            self.fakeWindows[handle] = FakeWindow(title)
+            return handle
+
+    def closeWindow(self, handle: int) -> None:
+        with self.lock:
+            del self.fakeWindows[handle]
+            if self.active == handle:
+                self.active = None
+
+    def focus(self, handle: int) -> None:
+        """
+        Another window takes the focus and the top, e.g. a user opening an application.
+        """
+        with self.lock:
+            self.active = handle
+            for other, window in self.fakeWindows.items():
+                window.onTop = other == handle
+
+    def findWindows(self, substring: str) -> list[int]:
+        return [handle for handle, window in self.fakeWindows.items() if substring.lower() in window.title.lower()]
+
+    def windowTitle(self, handle: int) -> Optional[str]:
+        window: Optional[FakeWindow] = self.fakeWindows.get(handle)
+        return window.title if window is not None else None
+
+    def activeWindow(self) -> Optional[int]:
+        return self.active
+
+    def isOnTop(self, handle: int) -> bool:
+        window: FakeWindow = self.fakeWindows[handle]
+        return window.onTop and not window.minimized
+
+    def raiseWindow(self, handle: int, verbose: bool = False) -> None:
+        window: FakeWindow = self.fakeWindows[handle]
+        window.onTop, window.minimized = True, False
+        self.active = handle
+
+    def minimizeWindow(self, handle: int, verbose: bool = False) -> None:
+        window: FakeWindow = self.fakeWindows[handle]
+        window.onTop, window.minimized = False, True
+        if self.active == handle:
+            self.active = None
+
+    def displays(self) -> list[Display]:
+        return list(self.fakeDisplays)
+
+
+def createWindowManager(backend: str = AUTO_BACKEND) -> WindowManager:
+    """
+    The window manager backend: pywin32 on Windows, X11 when a display is set, otherwise the fake one.
+    The backends are imported here only: the daemon imports on any platform.
+    """
+    if backend == AUTO_BACKEND:
+        if sys.platform == "win32":
+            backend = WIN32_BACKEND
+        elif os.environ.get("DISPLAY"):
+            backend = X11_BACKEND
+        else:
+            print("No display found, the kiosk windows are not managed.")
+            backend = FAKE_BACKEND
+
+    if backend == WIN32_BACKEND:
+        from win32 import Win32WindowManager
+        return Win32WindowManager()
+    if backend == X11_BACKEND:
+        from x11 import X11WindowManager
+        return X11WindowManager()
+    if backend == FAKE_BACKEND:
+        return FakeWindowManager()
+    raise ValueError(f"Unknown window manager backend: {backend}")
+
+
+windowManager: Optional[WindowManager] = None
+
+
+def getWindowManager(cfg: Config) -> WindowManager:
+    """
+    The window manager of the daemon, created on first use from the configuration.
+    """
+    global windowManager
+
+    if windowManager is None:
+        windowManager = createWindowManager(cfg.windowManager)
+    return windowManager
+
+
+def resetWindowManager() -> None:
+    """
+    Create the window manager again on next use, e.g. when the configuration selects another backend.
+    """
+    global windowManager
+
+    windowManager = None
+
+
+def orderedDisplays(displays: list[Display]) -> list[Display]:
+    """
+    The primary display first (@1), then the others from left to right and top to bottom.
+    """
+    return sorted(displays, key=lambda display: (not display.primary, display.x, display.y))
+
+
+def resolveWindowPositions(cfg: Config) -> None:
+    """
+    Replace the window positions referring to the displays by the origin of the displays found:
+    "auto" opens a window on every display, "@n" on the nth display. A display not found, or
+    not listed by the backend, gets the default position.
+    """
+    if not any(position == AUTO_POSITIONS or position.startswith(DISPLAY_POSITION_PREFIX)
+               for bay in cfg.bays for position in bay.windowPositions):
+        return
+    displays: list[Display] = []
+    try:
+        displays = orderedDisplays(getWindowManager(cfg).displays())
+    except Exception as e:
+        print(f"Error listing the displays: {e}")
+
+    for bay in cfg.bays:
+        positions: list[str] = []
+        for position in bay.windowPositions:
+            if position == AUTO_POSITIONS:
+                positions += [f"{display.x},{display.y}" for display in displays] or [""]
+            elif position.startswith(DISPLAY_POSITION_PREFIX):
+                index: int = int(position[len(DISPLAY_POSITION_PREFIX):]) - 1
+                if 0 <= index < len(displays):
+                    positions.append(f"{displays[index].x},{displays[index].y}")
+                else:
+                    print(f"Display {position} of bay {bay.name} not found, its window opens at the default position.")
+                    positions.append("")
+            else:
+                positions.append(position)
+        bay.windowPositions = positions
+    if (cfg.verbose):
+        print(f"Displays: {', '.join(f'{d.width}x{d.height} at {d.x},{d.y}' for d in displays) or 'none found'}")
+
+
+def benchmark() -> None:
+    """
+    Compare the former enumeration and raise on every call with the cached handles,
+    on the fake backend with 300 other windows.
+    """
+    import timeit
+
+    manager = FakeWindowManager()
+    for index in range(300):
+        manager.openWindow(f"Window {index}")
+    manager.openWindow("Screen Blocker - Google Chrome")
+    manager.openWindow("Screen Blocker - Google Chrome")
+    calls = 2000
+
+    def former() -> None:
+        for handle in manager.findWindows("Google Chrome"):
+            manager.raiseWindow(handle)
+    cachedTime = timeit.timeit(lambda: manager.ensureOnTop("Google Chrome"), number=calls) / calls
+    formerTime = timeit.timeit(former, number=calls) / calls
+    print(f"Enumerate and raise: {formerTime * 1e6:7.1f} us per call, {2 * calls} raises")
+    print(f"Cached handles     : {cachedTime * 1e6:7.1f} us per call, {manager.raises} raises, "
+          f"{manager.enumerations} enumerations")
+
+
+# test module
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "benchmark":
+        benchmark()
+        sys.exit(0)
+
+    if len(sys.argv) > 1:
+        # a real backend: list the displays, list and raise the given windows, e.g. python windowManager.py x11 Chrome
+        manager: WindowManager = createWindowManager(sys.argv[1])
+        for number, display in enumerate(orderedDisplays(manager.displays()), 1):
+            print(f"Display @{number}: {display.width}x{display.height} at {display.x},{display.y}"
+                  f"{' (primary)' if display.primary else ''}")
+        print(f"Windows found: {manager.windows(sys.argv[2])}")
+        manager.ensureOnTop(sys.argv[2], verbose=True)
+        sys.exit(0)
+
+    fake = FakeWindowManager()
+    other = fake.openWindow("Notepad")
+    left = fake.openWindow("Screen Blocker [1] - Google Chrome")
+    right = fake.openWindow("Screen Blocker [1] - Google Chrome")
+    bay2 = fake.openWindow("Screen Blocker [2] - Google Chrome")
+
+    # found once, raised once, then only checked
+    for _ in range(10):
+        fake.ensureOnTop("[1]")
+    assert fake.windows("[1]") == [left, right]
+    assert fake.enumerations == 1 and fake.raises == 2
+    assert fake.activeWindow() in (left, right)
+
+    # the other bay taking the focus is not a focus loss, another application is
+    fake.ensureOnTop("[2]")
+    raises = fake.raises
+    fake.ensureOnTop("[1]")
+    assert fake.raises == raises
+    fake.focus(other)
+    fake.ensureOnTop("[1]")
+    assert fake.raises == raises + 2 and fake.isOnTop(left) and fake.isOnTop(right)
+
+    # a closed window is noticed, the relaunched one is found by a new enumeration
+    fake.closeWindow(right)
+    relaunched = fake.openWindow("Screen Blocker [1] - Google Chrome")
+    fake.ensureOnTop("[1]")
+    assert fake.windows("[1]") == [left, relaunched] and fake.isOnTop(relaunched)
+    assert fake.enumerations == 3
+
+    fake.minimize("[1]")
+    assert not fake.isOnTop(left)
+    fake.ensureOnTop("[1]")
+    assert fake.isOnTop(left)
+
+    # a new window with the same title is only seen after forget()
+    extra = fake.openWindow("Screen Blocker [1] - Google Chrome")
+    fake.forget("[1]")
+    assert fake.windows("[1]") == [left, relaunched, extra]
+
+    # waiting for launched windows: as soon as they are shown, or False at the timeout
+    threading.Timer(0.3, lambda: fake.openWindow("Screen Blocker [3] - Google Chrome")).start()
+    started = time.monotonic()
+    assert fake.waitForWindows("[3]", 1, 5)
+    assert 0.3 <= time.monotonic() - started < 1
+    assert not fake.waitForWindows("[3]", 2, 0.2)
+
+    # window positions from the displays: a second display left of the primary one, a third one above
+    from config import BayConfig
+    # the window manager of the daemon (see getWindowManager)
+    windowManager = FakeWindowManager()
+    windowManager.fakeDisplays = [Display(-1920, 0, 1920, 1080, False), Display(0, 0, 2560, 1440, True),
+                                  Display(0, -1080, 1920, 1080, False)]
+    cfg = Config(windowManager=FAKE_BACKEND, bays=[BayConfig("1", "one", [AUTO_POSITIONS]),
+                                                   BayConfig("2", "two", ["@2", "100,-50", "@4"])])
+    resolveWindowPositions(cfg)
+    assert cfg.bays[0].windowPositions == ["0,0", "-1920,0", "0,-1080"], cfg.bays[0].windowPositions
+    assert cfg.bays[1].windowPositions == ["-1920,0", "100,-50", ""], cfg.bays[1].windowPositions
+    resetWindowManager()
+
+    assert isinstance(createWindowManager(FAKE_BACKEND), FakeWindowManager)
+    print("Window manager test finished.")
+    print()
@@ -0,0 +1,151 @@
+"""
+X11 backend of the window manager, with python-xlib: the kiosk windows are kept
+above the others through the EWMH hints of the window manager (_NET_WM_STATE_ABOVE,
+_NET_ACTIVE_WINDOW). Without an EWMH window manager (e.g. a bare Xvfb), the
+windows are restacked and focused directly.
+"""
+
+from typing import Any, Optional
+from Xlib import X, display, error, protocol
+from windowManager import Display, WindowManager
+
+# _NET_WM_STATE client message actions
+STATE_REMOVE = 0
+STATE_ADD = 1
+# source indication of the EWMH client messages: a pager (obeyed more than an application)
+SOURCE_PAGER = 2
+# WM_CHANGE_STATE argument minimizing a window
+ICONIC_STATE = 3
+
+ATOM_NAMES = (
+    "_NET_SUPPORTING_WM_CHECK", "_NET_CLIENT_LIST", "_NET_ACTIVE_WINDOW", "_NET_WM_NAME", "UTF8_STRING",
+    "_NET_WM_STATE", "_NET_WM_STATE_ABOVE", "_NET_WM_STATE_HIDDEN", "WM_CHANGE_STATE",
+)
+
+
+class X11WindowManager(WindowManager):
+    """
+    X11 backend, for Linux (and the tests under Xvfb).
+    """
+
+    def __init__(self, displayName: Optional[str] = None):
+        super().__init__()
+        self.display: Any = display.Display(displayName)
+        self.root: Any = self.display.screen().root
+        self.atoms: dict[str, int] = {name: self.display.intern_atom(name) for name in ATOM_NAMES}
+        self.ewmh: bool = self.rootProperty("_NET_SUPPORTING_WM_CHECK") is not None
+
+    def rootProperty(self, name: str) -> Optional[list[int]]:
+        prop: Any = self.root.get_full_property(self.atoms[name], X.AnyPropertyType)
+        return list(prop.value) if prop is not None else None
+
+    def window(self, handle: int) -> Any:
+        return self.display.create_resource_object("window", handle)
+
+    def topLevelWindows(self) -> list[int]:
+        """
+        The client windows managed by the window manager, or the children of the root window, bottom to top.
+        """
+        clients: Optional[list[int]] = self.rootProperty("_NET_CLIENT_LIST") if self.ewmh else None
+        if clients is not None:
+            return clients
+        return [child.id for child in self.root.query_tree().children]
+
+    def windowState(self, handle: int) -> list[int]:
+        prop: Any = self.window(handle).get_full_property(self.atoms["_NET_WM_STATE"], X.AnyPropertyType)
+        return list(prop.value) if prop is not None else []
+
+    def sendMessage(self, handle: int, messageType: str, data: list[int]) -> None:
+        """
+        Ask the window manager to change a window (EWMH client message sent to the root window).
+        """
+        event = protocol.event.ClientMessage(
+            window=self.window(handle), client_type=self.atoms[messageType], data=(32, (data + [0] * 5)[:5]))
+        self.root.send_event(event, event_mask=X.SubstructureRedirectMask | X.SubstructureNotifyMask)
+
+    def findWindows(self, substring: str) -> list[int]:
+        return [
+            handle for handle in self.topLevelWindows() if substring.lower() in (self.windowTitle(handle) or "").lower()
+        ]
+
+    def windowTitle(self, handle: int) -> Optional[str]:
+        try:
+            window: Any = self.window(handle)
+            prop: Any = window.get_full_property(self.atoms["_NET_WM_NAME"], self.atoms["UTF8_STRING"])
+            if prop is not None:
+                return prop.value.decode("utf-8", "replace") if isinstance(prop.value, bytes) else str(prop.value)
+            name: Any = window.get_wm_name()
+            return name if isinstance(name, str) else ""
+        except (error.BadWindow, error.BadDrawable):
+            return None
+
+    def activeWindow(self) -> Optional[int]:
+        if self.ewmh:
+            active: Optional[list[int]] = self.rootProperty("_NET_ACTIVE_WINDOW")
+            return active[0] if active else None
+        focus: Any = self.display.get_input_focus().focus
+        return focus.id if hasattr(focus, "id") else None
+
+    def isOnTop(self, handle: int) -> bool:
+        if self.window(handle).get_attributes().map_state != X.IsViewable:
+            return False
+        if self.ewmh:
+            state: list[int] = self.windowState(handle)
+            return self.atoms["_NET_WM_STATE_ABOVE"] in state and self.atoms["_NET_WM_STATE_HIDDEN"] not in state
+        # no window manager: only kiosk windows may be stacked above the window
+        children: list[int] = self.topLevelWindows()
+        if handle not in children:
+            return False
+        kioskWindows: set[int] = {kiosk for cached in self.handles.values() for kiosk in cached}
+        return all(child in kioskWindows for child in children[children.index(handle) + 1:])
+
+    def raiseWindow(self, handle: int, verbose: bool = False) -> None:
+        window: Any = self.window(handle)
+        window.map()
+        if self.ewmh:
+            self.sendMessage(handle, "_NET_WM_STATE", [STATE_ADD, self.atoms["_NET_WM_STATE_ABOVE"], 0, SOURCE_PAGER])
+            self.sendMessage(handle, "_NET_ACTIVE_WINDOW", [SOURCE_PAGER, X.CurrentTime])
+        else:
+            window.configure(stack_mode=X.Above)
+            self.display.set_input_focus(window, X.RevertToParent, X.CurrentTime)
+        self.display.sync()
+
+    def minimizeWindow(self, handle: int, verbose: bool = False) -> None:
+        window: Any = self.window(handle)
+        if self.ewmh:
+            self.sendMessage(handle, "_NET_WM_STATE", [STATE_REMOVE, self.atoms["_NET_WM_STATE_ABOVE"], 0, SOURCE_PAGER])
+            self.sendMessage(handle, "WM_CHANGE_STATE", [ICONIC_STATE])
+        else:
+            window.configure(stack_mode=X.Below)
+        self.display.sync()
+
+    def displays(self) -> list[Display]:
+        """
+        The monitors of the RandR extension (1.5), or the whole screen without it (e.g. a bare Xvfb).
+        """
+        if self.display.has_extension("RANDR"):
+            try:
+                monitors: Any = self.root.xrandr_get_monitors(is_active=True).monitors
+                if monitors:
+                    return [Display(monitor.x, monitor.y, monitor.width_in_pixels, monitor.height_in_pixels,
+                                    bool(monitor.primary)) for monitor in monitors]
+            except error.XError:
+                pass
+        geometry: Any = self.root.get_geometry()
+        return [Display(0, 0, geometry.width, geometry.height, True)]
+
+
+# test module
+if __name__ == "__main__":
+    # under Xvfb: DISPLAY=:99 python x11.py, with a window titled "Screen Blocker" open
+    manager = X11WindowManager()
+    print(f"EWMH window manager: {manager.ewmh}")
+    handles = manager.windows("Screen Blocker")
+    print(f"Windows found: {[hex(handle) for handle in handles]}")
+    print(f"Displays: {manager.displays()}")
+    manager.ensureOnTop("Screen Blocker", verbose=True)
+    assert all(manager.isOnTop(handle) for handle in handles[-1:])
+    manager.ensureOnTop("Screen Blocker", verbose=True)
+    print(f"Enumerations: {manager.enumerations}, raises: {manager.raises}")
+    print("X11 window manager test finished.")
+    print()